@@ -0,0 +1,52 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""Helpers shared by the pySISF benchmarks."""
+from __future__ import annotations
+
+import resource
+import tracemalloc
+
+import numpy as np
+
+RESULTS = []
+
+
+def synthetic_volume(shape, dtype=np.uint16, seed=0):
+    """Smooth background plus sparse bright spots, roughly resembling light-sheet data."""
+    rng = np.random.default_rng(seed)
+    x, y, z = np.meshgrid(*(np.linspace(0, 1, s, dtype=np.float32) for s in shape), indexing="ij")
+    volume = 200 + 100 * np.sin(6 * x) * np.cos(4 * y) + 50 * z
+    volume += rng.normal(0, 10, size=shape).astype(np.float32)
+    spots = rng.random(shape) > 0.999
+    volume[spots] += 2000
+    return np.clip(volume, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def measure(benchmark, func, *args, nbytes=0, chunks=0, rounds=5, **kwargs):
+    """
+    Benchmarks `func` and records MB/s, chunks/s and memory usage in `benchmark.extra_info`.
+
+    Peak memory is measured in one extra, untimed call under `tracemalloc` (numpy reports its buffers to it).
+    Nothing is recorded with `--benchmark-disable`, which runs `func` once as a smoke test.
+    """
+    result = benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=rounds, iterations=1, warmup_rounds=1)
+    if benchmark.stats is None:
+        return result
+
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mean = benchmark.stats.stats.mean
+    if nbytes:
+        benchmark.extra_info["MB/s"] = nbytes / mean / 1e6
+    if chunks:
+        benchmark.extra_info["chunks/s"] = chunks / mean
+    benchmark.extra_info["peak_alloc_MB"] = peak / 1e6
+    benchmark.extra_info["peak_rss_MB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    RESULTS.append((benchmark.name, dict(benchmark.extra_info)))
+    return result
@@ -0,0 +1,51 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Shared fixtures and reporting for the pySISF benchmark suite.
+
+Run with `pytest benchmarks` (requires `pytest-benchmark`). Baselines are recorded locally in
+`benchmarks/baselines`, which is not tracked; see `docs/developer.md` for saving and comparing against them.
+"""
+from __future__ import annotations
+
+import pytest
+
+from bench_utils import RESULTS, synthetic_volume
+from pySISF import sisf
+
+
+@pytest.fixture(scope="session")
+def volume():
+    return synthetic_volume((256, 256, 64))
+
+
+@pytest.fixture(scope="session")
+def small_volume():
+    return synthetic_volume((128, 128, 40))
+
+
+@pytest.fixture(scope="session")
+def shard(tmp_path_factory, volume):
+    path = tmp_path_factory.mktemp("shard")
+    fname_data, fname_meta = str(path / "bench.data"), str(path / "bench.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (32, 32, 16), 1, progress=False)
+    return fname_data, fname_meta
+
+
+@pytest.fixture(scope="session")
+def archive(tmp_path_factory, volume):
+    fname = str(tmp_path_factory.mktemp("archive") / "bench")
+    sisf.create_sisf(fname, volume, (128, 128, 64), (32, 32, 16), (1, 1, 1), enable_status=False)
+    return fname
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+
+    terminalreporter.section("pySISF throughput")
+    for name, info in RESULTS:
+        fields = " ".join(f"{key}={value:,.1f}" for key, value in info.items())
+        terminalreporter.write_line(f"{name}: {fields}")
@@ -0,0 +1,109 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""Benchmarks for shard and archive reads with common access shapes."""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from bench_utils import measure
+from pySISF import sisf
+
+pytest.importorskip("pytest_benchmark")
+
+# Selections on the (256, 256, 64) benchmark volume
+ACCESS_SHAPES = {
+    "full": (slice(None), slice(None), slice(None)),
+    "xy_plane": (slice(None), slice(None), 31),
+    "xz_plane": (slice(None), 100, slice(None)),
+    "cube": (slice(64, 128), slice(64, 128), slice(16, 48)),
+    "point": (100, 100, 30),
+}
+
+
+def selection_size(volume, key):
+    return volume[key].size * volume.itemsize
+
+
+def touched_chunks(volume, key, chunk_size):
+    total = 1
+    for axis, (s, c) in enumerate(zip(key, chunk_size)):
+        if isinstance(s, int):
+            continue
+        start, stop, _ = s.indices(volume.shape[axis])
+        total *= (stop + c - 1) // c - start // c
+    return total
+
+
+@pytest.mark.parametrize("access", ACCESS_SHAPES)
+def test_sisf_chunk_getitem(benchmark, shard, volume, access):
+    key = ACCESS_SHAPES[access]
+    reader = sisf.sisf_chunk(*shard, cache_metadata=True)
+
+    out = measure(
+        benchmark,
+        reader.__getitem__,
+        key,
+        nbytes=selection_size(volume, key),
+        chunks=touched_chunks(volume, key, reader.chunk_size),
+    )
+    assert (np.squeeze(out) == volume[key]).all()
+
+
+@pytest.mark.parametrize("access", ACCESS_SHAPES)
+def test_sisf_getitem(benchmark, archive, volume, access):
+    key = ACCESS_SHAPES[access]
+    reader = sisf.sisf(archive, cache_metadata=True)
+
+    out = measure(
+        benchmark,
+        reader.__getitem__,
+        (0, *key),
+        nbytes=selection_size(volume, key),
+        chunks=touched_chunks(volume, key, (32, 32, 16)),
+    )
+    assert (np.squeeze(out) == volume[key]).all()
+
+
+@pytest.fixture(scope="session", params=["c", "morton", "hilbert"])
+def ordered_shard(request, tmp_path_factory, volume):
+    path = tmp_path_factory.mktemp(f"shard_{request.param}")
+    fname_data, fname_meta = str(path / "bench.data"), str(path / "bench.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (32, 32, 16), 1, progress=False, order=request.param)
+    return request.param, fname_data, fname_meta
+
+
+@pytest.mark.parametrize("access", ["cube", "xy_plane", "xz_plane"])
+def test_chunk_order_requests(benchmark, ordered_shard, volume, access):
+    """Reads with only exactly adjacent chunks merged, recording how many data-file requests each read needs."""
+    from pySISF import metrics, storage
+
+    order, fname_data, fname_meta = ordered_shard
+    key = ACCESS_SHAPES[access]
+    reader = sisf.sisf_chunk(fname_data, fname_meta, cache_metadata=True, storage=storage.LocalStorage(coalesce_gap=0))
+
+    metrics.reset()
+    with metrics.trace():
+        reader[key]
+    counters, stages = metrics.stats()["counters"], metrics.stats()["stages"]
+    metrics.reset()
+    benchmark.extra_info["read_requests"] = counters["read_requests"]
+    benchmark.extra_info["mean_request_KB"] = stages["read"]["bytes"] / counters["read_requests"] / 1e3
+
+    out = measure(benchmark, reader.__getitem__, key, nbytes=selection_size(volume, key))
+    assert (np.squeeze(out) == volume[key]).all()
+
+
+@pytest.mark.parametrize("compression", [1, 4])
+@pytest.mark.parametrize("access", ["xy_plane", "cube"])
+def test_plane_frames(benchmark, tmp_path, volume, compression, access):
+    """Compression 4 decodes only the z-planes a selection needs."""
+    key = ACCESS_SHAPES[access]
+    fname_data, fname_meta = str(tmp_path / "bench.data"), str(tmp_path / "bench.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (32, 32, 16), compression, progress=False)
+    reader = sisf.sisf_chunk(fname_data, fname_meta, cache_metadata=True)
+
+    out = measure(benchmark, reader.__getitem__, key, nbytes=selection_size(volume, key))
+    assert (np.squeeze(out) == volume[key]).all()
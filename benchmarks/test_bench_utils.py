@@ -0,0 +1,108 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""Benchmarks for metadata parsing, downsampling, the ffmpeg video codecs and cold-start imports."""
+from __future__ import annotations
+
+import os
+import shutil
+import struct
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from bench_utils import measure
+import pySISF
+from pySISF import sisf, sndif_utils, vidlib
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(scope="module", params=[10_000, 100_000])
+def large_meta(request, tmp_path_factory):
+    """Shard metadata with a large index table, written directly without any chunk data."""
+    chunk_count = request.param
+    size = (chunk_count * 8, 8, 8)
+
+    header = bytearray(
+        struct.pack(sisf.SHARD_HEADER_LAYOUT, sisf.CURRENT_VERSION, 1, 1, 1, 8, 8, 8, *size, 0, size[0], 0, 8, 0, 8)
+    )
+    header.extend(struct.pack(sisf.SHARD_HEADER_EXT_LAYOUT, 0))
+
+    table = np.zeros(chunk_count, dtype=[("offset", "<u8"), ("size", "<u4")])
+    table["size"] = 100
+    table["offset"] = np.arange(chunk_count) * 100
+
+    path = tmp_path_factory.mktemp("meta") / "large.meta"
+    path.write_bytes(bytes(header) + table.tobytes())
+    return str(path), chunk_count
+
+
+def test_parse_metadata(benchmark, large_meta):
+    fname_meta, chunk_count = large_meta
+    shard = measure(
+        benchmark, sisf.sisf_chunk, "unused.data", fname_meta, cache_metadata=True, chunks=chunk_count, rounds=3
+    )
+    assert len(shard.cache) == chunk_count
+
+
+def test_downsample(benchmark, volume):
+    out = np.zeros(tuple(max(1, s // 2) for s in volume.shape), dtype=volume.dtype)
+    sndif_utils.downsample(volume, out)  # compile outside of the timed region
+
+    measure(benchmark, sndif_utils.downsample, volume, out, nbytes=volume.nbytes)
+
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which(vidlib.ffmpeg_exe) is None, reason="ffmpeg executable not found")
+
+
+@requires_ffmpeg
+def test_vidlib_encode(benchmark, small_volume):
+    stack = small_volume[:32, :32, :]
+    measure(benchmark, vidlib.encode_stack, stack, nbytes=stack.nbytes, chunks=1)
+
+
+@requires_ffmpeg
+def test_vidlib_encode_batch(benchmark, small_volume):
+    stacks = [small_volume[i : i + 32, j : j + 32, :] for i in range(0, 128, 32) for j in range(0, 128, 32)]
+    nbytes = sum(stack.nbytes for stack in stacks)
+    measure(benchmark, vidlib.encode_stacks, stacks, nbytes=nbytes, chunks=len(stacks))
+
+
+@requires_ffmpeg
+def test_vidlib_decode_batch(benchmark, small_volume):
+    stacks = [small_volume[i : i + 32, j : j + 32, :] for i in range(0, 128, 32) for j in range(0, 128, 32)]
+    blobs = [vidlib.encode_stack(stack, header=True) for stack in stacks]
+
+    measure(
+        benchmark,
+        vidlib.decode_stacks,
+        blobs,
+        restore_dtype=True,
+        nbytes=sum(stack.nbytes for stack in stacks),
+        chunks=len(blobs),
+    )
+
+
+# Statements run in a fresh interpreter; the last one includes loading the cached numba kernel
+COLD_START = {
+    "interpreter": "pass",
+    "import_pySISF": "import pySISF",
+    "import_sisf": "import pySISF.sisf",
+    "first_downsample": (
+        "import numpy as np; from pySISF import sndif_utils; "
+        "sndif_utils.downsample(np.zeros((4, 4, 4), np.uint16), np.zeros((2, 2, 2), np.uint16))"
+    ),
+}
+
+
+@pytest.mark.parametrize("statement", COLD_START)
+def test_cold_start(benchmark, statement):
+    command = [sys.executable, "-c", COLD_START[statement]]
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(pySISF.__file__))}
+    subprocess.run(command, check=True, env=env)  # populate the numba cache outside of the timed region
+
+    measure(benchmark, subprocess.run, command, check=True, env=env, rounds=5)
@@ -0,0 +1,59 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""Benchmarks for shard creation."""
+from __future__ import annotations
+
+import pytest
+
+from bench_utils import measure
+from pySISF import sisf
+
+pytest.importorskip("pytest_benchmark")
+
+CHUNK_SIZE = (32, 32, 16)
+
+
+def count_chunks(shape, chunk_size):
+    total = 1
+    for s, c in zip(shape, chunk_size):
+        total *= (s + c - 1) // c
+    return total
+
+
+@pytest.mark.parametrize("thread_count", [1, 4, 8])
+@pytest.mark.parametrize("compression", [0, 1, 4])
+def test_create_shard(benchmark, tmp_path, volume, compression, thread_count):
+    measure(
+        benchmark,
+        sisf.create_shard,
+        str(tmp_path / "out.data"),
+        str(tmp_path / "out.meta"),
+        volume,
+        CHUNK_SIZE,
+        compression,
+        thread_count=thread_count,
+        progress=False,
+        nbytes=volume.nbytes,
+        chunks=count_chunks(volume.shape, CHUNK_SIZE),
+    )
+
+
+@pytest.mark.parametrize("thread_count", [1, 8])
+@pytest.mark.parametrize("compression", [2, 3])
+def test_create_shard_video(benchmark, tmp_path, small_volume, compression, thread_count):
+    measure(
+        benchmark,
+        sisf.create_shard,
+        str(tmp_path / "out.data"),
+        str(tmp_path / "out.meta"),
+        small_volume,
+        CHUNK_SIZE,
+        compression,
+        thread_count=thread_count,
+        progress=False,
+        nbytes=small_volume.nbytes,
+        chunks=count_chunks(small_volume.shape, CHUNK_SIZE),
+        rounds=2,
+    )
@@ -1,192 +1,375 @@
 import os
 import sys
 import time
-import subprocess
+import argparse
 import threading
-from pathlib import Path
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from concurrent.futures import ThreadPoolExecutor
 import zipfile
 
+# Peak RAM of one conversion relative to the uncompressed ZIP contents (full stack plus downsampled pyramid)
+DEFAULT_MEMORY_FACTOR = 1.5
+# Conversions of a file attempted when its worker dies, before giving up until the file changes
+MAX_ATTEMPTS = 3
 
-class FileChangeHandler(FileSystemEventHandler):
-    """Handles file system events and manages subprocess execution."""
+# Processor module, imported once per worker process by `init_worker`
+processor = None
 
-    def __init__(self, script_path, max_workers=4):
-        """
-        Initialize the file change handler.
 
-        Args:
-            script_path (str): Path to the Python script to run for each file change
-            max_workers (int): Maximum number of concurrent subprocesses (default: 4)
-        """
-        self.script_path = script_path
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.running_processes = {}  # Track running processes by file path
-        self.lock = threading.Lock()
+def init_worker(script_path):
+    """Import the processing script once, so each job does not pay for numba/h5ffmpeg/basicpy imports."""
+    global processor
+    spec = importlib.util.spec_from_file_location("sisf_processor", script_path)
+    processor = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(processor)
 
-    def on_modified(self, event):
-        """Handle file modification events."""
-        if not event.is_directory:
-            self.process_file(event.src_path, "modified")
 
-    def on_created(self, event):
-        """Handle file creation events."""
-        if not event.is_directory:
-            self.process_file(event.src_path, "created")
+def run_job(file_path):
+    """Runs in a worker process, returns the processing time in seconds."""
+    start = time.time()
+    processor.process_file(file_path)
+    return time.time() - start
 
-    def on_moved(self, event):
-        """Handle file move/rename events."""
-        if not event.is_directory:
-            # Cancel any existing process for the old path
-            self.cancel_process(event.src_path)
-            # Start new process for the new path
-            self.process_file(event.dest_path, "moved")
 
-    def on_deleted(self, event):
-        """Handle file deletion events."""
-        if not event.is_directory:
-            # Cancel any running process for the deleted file
-            self.cancel_process(event.src_path)
+def available_memory():
+    """Bytes of memory available for new work, as reported by the OS."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
 
-    def process_file(self, file_path, event_type):
+def process_memory(pid):
+    """Resident bytes of process `pid`, 0 if unknown."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def file_signature(file_path):
+    """(size, mtime) of a file, identifying one version of it."""
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime
+
+
+def estimate_job_memory(file_path, memory_factor=DEFAULT_MEMORY_FACTOR):
+    """Estimate the peak memory of converting `file_path` from the uncompressed size of its members."""
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        return int(memory_factor * sum(info.file_size for info in zip_ref.infolist()))
+
+
+class ConversionService(FileSystemEventHandler):
+    """
+    Watches for ZIP files and converts them in a persistent pool of worker processes.
+
+    File system events only mark a file as pending. A scheduler thread waits until a pending file's size and
+    modification time have been stable for `settle_seconds` and it opens as a valid ZIP, then admits it once
+    its estimated memory fits into the memory budget.
+
+    Converted files are remembered by path, size and mtime, so a new file written to the same path is converted
+    again, while failed files are forgotten and retried on their next change. Workers are replaced after
+    `tasks_per_child` files, and the whole pool is rebuilt if a worker dies (e.g. killed by the OOM killer); the
+    files running at that point are queued again, up to `MAX_ATTEMPTS` times.
+    """
+
+    def __init__(
+        self,
+        script_path,
+        max_workers=4,
+        settle_seconds=10.0,
+        poll_interval=1.0,
+        memory_limit=None,
+        memory_fraction=0.8,
+        memory_per_job=None,
+        tasks_per_child=16,
+    ):
         """
-        Process a file by running the specified script as a subprocess.
+        Initialize the conversion service.
 
         Args:
-            file_path (str): Path to the file that changed
-            event_type (str): Type of event (created, modified, moved)
+            script_path (str): Path to a Python script defining `process_file(file_path)`
+            max_workers (int): Number of persistent worker processes (default: 4)
+            settle_seconds (float): Time a file must be unchanged before it is considered complete
+            poll_interval (float): Seconds between scheduler passes
+            memory_limit (int): Fixed memory budget in bytes, default measured before each job with `memory_fraction`
+            memory_fraction (float): Fraction of the memory available to the workers used when `memory_limit` is not
+                given
+            memory_per_job (int): Fixed memory estimate per job in bytes, default estimated from the ZIP contents
+            tasks_per_child (int): Files converted by a worker process before it is replaced, which returns memory
+                leaked or fragmented by the processing script (Python 3.11+, default: 16)
         """
+        self.script_path = script_path
+        self.max_workers = max_workers
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.memory_limit = memory_limit
+        self.memory_fraction = memory_fraction
+        self.memory_per_job = memory_per_job
+        self.tasks_per_child = tasks_per_child
+        self.executor = self.create_executor()
 
-        # Skip temporary files and hidden files
-        skip_patterns = [
-            '.',  # Hidden files
-            '~',  # Temporary files
-            '.tmp',  # Temporary files
-            '.log',  # Log files
-            '.lock',  # Lock files
-            '__pycache__',  # Python cache
-            '.DS_Store',  # macOS system files
-        ]
-        if  any(file_path.startswith(pattern) or file_path.endswith(pattern) for pattern in skip_patterns) or '.zip' not in file_path:
-            return
-
+        self.lock = threading.Lock()
+        self.pending = {}  # file path -> (size, mtime, time of last change)
+        self.ready = []  # complete files waiting for admission, in arrival order
+        self.running = {}  # file path -> (future, executor, (size, mtime), reserved bytes)
+        self.finished = {}  # file path -> (size, mtime) of the converted version
+        self.attempts = {}  # file path -> ((size, mtime), conversions of that version started)
+        self.reserved = 0
+
+        self.total_bytes = 0
+        self.total_files = 0
+        self.started = time.time()
+
+        self.stopping = threading.Event()
+        self.scheduler = threading.Thread(target=self.schedule_loop, daemon=True)
+        self.scheduler.start()
+
+    def create_executor(self):
+        kwargs = {}
+        if sys.version_info >= (3, 11):
+            # Workers are then started with "spawn", which imports this script again without running `main`
+            kwargs["max_tasks_per_child"] = self.tasks_per_child
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=init_worker, initargs=(self.script_path,), **kwargs
+        )
+
+    def restart_executor(self, broken):
+        """Replaces the worker pool after one of its processes died, unless that was already done."""
         with self.lock:
-            # Cancel any existing process for this file
-            if file_path in self.running_processes:
-                print(f"Skip because already running for {file_path}")
+            if self.executor is not broken:
                 return
-            #print(f"Cancelling existing process for {file_path}")
-                #self.running_processes[file_path].cancel()
+            print("⚠ A worker process died, restarting the worker pool")
+            self.executor = self.create_executor()
 
-            # Submit new task to executor
-            future = self.executor.submit(self.run_script, file_path, event_type)
-            self.running_processes[file_path] = future
+        broken.shutdown(wait=False)
 
-            # Add callback to clean up completed processes
-            #future.add_done_callback(lambda f: self.cleanup_process(file_path, f))
-
-    def run_script(self, file_path, event_type):
+    def memory_budget(self):
         """
-        Run the specified Python script with the file path as an argument.
-
-        Args:
-            file_path (str): Path to the file that changed
-            event_type (str): Type of event that triggered this
+        Memory the running jobs may reserve: `memory_limit`, or `memory_fraction` of the memory available now plus
+        the memory already held by the workers, so that other programs' usage is taken into account.
         """
-        print(f"Processing {event_type} file: {file_path}")
-        process = None
+        if self.memory_limit:
+            return self.memory_limit
 
-        try:
-            if not zipfile.is_zipfile(file_path):
-                raise ValueError(f"not a valid zip file.")
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                # Check the namelist because that tells if the zip is corrupt
-                zip_ref.namelist()
-        except Exception as e:
-            print(f"Skipping processing {file_path} because it failed the zip check")
-            self.cleanup_process(file_path)
+        held = sum(process_memory(process.pid) for process in multiprocessing.active_children())
+        return int(self.memory_fraction * (available_memory() + held))
+
+    @staticmethod
+    def should_skip(file_path):
+        # Skip temporary files and hidden files
+        name = os.path.basename(file_path)
+        skip_patterns = ['.', '~', '.tmp', '.log', '.lock', '__pycache__', '.DS_Store']
+        return any(name.startswith(p) or name.endswith(p) for p in skip_patterns) or not name.endswith('.zip')
+
+    def touch(self, file_path):
+        """Record activity on a file, restarting its settle timer."""
+        if self.should_skip(file_path):
             return
 
         try:
-            # Run the script with the file path as an argument
-            cmd = [sys.executable, self.script_path, file_path]
-
-            # Start the subprocess
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, #subprocess.PIPE,
-                text=True
-            )
-
-            # Wait for completion and capture output
-            stdout, stderr = process.communicate()
-
-            if process.returncode == 0:
-                print(f"✓ Successfully processed {file_path}")
-            else:
-                print(f"✗ Error processing {file_path} (exit code: {process.returncode})")
+            signature = file_signature(file_path)
+        except OSError:
+            return
 
-            if stdout.strip():
-                print(f"STDOUT:\n", stdout.strip())
-            if stderr.strip():
-                print(f"STDERR:\n", stderr.strip())
+        with self.lock:
+            if file_path in self.running or self.finished.get(file_path) == signature:
+                return
+            self.pending[file_path] = (None, None, time.time())
 
-        except subprocess.TimeoutExpired:
-            print(f"⚠ Timeout processing {file_path}")
-            if process:
-                process.kill()
-        except Exception as e:
-            if process:
-                process.kill()
-            print(f"✗ Exception processing {file_path}: {e}")
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
 
-        self.cleanup_process(file_path)
+    def on_created(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
 
-    def cancel_process(self, file_path):
-        """
-        Cancel a running process for a specific file.
-        """
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.forget(event.src_path)
+            self.touch(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.forget(event.src_path)
+
+    def forget(self, file_path):
         with self.lock:
-            if file_path in self.running_processes:
-                future = self.running_processes[file_path]
-                future.cancel()
-                del self.running_processes[file_path]
+            self.pending.pop(file_path, None)
+            self.finished.pop(file_path, None)
+            self.attempts.pop(file_path, None)
+            if file_path in self.ready:
+                self.ready.remove(file_path)
+
+    def check_settled(self):
+        """Move files whose size and mtime stopped changing, and which are valid ZIPs, to the ready queue."""
+        now = time.time()
 
-    def cleanup_process(self, file_path):
-        """
-        Clean up completed process from tracking dictionary.
-        """
-        #print("cleaning... ")
         with self.lock:
-            if file_path in self.running_processes:
-                del self.running_processes[file_path]
+            pending = list(self.pending.items())
+
+        for file_path, (size, mtime, changed) in pending:
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                self.forget(file_path)
+                continue
+
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                with self.lock:
+                    if file_path in self.pending:
+                        self.pending[file_path] = (st.st_size, st.st_mtime, now)
+                continue
+
+            if now - changed < self.settle_seconds:
+                continue
+
+            try:
+                with zipfile.ZipFile(file_path, 'r') as zip_ref:
+                    # Check the namelist because that tells if the zip is corrupt
+                    zip_ref.namelist()
+            except (zipfile.BadZipFile, OSError):
+                # Probably still being written, check again after another settle period
+                with self.lock:
+                    if file_path in self.pending:
+                        self.pending[file_path] = (st.st_size, st.st_mtime, now)
+                continue
+
+            with self.lock:
+                if self.pending.pop(file_path, None) is not None:
+                    self.ready.append(file_path)
+
+    def admit(self):
+        """Submit ready files while their estimated memory fits into the budget."""
+        while True:
+            with self.lock:
+                if not self.ready or len(self.running) >= self.max_workers:
+                    return
+                file_path = self.ready[0]
+
+            try:
+                need = self.memory_per_job or estimate_job_memory(file_path)
+                signature = file_signature(file_path)
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"✗ Skipping {file_path}: {e}")
+                self.forget(file_path)
+                continue
+
+            # Measured for each job, as the memory available changes with the workers and other programs
+            budget = self.memory_budget()
+            free = available_memory()
+
+            with self.lock:
+                # Always allow one job, even if it is larger than the budget, so large files are not starved
+                if self.running and (self.reserved + need > budget or need > free):
+                    return
+
+                executor = self.executor
+                try:
+                    future = executor.submit(run_job, file_path)
+                except BrokenProcessPool:
+                    future = None
+                else:
+                    self.ready.pop(0)
+                    self.reserved += need
+                    self.running[file_path] = (future, executor, signature, need)
+                    previous, count = self.attempts.get(file_path, (None, 0))
+                    self.attempts[file_path] = (signature, count + 1 if previous == signature else 1)
+
+            if future is None:
+                self.restart_executor(executor)
+                continue
+
+            print(f"Processing {file_path} (~{need / 2**30:.1f} GiB reserved, {self.reserved / 2**30:.1f} GiB total)")
+            future.add_done_callback(lambda f, file_path=file_path: self.complete(file_path, f))
+
+    def complete(self, file_path, future):
+        with self.lock:
+            _, executor, signature, need = self.running.pop(file_path)
+            self.reserved -= need
+
+        try:
+            elapsed = future.result()
+        except BrokenProcessPool:
+            self.restart_executor(executor)
+            with self.lock:
+                attempts = self.attempts.get(file_path, (None, 0))[1]
+                if attempts < MAX_ATTEMPTS:
+                    self.pending[file_path] = (None, None, time.time())
+            if attempts < MAX_ATTEMPTS:
+                print(f"✗ Worker died while processing {file_path}, retrying (attempt {attempts + 1}/{MAX_ATTEMPTS})")
+            else:
+                print(f"✗ Worker died while processing {file_path}, giving up until the file changes")
+            return
+        except Exception as e:
+            # Not remembered as finished, so the file is converted again once it is modified or replaced
+            print(f"✗ Error processing {file_path}: {e}")
+            return
+
+        input_bytes = signature[0]
+        with self.lock:
+            self.finished[file_path] = signature
+            self.attempts.pop(file_path, None)
+            self.total_bytes += input_bytes
+            self.total_files += 1
+            overall = self.total_bytes / max(time.time() - self.started, 1e-9)
+
+        print(
+            f"✓ Successfully processed {file_path} in {elapsed:.1f}s "
+            f"({input_bytes / max(elapsed, 1e-9) / 1e6:.1f} MB/s, "
+            f"{self.total_files} files at {overall / 1e6:.1f} MB/s overall)"
+        )
+
+    def schedule_loop(self):
+        while not self.stopping.wait(self.poll_interval):
+            try:
+                self.check_settled()
+                self.admit()
+            except Exception as e:
+                print(f"⚠ Scheduler error: {e}")
+
+    def scan(self, folder):
+        """Pick up ZIP files which already exist in `folder`."""
+        for root, _, files in os.walk(folder):
+            for name in files:
+                self.touch(os.path.join(root, name))
 
     def shutdown(self):
-        """Shutdown the thread pool executor and cancel pending tasks."""
+        """Stop scheduling new files and wait for running conversions."""
         print("Shutting down watchdog...")
+        self.stopping.set()
+        self.scheduler.join()
         self.executor.shutdown(wait=True)
 
 
 def main():
     """Main function to set up and run the folder watchdog."""
-    if len(sys.argv) < 3:
-        print("Usage: python folder_watchdog.py <folder_to_watch> <script_to_run>")
-        print("Example: python folder_watchdog.py /path/to/watch process_file.py")
-        sys.exit(1)
-
-    watch_folder = sys.argv[1]
-    script_to_run = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Convert ZIP files appearing in a folder with a persistent worker pool.")
+    parser.add_argument("watch_folder", help="folder to watch")
+    parser.add_argument("script_to_run", help="script defining process_file(file_path), e.g. process_file.py")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--settle", type=float, default=10.0, help="seconds a file must be unchanged before processing")
+    parser.add_argument("--memory-limit-gb", type=float, default=None, help="memory budget for running jobs")
+    parser.add_argument("--memory-per-job-gb", type=float, default=None, help="override the per-job memory estimate")
+    parser.add_argument("--tasks-per-child", type=int, default=16, help="files converted before a worker is replaced")
+    args = parser.parse_args()
+
+    watch_folder = args.watch_folder
+    script_to_run = args.script_to_run
 
     # Validate inputs
-    if not os.path.exists(watch_folder):
-        print(f"Error: Watch folder does not exist: {watch_folder}")
-        sys.exit(1)
-
     if not os.path.isdir(watch_folder):
-        print(f"Error: Watch path is not a directory: {watch_folder}")
+        print(f"Error: Watch folder does not exist or is not a directory: {watch_folder}")
         sys.exit(1)
 
     if not os.path.exists(script_to_run):
@@ -197,17 +380,24 @@ def main():
     watch_folder = os.path.abspath(watch_folder)
     script_to_run = os.path.abspath(script_to_run)
 
+    service = ConversionService(
+        script_to_run,
+        max_workers=args.workers,
+        settle_seconds=args.settle,
+        memory_limit=int(args.memory_limit_gb * 2**30) if args.memory_limit_gb else None,
+        memory_per_job=int(args.memory_per_job_gb * 2**30) if args.memory_per_job_gb else None,
+        tasks_per_child=args.tasks_per_child,
+    )
+
     print(f"Watching folder: {watch_folder}")
     print(f"Running script: {script_to_run}")
-    print("Maximum concurrent processes: 4")
+    print(f"Worker processes: {args.workers}, memory budget: {service.memory_budget() / 2**30:.1f} GiB")
     print("Press Ctrl+C to stop...")
 
-    # Set up file system event handler
-    event_handler = FileChangeHandler(script_to_run, max_workers=4)
-
     # Set up observer
     observer = Observer()
-    observer.schedule(event_handler, watch_folder, recursive=True)
+    observer.schedule(service, watch_folder, recursive=True)
+    service.scan(watch_folder)
 
     try:
         # Start monitoring
@@ -223,7 +413,7 @@ def main():
     finally:
         # Clean shutdown
         observer.stop()
-        event_handler.shutdown()
+        service.shutdown()
         observer.join()
         print("Watchdog stopped.")
 
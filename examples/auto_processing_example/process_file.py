@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """
-Example file processor script for use with folder_watchdog.py
+Example file processor script for use with auto_convert_zip.py
 This script demonstrates how to process files detected by the watchdog.
+
+auto_convert_zip.py imports this file once per worker process and calls `process_file` for each ZIP, so heavy
+imports (numba, h5ffmpeg, basicpy, ...) belong at module level. The script can still be run on its own.
 """
 
 import sys
@@ -9,15 +12,9 @@ import os
 import time
 from pathlib import Path
 
-def main():
-    """Main function to handle command line arguments and process files."""
-    if len(sys.argv) != 2:
-        print("Usage: python process_file.py <file_path>")
-        print("This script is designed to be called by folder_watchdog.py")
-        sys.exit(1)
-
-    file_path = sys.argv[1]
 
+def process_file(file_path):
+    """Process one ZIP file. Raising an exception marks the file as failed."""
     print(f"File processor started for: {file_path}")
     print(f"Process ID: {os.getpid()}")
 
@@ -29,5 +26,15 @@ def main():
     os.remove(file_path)
 
 
+def main():
+    """Main function to handle command line arguments and process files."""
+    if len(sys.argv) != 2:
+        print("Usage: python process_file.py <file_path>")
+        print("This script is designed to be called by auto_convert_zip.py")
+        sys.exit(1)
+
+    process_file(sys.argv[1])
+
+
 if __name__ == "__main__":
     main()
@@ -34,19 +34,16 @@ for i, (in_file, (out_file_data, out_file_meta)) in enumerate(zip(files, out_fil
 
     channel = int(in_file.split("ch")[1].split(".")[0])
 
+    # Flatfield correction is applied to each frame as it is decoded
     r = pySISF.sndif_utils.load_from_zip(
         in_file,
         stack_size=2000,  # stack_size=10,
         # stack_select=slice(1000, 1010),
         thread_count=16,
-        chunk_batch=1,
+        flatfield=flatfield_fits[channel].flatfield,
+        darkfield=flatfield_fits[channel].darkfield,
     )
 
-    if False:
-        flatfield = flatfield_fits[channel]
-        for i in tqdm.trange(r.shape[2]):
-            r[..., i] = flatfield_fits[channel].transform(r[..., i])
-
     if False:
         import tifffile
 
@@ -5,8 +5,36 @@
 """Import SISF components"""
 from __future__ import annotations
 
+import importlib
+
 __version__ = "0.7.0"
 
-from pySISF import sisf
-from pySISF import vidlib
-from pySISF import sndif_utils
+from pySISF import metrics
+from pySISF.metrics import stats
+
+# Submodules are imported on first access, so `import pySISF` does not pull in numba, h5ffmpeg or tqdm
+_LAZY_SUBMODULES = (
+    "sisf",
+    "vidlib",
+    "sndif_utils",
+    "verify",
+    "storage",
+    "pack",
+    "advisor",
+    "tiff_utils",
+    "segmentation",
+    "mosaic",
+    "analysis",
+    "zarr_utils",
+    "rechunk",
+)
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f"pySISF.{name}")
+    raise AttributeError(f"module 'pySISF' has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_SUBMODULES))
@@ -0,0 +1,300 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Chunk-shape, codec and metachunk-size advisor.
+
+Trial-encodes a sample of real data with `create_shard` for every candidate chunk size and codec, replays a
+described access workload against each trial shard, and reports the measured compression ratio, encode/decode
+throughput and bytes read per query, with a recommendation.
+
+Workloads weight query kinds: "xy_plane", "xz_plane", "yz_plane", "point" and "cube:N" (an N^3 region).
+
+Usage:
+    python -m pySISF.advisor sample.tif --workload xy_plane=3,cube:64=1 --chunk-sizes 32x32x10,64x64x16 --codecs 1
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pySISF import metrics, sisf, storage
+
+DEFAULT_CHUNK_SIZES = [(16, 16, 16), (32, 32, 10), (32, 32, 32), (64, 64, 16), (64, 64, 64), (128, 128, 32)]
+DEFAULT_MCHUNK_SIZES = [(1000, 1000, 1000), (2000, 2000, 2000), (4000, 4000, 4000)]
+DEFAULT_WORKLOAD = {"xy_plane": 1, "cube:64": 1, "point": 1}
+
+# Largest shard table the advisor recommends, so that opening a shard stays a single modest read
+DEFAULT_MAX_INDEX_BYTES = 16 * 2**20
+# Storage bandwidth used to turn bytes read into time, e.g. a network filesystem or object store
+DEFAULT_BANDWIDTH = 500e6
+
+
+def make_queries(kind, shape, count, rng):
+    """Returns `count` random selections of the given query kind within a volume of `shape`."""
+    queries = []
+    for _ in range(count):
+        x, y, z = (int(rng.integers(0, s)) for s in shape)
+        match kind.split(":")[0]:
+            case "xy_plane":
+                queries.append((slice(None), slice(None), z))
+            case "xz_plane":
+                queries.append((slice(None), y, slice(None)))
+            case "yz_plane":
+                queries.append((x, slice(None), slice(None)))
+            case "point":
+                queries.append((x, y, z))
+            case "cube":
+                side = int(kind.split(":")[1])
+                starts = [int(rng.integers(0, max(1, s - side + 1))) for s in shape]
+                queries.append(tuple(slice(start, min(start + side, s)) for start, s in zip(starts, shape)))
+            case _:
+                raise ValueError(f"Unknown query kind {kind}")
+
+    return queries
+
+
+def trial(sample, chunk_size, compression, workload, queries_per_kind=8, folder=None, seed=0, **shard_kwargs):
+    """
+    Encodes `sample` into one shard and replays the workload against it.
+
+    Returns:
+        dict of measurements: "ratio", "encode_MB/s", "index_bytes", and per query kind "queries" with the mean
+        "bytes_read" (stored bytes fetched), "read_requests", "seconds", "decode_MB/s" and "amplification"
+        (bytes decoded / bytes returned).
+    """
+    rng = np.random.default_rng(seed)
+
+    with tempfile.TemporaryDirectory(dir=folder) as tmp:
+        fname_data, fname_meta = os.path.join(tmp, "trial.data"), os.path.join(tmp, "trial.meta")
+
+        t = time.perf_counter()
+        sisf.create_shard(fname_data, fname_meta, sample, chunk_size, compression, progress=False, **shard_kwargs)
+        encode_seconds = time.perf_counter() - t
+
+        result = {
+            "chunk_size": tuple(chunk_size),
+            "compression": compression,
+            "ratio": sample.nbytes / os.path.getsize(fname_data),
+            "encode_MB/s": sample.nbytes / encode_seconds / 1e6,
+            "index_bytes": os.path.getsize(fname_meta),
+            "queries": {},
+        }
+
+        # Only merge adjacent chunks, so that bytes read are the payloads actually needed
+        reader = sisf.sisf_chunk(
+            fname_data, fname_meta, cache_metadata=True, storage=storage.LocalStorage(coalesce_gap=0)
+        )
+        previous = metrics.ENABLED
+        metrics.enable()
+        try:
+            for kind in workload:
+                totals = {"bytes_read": 0, "read_requests": 0, "seconds": 0.0, "bytes_decoded": 0, "bytes_returned": 0}
+                queries = make_queries(kind, sample.shape, queries_per_kind, rng)
+
+                for key in queries:
+                    metrics.reset()
+                    t = time.perf_counter()
+                    out = reader[key]
+                    totals["seconds"] += time.perf_counter() - t
+
+                    snapshot = metrics.stats()
+                    totals["bytes_read"] += snapshot["bytes_read"]
+                    totals["read_requests"] += snapshot["counters"].get("read_requests", 0)
+                    totals["bytes_decoded"] += snapshot["stages"]["decompress"]["bytes"]
+                    totals["bytes_returned"] += out.nbytes
+
+                query = {name: value / len(queries) for name, value in totals.items()}
+                query["amplification"] = totals["bytes_decoded"] / totals["bytes_returned"]
+                query["decode_MB/s"] = totals["bytes_returned"] / totals["seconds"] / 1e6
+                result["queries"][kind] = query
+        finally:
+            metrics.enable(previous)
+            metrics.reset()
+
+    return result
+
+
+def query_cost(result, workload, bandwidth=DEFAULT_BANDWIDTH):
+    """Weighted mean seconds per query: measured decode time plus the time to fetch the bytes read at `bandwidth`."""
+    total_weight = sum(workload.values())
+    cost = 0.0
+    for kind, weight in workload.items():
+        query = result["queries"][kind]
+        cost += weight * (query["seconds"] + query["bytes_read"] / bandwidth)
+
+    return cost / total_weight
+
+
+def advise_mchunk(chunk_size, itemsize, mchunk_sizes=None, max_index_bytes=DEFAULT_MAX_INDEX_BYTES, stats=True):
+    """
+    Returns the largest metachunk size whose shard table stays under `max_index_bytes`, with the table size of
+    every candidate. Larger metachunks mean fewer files; the table size bounds the cost of opening a shard.
+    """
+    mchunk_sizes = mchunk_sizes if mchunk_sizes else DEFAULT_MCHUNK_SIZES
+    line_size = sisf.SHARD_LINE_CHECKSUM_SIZE + (sisf.SHARD_STATS_SIZE if stats else 0)
+
+    candidates = []
+    for mchunk_size in mchunk_sizes:
+        chunks = 1
+        for m, c in zip(mchunk_size, chunk_size):
+            chunks *= (m + c - 1) // c
+        candidates.append(
+            {
+                "mchunk_size": tuple(mchunk_size),
+                "index_bytes": chunks * line_size,
+                "shard_GB": np.prod(mchunk_size, dtype=np.float64) * itemsize / 1e9,
+            }
+        )
+
+    fitting = [c for c in candidates if c["index_bytes"] <= max_index_bytes]
+    best = max(fitting, key=lambda c: np.prod(c["mchunk_size"], dtype=np.float64)) if fitting else None
+
+    return best, candidates
+
+
+def advise(
+    sample,
+    workload=None,
+    chunk_sizes=None,
+    compressions=(1,),
+    mchunk_sizes=None,
+    queries_per_kind=8,
+    bandwidth=DEFAULT_BANDWIDTH,
+    folder=None,
+    progress=True,
+    **shard_kwargs,
+):
+    """
+    Trial-encodes `sample` with every candidate chunk size and codec and recommends the cheapest for `workload`.
+
+    Parameters:
+        sample (3D numpy array-like): representative data, e.g. a few hundred planes of a real acquisition.
+        workload (dict, default None): query kind -> weight, e.g. {"xy_plane": 3, "cube:64": 1}.
+        chunk_sizes (list of 3-tuple, default None): candidate chunk sizes, `DEFAULT_CHUNK_SIZES` if not set.
+        compressions (tuple of int, default (1,)): candidate codecs, as passed to `create_shard`.
+        mchunk_sizes (list of 3-tuple, default None): candidate metachunk sizes, `DEFAULT_MCHUNK_SIZES` if not set.
+        queries_per_kind (int, default 8): random queries replayed per query kind.
+        bandwidth (float, default 500e6): storage bandwidth in bytes/s used to cost the bytes read.
+        folder (str, default None): where trial shards are written, the system temporary folder if not set.
+        progress (bool, default True): prints a loading bar using `tqdm`.
+        shard_kwargs: passed to `create_shard`, e.g. order="hilbert".
+
+    Returns:
+        dict with "results" (one `trial` result per candidate, with its "cost" in seconds per query, sorted by
+        cost), "recommended" (the cheapest result) and "mchunk" (`advise_mchunk` for the recommended chunk size).
+    """
+    import tqdm
+
+    sample = np.asarray(sample)
+    workload = workload if workload else DEFAULT_WORKLOAD
+    chunk_sizes = chunk_sizes if chunk_sizes else DEFAULT_CHUNK_SIZES
+    candidates = [(tuple(c), compression) for c in chunk_sizes for compression in compressions]
+
+    results = []
+    for chunk_size, compression in tqdm.tqdm(candidates, disable=not progress):
+        result = trial(
+            sample, chunk_size, compression, workload, queries_per_kind=queries_per_kind, folder=folder, **shard_kwargs
+        )
+        result["cost"] = query_cost(result, workload, bandwidth=bandwidth)
+        results.append(result)
+
+    results.sort(key=lambda r: (r["cost"], -r["ratio"]))
+    recommended = results[0]
+    mchunk, mchunk_candidates = advise_mchunk(recommended["chunk_size"], sample.itemsize, mchunk_sizes)
+
+    return {
+        "results": results,
+        "recommended": recommended,
+        "mchunk": mchunk,
+        "mchunk_candidates": mchunk_candidates,
+    }
+
+
+def format_report(report):
+    """Formats the output of `advise` as a text table."""
+    kinds = list(report["recommended"]["queries"])
+    lines = [
+        f"{'chunk size':>16} {'codec':>5} {'ratio':>7} {'enc MB/s':>9} {'ms/query':>9}  "
+        + "  ".join(f"{kind + ' KB read (amp)':>28}" for kind in kinds)
+    ]
+
+    for r in report["results"]:
+        reads = "  ".join(
+            f"{r['queries'][k]['bytes_read'] / 1e3:>19.1f} ({r['queries'][k]['amplification']:>6.1f}x)" for k in kinds
+        )
+        size = "x".join(str(s) for s in r["chunk_size"])
+        lines.append(
+            f"{size:>16} {r['compression']:>5} {r['ratio']:>7.2f} {r['encode_MB/s']:>9.1f} {r['cost'] * 1e3:>9.2f}  "
+            + reads
+        )
+
+    best = report["recommended"]
+    lines.append("")
+    lines.append(
+        f"Recommended: chunk_size={best['chunk_size']}, compression={best['compression']} "
+        f"({best['cost'] * 1e3:.2f} ms/query, ratio {best['ratio']:.2f})"
+    )
+    for m in report["mchunk_candidates"]:
+        lines.append(
+            f"  mchunk_size={m['mchunk_size']}: {m['index_bytes'] / 2**20:.2f} MiB shard table, "
+            f"{m['shard_GB']:.1f} GB raw per shard"
+        )
+    if report["mchunk"] is not None:
+        lines.append(f"Recommended: mchunk_size={report['mchunk']['mchunk_size']}")
+    else:
+        lines.append("No metachunk candidate keeps the shard table small, use a larger chunk size.")
+
+    return "\n".join(lines)
+
+
+def parse_size(text):
+    return tuple(int(s) for s in text.split("x"))
+
+
+def load_sample(fname):
+    if fname.endswith(".npy"):
+        return np.load(fname, mmap_mode="r")
+
+    import tifffile
+
+    # Tiff stacks are stored ZYX, SISF volumes are XYZ
+    return np.transpose(tifffile.imread(fname), (2, 1, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend SISF chunk and metachunk sizes for an access workload.")
+    parser.add_argument("sample", help="sample volume, .npy (XYZ) or tiff stack (ZYX)")
+    parser.add_argument("--workload", default="xy_plane=1,cube:64=1,point=1", help="query kinds with weights")
+    parser.add_argument("--chunk-sizes", default=None, help="candidate chunk sizes, e.g. 32x32x10,64x64x16")
+    parser.add_argument("--mchunk-sizes", default=None, help="candidate metachunk sizes, e.g. 2000x2000x2000")
+    parser.add_argument("--codecs", default="1", help="candidate codecs, e.g. 1,2")
+    parser.add_argument("--queries", type=int, default=8, help="random queries per query kind")
+    parser.add_argument("--bandwidth", type=float, default=DEFAULT_BANDWIDTH / 1e6, help="storage bandwidth in MB/s")
+    parser.add_argument("--order", default="c", help="chunk order, c, morton or hilbert")
+    args = parser.parse_args()
+
+    workload = {}
+    for item in args.workload.split(","):
+        kind, _, weight = item.partition("=")
+        workload[kind] = float(weight) if weight else 1.0
+
+    report = advise(
+        load_sample(args.sample),
+        workload=workload,
+        chunk_sizes=[parse_size(s) for s in args.chunk_sizes.split(",")] if args.chunk_sizes else None,
+        compressions=tuple(int(c) for c in args.codecs.split(",")),
+        mchunk_sizes=[parse_size(s) for s in args.mchunk_sizes.split(",")] if args.mchunk_sizes else None,
+        queries_per_kind=args.queries,
+        bandwidth=args.bandwidth * 1e6,
+        order=args.order,
+    )
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
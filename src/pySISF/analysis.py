@@ -0,0 +1,295 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Whole-archive statistics computed by streaming chunks, without materializing the volume.
+
+`histogram` decodes the chunks of one channel on the shared read executor and merges per-chunk histograms, so
+memory stays at a few chunks per thread. `percentiles` derives percentiles from that histogram. `project` computes
+maximum, mean and sum projections the same way, holding only the 2D result.
+
+For a quick answer on large archives, `approximate=True` reads the coarsest pyramid level instead of full
+resolution, or a random sample of the chunks when the archive has no pyramid.
+
+Usage:
+    python -m pySISF.analysis archive --channel 0 --percentiles 1 50 99.9 [--approximate]
+"""
+
+import argparse
+import threading
+
+import numpy as np
+
+from pySISF import sisf
+
+# Default bin count of float data; integer data gets one bin per value, up to MAX_BINS bins
+DEFAULT_FLOAT_BINS = 4096
+MAX_BINS = 2**16
+# Fraction of chunks read by approximate histograms of archives without a pyramid
+APPROXIMATE_SAMPLE = 0.05
+
+
+def open_archive(archive):
+    return sisf.sisf(archive) if isinstance(archive, str) else archive
+
+
+def coarsest_scale(archive, channel=0):
+    """Returns the coarsest pyramid level (1, 2, 4, ...) stored for `channel`."""
+    archive = open_archive(archive)
+
+    scale = 1
+    while scale * 2 <= max(archive.mchunk):
+        try:
+            archive.get_chunk(0, 0, 0, channel, scale * 2)
+        except (OSError, ValueError):
+            break
+        scale *= 2
+
+    return scale
+
+
+def scaled_size(archive, channel=0, scale=1):
+    """Returns the XYZ size of pyramid level `scale`, see `pySISF.sisf.sisf.get_size`."""
+    return open_archive(archive).get_size(scale, channel)
+
+
+def iter_channel(archive, channel=0, region=None, scale=1):
+    """
+    Yields the read plan of one channel of an archive entry by entry, see `pySISF.sisf.run_read_plan`, so the plan
+    is never held in memory. Output indices are (0, x, y, z) slices relative to the start of the region.
+
+    Parameters:
+        region (3 (start, stop) pairs, default None): XYZ selection in scaled coordinates, everything if not set.
+    """
+    if region is None:
+        region = tuple((0, s) for s in scaled_size(archive, channel, scale))
+
+    return archive.iter_plan(((channel, channel + 1), *region), scale=scale)
+
+
+def sample_plan(plan, fraction, seed=0):
+    """
+    Yields each entry of a read plan with probability `fraction`, drawn with a seeded RNG. The last entry is
+    yielded if no other was, so that a sample is never empty.
+    """
+    rng = np.random.default_rng(seed)
+    entry = None
+    sampled = False
+    for entry in plan:
+        if rng.random() < fraction:
+            sampled = True
+            yield entry
+
+    if not sampled and entry is not None:
+        yield entry
+
+
+def default_bins(archive, dtype, channel=0, scale=1):
+    """
+    Chooses histogram bins from the stored chunk statistics: one bin per value for integer data (up to
+    `MAX_BINS`), `DEFAULT_FLOAT_BINS` bins otherwise.
+
+    Returns:
+        (bin count, (low, high)) for `np.histogram`
+    """
+    try:
+        table = archive.chunk_stats(channel=channel, scale=scale)
+        low, high = float(table["min"].min()), float(table["max"].max())
+    except ValueError:
+        if not np.issubdtype(dtype, np.integer):
+            raise ValueError("Archive has no chunk statistics, a histogram range is required for float data") from None
+        low, high = float(np.iinfo(dtype).min), float(np.iinfo(dtype).max)
+
+    if np.issubdtype(dtype, np.integer):
+        high += 1  # so that the last value gets a bin of its own
+        return int(min(high - low, MAX_BINS)), (low, high)
+
+    return DEFAULT_FLOAT_BINS, (low, high if high > low else low + 1)
+
+
+def histogram(
+    archive, bins=None, channel=0, range=None, region=None, scale=1, sample=None, approximate=False, seed=0
+):
+    """
+    Histogram of one channel, streamed chunk by chunk across the read executor.
+
+    Parameters:
+        archive (str or pySISF.sisf.sisf): archive to read.
+        bins (int, default None): number of equal-width bins; with `range` not set either, chosen by `default_bins`.
+        channel (int, default 0): channel to read.
+        range ((low, high), default None): histogram range, from the stored chunk statistics if not set.
+        region (3 (start, stop) pairs, default None): XYZ selection in scaled coordinates, everything if not set.
+        scale (int, default 1): pyramid level to read. Coarser levels are averaged, which narrows the tails.
+        sample (float, default None): fraction of the chunks to read, each chunk being chosen at random with
+            probability `sample` using `seed`.
+        approximate (bool, default False): read the coarsest pyramid level, or `APPROXIMATE_SAMPLE` of the chunks
+            if there is none, instead of `scale`.
+
+    Returns:
+        (counts, bin edges), as `np.histogram`. Counts cover only the voxels read, so sampled counts are not scaled.
+    """
+    archive = open_archive(archive)
+    dtype = np.dtype(sisf.get_dtype(archive.dtype))
+
+    if approximate:
+        scale = coarsest_scale(archive, channel)
+        if scale == 1 and sample is None:
+            sample = APPROXIMATE_SAMPLE
+
+    if range is None:
+        default_count, range = default_bins(archive, dtype, channel, scale)
+        bins = default_count if bins is None else bins
+    elif bins is None:
+        bins = DEFAULT_FLOAT_BINS
+    low, high = range
+    edges = np.linspace(low, high, bins + 1)
+
+    plan = iter_channel(archive, channel, region, scale)
+    if sample is not None:
+        plan = sample_plan(plan, sample, seed)
+
+    # uint8/uint16 data with one bin per integer value is counted with bincount, several times faster than
+    # np.histogram. As in np.histogram, the last bin also holds values equal to `high`.
+    unit_bins = (
+        dtype.itemsize <= 2
+        and np.issubdtype(dtype, np.integer)
+        and high - low == bins
+        and low >= 0
+        and low == int(low)
+        and high == int(high)
+    )
+    low_int, high_int = int(low), int(high)
+
+    counts = np.zeros(bins, dtype=np.int64)
+    lock = threading.Lock()
+
+    def accumulate(chunk, dst):
+        if unit_bins:
+            values = np.bincount(chunk.ravel(), minlength=high_int + 1)
+            partial = values[low_int:high_int].copy()
+            partial[-1] += values[high_int]
+        else:
+            partial, _ = np.histogram(chunk, bins=bins, range=range)
+        with lock:
+            counts[:] += partial
+
+    sisf.run_read_plan(plan, accumulate)
+
+    return counts, edges
+
+
+def percentiles_from_histogram(counts, edges, q, integer=False):
+    """
+    Percentiles `q` (in [0, 100]) of a histogram, interpolated linearly within bins. With `integer` set and
+    bins of width 1, the value of the bin is returned instead, which matches `np.percentile(method="inverted_cdf")`.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    cdf = np.cumsum(counts)
+    if cdf[-1] == 0:
+        raise ValueError("Histogram is empty.")
+
+    target = q / 100 * cdf[-1]
+    idx = np.clip(np.searchsorted(cdf, target, side="left"), 0, len(counts) - 1)
+
+    if integer and np.allclose(np.diff(edges), 1):
+        return edges[idx]
+
+    before = np.where(idx > 0, cdf[idx - 1], 0)
+    frac = np.divide(target - before, counts[idx], out=np.zeros_like(target), where=counts[idx] > 0)
+    return edges[idx] + np.clip(frac, 0, 1) * (edges[idx + 1] - edges[idx])
+
+
+def percentiles(archive, q, channel=0, **kwargs):
+    """
+    Percentiles of one channel, computed from `histogram`. Exact for uint8/uint16 data with the default bins,
+    within one bin width otherwise.
+
+    Parameters:
+        q (float or list of float): percentiles to compute, in [0, 100].
+        Other parameters are as for `histogram`.
+
+    Returns:
+        numpy array of the percentiles, shaped as `q`.
+    """
+    archive = open_archive(archive)
+    counts, edges = histogram(archive, channel=channel, **kwargs)
+    integer = np.issubdtype(sisf.get_dtype(archive.dtype), np.integer)
+
+    return percentiles_from_histogram(counts, edges, q, integer=integer)
+
+
+def project(archive, axis=2, mode="max", channel=0, region=None, scale=1):
+    """
+    Projection of one channel along an axis, reduced chunk by chunk on the read executor. Only the 2D result is
+    kept in memory, each chunk is reduced along `axis` before being merged into it.
+
+    Parameters:
+        archive (str or pySISF.sisf.sisf): archive to read.
+        axis (int, default 2): axis to project along, 0 (x), 1 (y) or 2 (z).
+        mode (str, default "max"): "max", "mean" or "sum".
+        channel (int, default 0): channel to read.
+        region (3 (start, stop) pairs, default None): XYZ selection in scaled coordinates, everything if not set.
+        scale (int, default 1): pyramid level to read.
+
+    Returns:
+        2D numpy array over the two remaining axes of the region. Maximum projections keep the archive type, sums
+        are accumulated as int64 / uint64 / float64 and means are float64.
+    """
+    archive = open_archive(archive)
+    dtype = np.dtype(sisf.get_dtype(archive.dtype))
+
+    if region is None:
+        region = tuple((0, s) for s in scaled_size(archive, channel, scale))
+    shape = tuple(stop - start for i, (start, stop) in enumerate(region) if i != axis)
+
+    match mode:
+        case "max":
+            lowest = np.iinfo(dtype).min if np.issubdtype(dtype, np.integer) else -np.inf
+            out = np.full(shape, lowest, dtype=dtype)
+        case "sum" if np.issubdtype(dtype, np.integer):
+            out = np.zeros(shape, dtype=np.uint64 if np.issubdtype(dtype, np.unsignedinteger) else np.int64)
+        case "mean" | "sum":
+            out = np.zeros(shape, dtype=np.float64)
+        case _:
+            raise ValueError(f"Unknown projection mode {mode!r}, expected max, mean or sum")
+
+    lock = threading.Lock()
+
+    def accumulate(chunk, dst):
+        dst = tuple(d for i, d in enumerate(dst[1:]) if i != axis)
+        if mode == "max":
+            partial = chunk.max(axis=axis)
+            with lock:
+                np.maximum(out[dst], partial, out=out[dst])
+        else:
+            partial = chunk.sum(axis=axis, dtype=out.dtype)
+            with lock:
+                out[dst] += partial
+
+    sisf.run_read_plan(iter_channel(archive, channel, region, scale), accumulate)
+
+    if mode == "mean":
+        out /= region[axis][1] - region[axis][0]
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print percentiles of one channel of a SISF archive.")
+    parser.add_argument("archive", help="SISF archive")
+    parser.add_argument("--channel", type=int, default=0, help="channel to read")
+    parser.add_argument("--percentiles", type=float, nargs="+", default=[0.1, 1, 50, 99, 99.9])
+    parser.add_argument("--scale", type=int, default=1, help="pyramid level to read")
+    parser.add_argument("--approximate", action="store_true", help="read the coarsest level or a chunk sample")
+    args = parser.parse_args()
+
+    values = percentiles(
+        args.archive, args.percentiles, channel=args.channel, scale=args.scale, approximate=args.approximate
+    )
+    for q, v in zip(args.percentiles, values):
+        print(f"{q:g}%: {v:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Lightweight instrumentation for SISF reads and writes.
+
+Instrumentation is disabled by default. When disabled, `start`, `record` and `count` return immediately, so the
+only cost on the hot paths is one function call and a flag check.
+
+Example:
+    pySISF.metrics.enable()
+    archive[0, :, :, 100]
+    print(pySISF.stats())
+
+    with pySISF.metrics.trace() as events:
+        archive[0, :, :, 100]
+    # events is a list of (stage, seconds, nbytes)
+"""
+
+import contextlib
+import math
+import threading
+import time
+from collections import defaultdict
+
+ENABLED = False
+
+# Histogram buckets are powers of two from 1 us to ~8.6 s, with one overflow bucket
+HISTOGRAM_MIN_EXPONENT = -20
+HISTOGRAM_MAX_EXPONENT = 3
+
+_lock = threading.Lock()
+_callbacks = []
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.nbytes = 0
+        self.histogram = [0] * (HISTOGRAM_MAX_EXPONENT - HISTOGRAM_MIN_EXPONENT + 2)
+
+    def add(self, seconds, nbytes):
+        self.count += 1
+        self.seconds += seconds
+        self.nbytes += nbytes
+
+        exponent = math.ceil(math.log2(seconds)) if seconds > 0 else HISTOGRAM_MIN_EXPONENT
+        bucket = min(max(exponent, HISTOGRAM_MIN_EXPONENT), HISTOGRAM_MAX_EXPONENT + 1) - HISTOGRAM_MIN_EXPONENT
+        self.histogram[bucket] += 1
+
+    def snapshot(self):
+        histogram = {}
+        for i, n in enumerate(self.histogram):
+            if n:
+                exponent = i + HISTOGRAM_MIN_EXPONENT
+                histogram["inf" if exponent > HISTOGRAM_MAX_EXPONENT else 2.0**exponent] = n
+
+        return {
+            "count": self.count,
+            "seconds": self.seconds,
+            "bytes": self.nbytes,
+            "mean_seconds": self.seconds / self.count if self.count else 0.0,
+            "MB/s": self.nbytes / self.seconds / 1e6 if self.seconds > 0 else 0.0,
+            "histogram": histogram,
+        }
+
+
+_stages = defaultdict(StageStats)
+_counters = defaultdict(int)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def disable():
+    enable(False)
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def start():
+    """Returns a start timestamp for `record`, or 0 when instrumentation is disabled."""
+    return time.perf_counter() if ENABLED else 0
+
+
+def record(stage, t0, nbytes=0):
+    """
+    Records the time since `t0` (from `start` or a previous `record`) against `stage`.
+
+    Nothing is recorded if `t0` is 0, i.e. instrumentation was enabled after `start`.
+
+    Returns:
+        The current timestamp, so consecutive stages can be chained, or 0 when disabled.
+    """
+    if not ENABLED:
+        return 0
+
+    now = time.perf_counter()
+    if not t0:
+        return now
+    seconds = now - t0
+
+    with _lock:
+        _stages[stage].add(seconds, nbytes)
+
+    for callback in _callbacks:
+        callback(stage, seconds, nbytes)
+
+    return now
+
+
+def count(name, n=1):
+    if not ENABLED:
+        return
+
+    with _lock:
+        _counters[name] += n
+
+
+def add_callback(callback):
+    """Registers `callback(stage, seconds, nbytes)`, called for every recorded stage while enabled."""
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    _callbacks.remove(callback)
+
+
+@contextlib.contextmanager
+def trace():
+    """Enables instrumentation for the duration of the block and collects every (stage, seconds, nbytes) event."""
+    events = []
+    previous = ENABLED
+
+    def callback(*event):
+        events.append(event)
+
+    add_callback(callback)
+    enable()
+    try:
+        yield events
+    finally:
+        enable(previous)
+        remove_callback(callback)
+
+
+def stats():
+    """
+    Returns a snapshot of all counters and per-stage timings.
+
+    Stages recorded by pySISF are "metadata", "open", "read", "decompress" and "copy" for reads, and
+    "compress" and "write" for `create_shard`. Counters include "chunks_decoded", "chunks_encoded",
+    "read_requests" (storage requests issued) and the metadata cache hits/misses, summarized as
+    "metadata_cache_hit_rate".
+    """
+    with _lock:
+        counters = dict(_counters)
+        stages = {name: stage.snapshot() for name, stage in _stages.items()}
+
+    lookups = counters.get("metadata_cache_hit", 0) + counters.get("metadata_cache_miss", 0)
+
+    return {
+        "enabled": ENABLED,
+        "counters": counters,
+        "stages": stages,
+        "bytes_read": stages["read"]["bytes"] if "read" in stages else 0,
+        "bytes_written": stages["write"]["bytes"] if "write" in stages else 0,
+        "metadata_cache_hit_rate": counters.get("metadata_cache_hit", 0) / lookups if lookups else None,
+    }
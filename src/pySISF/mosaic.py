@@ -0,0 +1,311 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Virtual mosaics: a stitched volume served straight from per-tile shards, without rewriting them into an archive.
+
+A mosaic descriptor is a small JSON file listing tiles, each one a set of shards `{name}.{scale}X.data` and
+`{name}.{scale}X.meta` (as written per acquisition tile by the SNDIF conversion scripts), with its global offset,
+channel and priority. Tile names are relative to the descriptor's folder. Reads in global coordinates are split
+into the overlapping part of every tile and dispatched to the tiles' `sisf_chunk` objects.
+
+Overlaps are resolved by the blending rule of the mosaic:
+    "priority": the tile with the highest priority wins, later tiles of the descriptor win ties.
+    "max": voxel-wise maximum of the overlapping tiles.
+    "mean": voxel-wise mean of the overlapping tiles.
+
+Tiles are read straight into the output. With "max" and "mean", each box where two tiles overlap is then
+recomputed from every tile covering it, so blending only needs a buffer the size of one overlap box, at the cost of
+decoding overlapping voxels once more per tile covering them.
+
+Usage:
+    pySISF.mosaic.create_mosaic("mosaic.json", [{"name": "tile_0_ch0", "offset": (0, 0, 0)}, ...])
+    m = pySISF.mosaic.mosaic("mosaic.json")
+    region = m[0, 1000:3000, 1000:3000, 500]
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from pySISF.sisf import execute_read_plan, get_dtype, parse_selection, prepare_output, sisf_chunk
+from pySISF.storage import LocalStorage, open_storage
+
+MOSAIC_VERSION = 1
+BLENDING_MODES = ("priority", "max", "mean")
+
+
+def tile_keys(name, scale):
+    """Returns the data and metadata keys of a tile at pyramid level `scale`."""
+    return f"{name}.{scale}X.data", f"{name}.{scale}X.meta"
+
+
+def overlaps(a, b):
+    """True if two lists of (start, stop) ranges intersect on every axis."""
+    return all(max(a0, b0) < min(a1, b1) for (a0, a1), (b0, b1) in zip(a, b))
+
+
+def create_mosaic(fname, tiles, res=(1000, 1000, 1000), blending="priority"):
+    """
+    Writes a mosaic descriptor. Each tile's 1X shard is opened once to record its size and type.
+
+    Parameters:
+        fname (str): descriptor to create, usually ending in ".json".
+        tiles (list of dict): one entry per tile with keys
+            "name" (str): shard name without the ".{scale}X.data" suffix, relative to the descriptor's folder.
+            "offset" (3-tuple of int): global position of the tile's (cropped) origin, in 1X voxels.
+            "channel" (int, default 0): mosaic channel of the tile.
+            "priority" (int, default 0): precedence of the tile in "priority" blending.
+        res (3-tuple of int, default (1000, 1000, 1000)): resolution in nm.
+        blending (str, default "priority"): overlap rule, one of `BLENDING_MODES`.
+    """
+    if blending not in BLENDING_MODES:
+        raise ValueError(f"Unknown blending mode {blending!r}, expected one of {BLENDING_MODES}")
+
+    storage = LocalStorage(os.path.dirname(fname))
+
+    entries = []
+    dtype = None
+    size = [0, 0, 0]
+    for tile in tiles:
+        offset = tuple(int(i) for i in tile["offset"])
+        if len(offset) != 3 or min(offset) < 0:
+            raise ValueError(f"Invalid offset {offset} for tile {tile['name']}, expected 3 non-negative values")
+
+        shard = sisf_chunk(*tile_keys(tile["name"], 1), storage=storage)
+        if dtype is None:
+            dtype = shard.dtype
+        elif shard.dtype != dtype:
+            raise ValueError(f"Tile {tile['name']} has dtype {shard.dtype}, other tiles have {dtype}")
+
+        size = [max(s, o + t) for s, o, t in zip(size, offset, shard.shape)]
+        entries.append(
+            {
+                "name": tile["name"],
+                "offset": list(offset),
+                "size": list(shard.shape),
+                "channel": int(tile.get("channel", 0)),
+                "priority": int(tile.get("priority", 0)),
+            }
+        )
+
+    if not entries:
+        raise ValueError("A mosaic needs at least one tile.")
+
+    descriptor = {
+        "version": MOSAIC_VERSION,
+        "dtype": dtype,
+        "channel_count": max(entry["channel"] for entry in entries) + 1,
+        "res": list(res),
+        "size": size,
+        "blending": blending,
+        "tiles": entries,
+    }
+
+    with open(fname, "w") as f:
+        json.dump(descriptor, f, indent=1)
+
+
+class mosaic:
+    def __init__(self, fname, cache_metadata=False, verify_checksums=False, storage=None):
+        """
+        Opens a mosaic descriptor. Tile shards are only opened once a read touches them.
+
+        Parameters:
+            fname (str): descriptor file, or its URL such as "https://host/specimen/mosaic.json".
+            cache_metadata (bool, default False): load each shard table once, on first access.
+            verify_checksums (bool, default False): check each chunk against its stored CRC-32.
+            storage (pySISF.storage.Storage, default None): backend holding the descriptor and tiles, chosen from
+                the descriptor's folder with `pySISF.storage.open_storage` if not set.
+        """
+        self.fname = fname
+        root, self.descriptor_key = fname.rsplit("/", 1) if "/" in fname else ("", fname)
+
+        self.cache_metadata = cache_metadata
+        self.verify_checksums = verify_checksums
+        self.storage = storage if storage is not None else open_storage(root)
+
+        descriptor = json.loads(bytes(self.storage.read(self.descriptor_key)))
+        if descriptor["version"] > MOSAIC_VERSION:
+            raise NotImplementedError(f"Mosaic version {descriptor['version']} not supported.")
+        if descriptor["blending"] not in BLENDING_MODES:
+            raise ValueError(f"Unknown blending mode {descriptor['blending']!r} in {fname}")
+
+        self.version = descriptor["version"]
+        self.dtype = descriptor["dtype"]
+        self.channel_count = descriptor["channel_count"]
+        self.res = tuple(descriptor["res"])
+        self.size = tuple(descriptor["size"])
+        self.blending = descriptor["blending"]
+        self.tiles = descriptor["tiles"]
+
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return (self.channel_count, *self.size)
+
+    def get_shape(self, scale=1):
+        """Shape of pyramid level `scale`."""
+        return (self.channel_count, *(max(1, s // scale) for s in self.size))
+
+    def get_tile(self, index, scale=1):
+        """Opens (once) the shard of tile `index` at pyramid level `scale`."""
+        key = (index, scale)
+        with self.shards_lock:
+            if key not in self.shards:
+                self.shards[key] = sisf_chunk(
+                    *tile_keys(self.tiles[index]["name"], scale),
+                    parent=self,
+                    cache_metadata=self.cache_metadata,
+                    verify_checksums=self.verify_checksums,
+                    storage=self.storage,
+                )
+            return self.shards[key]
+
+    def get_tile_bounds(self, index, scale=1):
+        """
+        Returns the (start, stop) extent of tile `index` at pyramid level `scale`, in scaled global coordinates.
+
+        The extent comes from the descriptor, so no shard is opened at scale 1. Other levels use the size of the
+        downsampled shard, which rounding can make differ from the 1X size divided by `scale`.
+        """
+        tile = self.tiles[index]
+        size = tile["size"] if scale == 1 else self.get_tile(index, scale).shape
+        return [(o // scale, o // scale + s) for o, s in zip(tile["offset"], size)]
+
+    def find_tiles(self, key, scale=1):
+        """
+        Lists the tiles intersecting a selection, in blending order.
+
+        Parameters:
+            key (4 (start, stop) pairs): channel and XYZ selection, in scaled global coordinates.
+
+        Returns:
+            List of (tile index, intersection) pairs, the intersection being 3 (start, stop) pairs.
+        """
+        out = []
+        for index, tile in enumerate(self.tiles):
+            if not key[0][0] <= tile["channel"] < key[0][1]:
+                continue
+
+            # Cheap rejection with the 1X extent, grown by a voxel to allow for rounding at coarser levels
+            coarse = [(o // scale - 1, (o + s) // scale + 1) for o, s in zip(tile["offset"], tile["size"])]
+            if not overlaps(coarse, key[1:]):
+                continue
+
+            bounds = self.get_tile_bounds(index, scale)
+            if overlaps(bounds, key[1:]):
+                out.append((index, [(max(a0, b0), min(a1, b1)) for (a0, a1), (b0, b1) in zip(bounds, key[1:])]))
+
+        # Lowest priority first, so higher priorities are written last; the sort is stable for ties
+        out.sort(key=lambda entry: self.tiles[entry[0]]["priority"])
+
+        return out
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def read(self, key, scale=1, out=None):
+        """
+        Reads a region of the mosaic. Voxels covered by no tile are 0.
+
+        Parameters:
+            key (4 selectors): int, slice or (start, stop) pair for the channel and each XYZ axis, in scaled global
+                coordinates.
+            scale (int, default 1): pyramid level to read.
+            out (writable 4D array, default None): destination shaped as the selection, e.g. an `np.memmap`. A new
+                array if not set.
+
+        Returns:
+            4D numpy array of the selection, `out` if set.
+        """
+        key = parse_selection(key, self.get_shape(scale))
+        reused = out is not None
+        out = prepare_output(key, out, get_dtype(self.dtype))
+        if reused:
+            out[...] = 0  # tiles need not cover the whole selection
+
+        tiles = self.find_tiles(key, scale)
+
+        # Non-overlapping tiles are read with one plan, so their chunks decode in parallel
+        plan = []
+        pending = []
+
+        for index, inter in tiles:
+            channel = self.tiles[index]["channel"] - key[0][0]
+            if any(c == channel and overlaps(r, inter) for c, r in pending):
+                execute_read_plan(plan, out)
+                plan, pending = [], []
+            plan.extend(self.plan_tile(index, inter, scale, out_prefix=(channel,), origin=key[1:]))
+            pending.append((channel, inter))
+
+        if plan:
+            execute_read_plan(plan, out)
+
+        if self.blending != "priority":
+            for i, (index, inter) in enumerate(tiles):
+                channel = self.tiles[index]["channel"]
+                for other, other_inter in tiles[i + 1 :]:
+                    if self.tiles[other]["channel"] == channel and overlaps(inter, other_inter):
+                        box = [(max(a0, b0), min(a1, b1)) for (a0, a1), (b0, b1) in zip(inter, other_inter)]
+                        self.blend(box, channel, tiles, key, scale, out)
+
+        return out
+
+    def plan_tile(self, index, region, scale, out_prefix=(), origin=None):
+        """
+        Read plan of `region` (3 (start, stop) pairs in scaled global coordinates) of tile `index`, writing to
+        `out_prefix` + XYZ positions relative to `origin`, the start of `region` if not set.
+        """
+        bounds = self.get_tile_bounds(index, scale)
+        origin = region if origin is None else origin
+
+        local = [(a0 - b0, a1 - b0) for (a0, a1), (b0, _) in zip(region, bounds)]
+        offset = [a0 - o0 for (a0, _), (o0, _) in zip(region, origin)]
+
+        return self.get_tile(index, scale).plan_read(local, out_prefix=out_prefix, out_offset=offset)
+
+    def blend(self, box, channel, tiles, key, scale, out):
+        """
+        Recomputes the voxels of `box`, covered by several tiles of `channel`, as the maximum or mean of every tile
+        in `tiles` covering them.
+        """
+        shape = tuple(b1 - b0 for b0, b1 in box)
+        if self.blending == "max":
+            lowest = np.iinfo(out.dtype).min if np.issubdtype(out.dtype, np.integer) else -np.inf
+            total = np.full(shape, lowest, dtype=out.dtype)
+        else:
+            total = np.zeros(shape, dtype=np.float64)
+            weight = np.zeros(shape, dtype=np.uint16)
+
+        for index, inter in tiles:
+            if self.tiles[index]["channel"] != channel or not overlaps(inter, box):
+                continue
+
+            part = [(max(a0, b0), min(a1, b1)) for (a0, a1), (b0, b1) in zip(inter, box)]
+            region = np.zeros(tuple(a1 - a0 for a0, a1 in part), dtype=out.dtype)
+            execute_read_plan(self.plan_tile(index, part, scale), region)
+
+            dst = tuple(slice(a0 - b0, a1 - b0) for (a0, a1), (b0, _) in zip(part, box))
+            if self.blending == "max":
+                np.maximum(total[dst], region, out=total[dst])
+            else:
+                total[dst] += region
+                weight[dst] += 1
+
+        if self.blending == "mean":
+            total /= weight  # every voxel of the box is covered by at least two tiles
+
+        # Truncated for integer outputs, like downsampling
+        out[(channel - key[0][0], *(slice(b0 - k0, b1 - k0) for (b0, b1), (k0, _) in zip(box, key[1:])))] = total
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError("SISF mosaics can not be modified.")
+
+    def __repr__(self):
+        return f"<sisf mosaic at {self.fname} ({len(self.tiles)} tiles, {self.shape}, {self.blending})>"
@@ -0,0 +1,150 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Packs a SISF archive folder into a single file (or a few large segment files), and back.
+
+A packed archive holds every file of the archive folder (`metadata.bin`, `meta/*.meta` and `data/*.data`) back to
+back, followed by an index of (key, segment, offset, size) entries. It is opened by `pySISF.sisf.sisf` like a
+folder, and read through memory maps by `pySISF.storage.PackedStorage`. `pySISF.sisf.create_sisf(..., packed=True)`
+writes a packed archive directly; other writers (`pySISF.tiff_utils`, `pySISF.rechunk`) write folders to be packed.
+
+Usage:
+    python -m pySISF.pack pack <archive folder> <archive.sisfpack> [--segment-size GB]
+    python -m pySISF.pack unpack <archive.sisfpack> <archive folder>
+"""
+
+import argparse
+import os
+import shutil
+import struct
+
+from pySISF.storage import (
+    PACK_ENTRY_LAYOUT,
+    PACK_HEADER_LAYOUT,
+    PACK_HEADER_SIZE,
+    PACK_MAGIC,
+    PACK_VERSION,
+    PackedStorage,
+    pack_segment_name,
+)
+
+COPY_BUFFER_SIZE = 16 * 2**20
+
+
+def archive_keys(archive):
+    """Returns the keys of every file of an archive folder, in the order they are packed."""
+    keys = ["metadata.bin"]
+    for folder in ["meta", "data"]:
+        keys.extend(f"{folder}/{name}" for name in sorted(os.listdir(os.path.join(archive, folder))))
+
+    return keys
+
+
+def pack(archive, fname, segment_size=None, progress=True):
+    """
+    Packs an archive folder into a single file.
+
+    Parameters:
+        archive (str): SISF archive folder.
+        fname (str): packed archive to create, usually ending in ".sisfpack".
+        segment_size (int, default None): if set, payloads continue in a new segment file (`fname.1`, `fname.2`, ...)
+            once a segment reaches this many bytes. Files are never split across segments.
+        progress (bool, default True): prints a loading bar using `tqdm`.
+
+    Returns:
+        Number of segment files written.
+    """
+    import tqdm
+
+    keys = archive_keys(archive)
+    index = []
+
+    segment = 0
+    with open(fname, "wb") as head:
+        head.write(bytes(PACK_HEADER_SIZE))  # written once the index location is known
+        offset = PACK_HEADER_SIZE
+
+        # Payloads go to `f`, the last segment; the first segment stays open for the index
+        f = head
+        try:
+            for key in tqdm.tqdm(keys, disable=not progress):
+                path = os.path.join(archive, key)
+                size = os.path.getsize(path)
+
+                segment_start = PACK_HEADER_SIZE if segment == 0 else 0
+                if segment_size is not None and offset > segment_start and offset + size > segment_size:
+                    if f is not head:
+                        f.close()
+                    segment += 1
+                    f = open(pack_segment_name(fname, segment), "wb")
+                    offset = 0
+
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, f, COPY_BUFFER_SIZE)
+                index.append((key, segment, offset, size))
+                offset += size
+        finally:
+            if f is not head:
+                f.close()
+
+        index_offset = head.seek(0, os.SEEK_END)
+        for key, entry_segment, entry_offset, size in index:
+            key_bin = key.encode("utf-8")
+            head.write(struct.pack(PACK_ENTRY_LAYOUT, entry_segment, entry_offset, size, len(key_bin)))
+            head.write(key_bin)
+        index_size = head.tell() - index_offset
+
+        head.seek(0)
+        head.write(struct.pack(PACK_HEADER_LAYOUT, PACK_MAGIC, PACK_VERSION, segment + 1, index_offset, index_size))
+
+    return segment + 1
+
+
+def unpack(fname, archive, progress=True):
+    """
+    Extracts a packed archive into an archive folder.
+
+    Parameters:
+        fname (str): packed archive.
+        archive (str): SISF archive folder to create.
+        progress (bool, default True): prints a loading bar using `tqdm`.
+    """
+    import tqdm
+
+    storage = PackedStorage(fname)
+
+    os.makedirs(os.path.join(archive, "data"), exist_ok=True)
+    os.makedirs(os.path.join(archive, "meta"), exist_ok=True)
+
+    for key in tqdm.tqdm(list(storage.keys()), disable=not progress):
+        with open(os.path.join(archive, key), "wb") as f:
+            f.write(storage.read(key))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a SISF archive folder into a single file, or unpack it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_pack = subparsers.add_parser("pack", help="pack an archive folder")
+    parser_pack.add_argument("archive", help="SISF archive folder")
+    parser_pack.add_argument("fname", help="packed archive to create")
+    parser_pack.add_argument("--segment-size", type=float, default=None, help="maximum segment size in GB")
+
+    parser_unpack = subparsers.add_parser("unpack", help="unpack a packed archive")
+    parser_unpack.add_argument("fname", help="packed archive")
+    parser_unpack.add_argument("archive", help="SISF archive folder to create")
+
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        segment_size = None if args.segment_size is None else int(args.segment_size * 1e9)
+        segments = pack(args.archive, args.fname, segment_size=segment_size)
+        print(f"Packed {args.archive} into {segments} segment(s).")
+    else:
+        unpack(args.fname, args.archive)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Rewrites an existing SISF archive with a different chunk size, codec or chunk order.
+
+The metachunk grid is kept, so every shard of the source (each channel and pyramid level) becomes exactly one shard
+of the destination. Each worker opens one source shard at a time and writes it through `pySISF.sisf.create_shard`
+from a `ShardSource`, which decodes source chunks as the new chunks need them and drops them once every new chunk
+overlapping them is written. No decoded metachunk is held in memory, and each source chunk is decoded once. Stored
+pyramid levels are rechunked as they are, not recomputed.
+
+Usage:
+    python -m pySISF.rechunk src dst --chunk-size 64x64x64 --compression 4
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from pySISF import analysis, sisf
+
+
+class ShardSource:
+    """
+    Read-only array-like view of a shard for `pySISF.sisf.create_shard`, decoding source chunks on demand.
+
+    Decoded source chunks are kept until every new chunk overlapping them has been read, so memory follows the
+    frontier of the write order rather than the size of the shard, whatever the chunk order.
+
+    Parameters:
+        shard (pySISF.sisf.sisf_chunk): shard to read.
+        chunk_size (3-tuple of int): chunk size of the new shard, which reads one new chunk at a time.
+    """
+
+    def __init__(self, shard, chunk_size):
+        self.shard = shard
+        self.shape = shard.shape
+        self.dtype = np.dtype(sisf.get_dtype(shard.dtype))
+
+        # Number of new chunks reading each source chunk
+        self.uses = defaultdict(int)
+        bounds = [sisf.iterate_bounded(self.shape[i], chunk_size[i]) for i in range(3)]
+        for key in itertools.product(*bounds):
+            for _, chunk_id, _, _ in shard.iter_plan(key):
+                self.uses[chunk_id] += 1
+
+        self.chunks = {}
+        self.lock = threading.Lock()
+
+    def get_chunk(self, chunk_id):
+        # Entries are [lock, decoded chunk], so that concurrent readers of a chunk decode it once
+        with self.lock:
+            entry = self.chunks.get(chunk_id)
+            if entry is None:
+                entry = self.chunks[chunk_id] = [threading.Lock(), None]
+
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = self.shard.decode_chunk(chunk_id, self.shard.fetch_chunks([chunk_id])[0])
+
+        with self.lock:
+            self.uses[chunk_id] -= 1
+            if self.uses[chunk_id] <= 0:
+                self.chunks.pop(chunk_id, None)
+
+        return entry[1]
+
+    def __getitem__(self, key):
+        key = sisf.parse_selection(key, self.shape)
+        out = np.empty([stop - start for start, stop in key], dtype=self.dtype)
+        for _, chunk_id, src, dst in self.shard.iter_plan(key):
+            out[dst] = self.get_chunk(chunk_id)[src]
+
+        return out
+
+
+def rechunk(
+    src,
+    dst,
+    chunk_size=None,
+    compression=None,
+    compression_opts=None,
+    order="c",
+    workers=2,
+    thread_count=8,
+    progress=True,
+):
+    """
+    Rewrites an archive into a new one.
+
+    Parameters:
+        src (str or pySISF.sisf.sisf): archive to read.
+        dst (str): archive folder to create.
+        chunk_size (3-tuple of int, default None): new chunk size, the source's if not set.
+        compression (int, default None): new compression codec, the source's if not set.
+        compression_opts (default None): codec options, passed to `create_shard`.
+        order (str, default "c"): chunk order of the new shards, see `create_shard`.
+        workers (int, default 2): number of shards rewritten in parallel.
+        thread_count (int, default 8): encoding threads of each shard, see `create_shard`.
+        progress (bool, default True): prints a loading bar with the decoded throughput using `tqdm`.
+
+    Returns:
+        dict with the number of "shards" written, "bytes_decoded" (raw voxel bytes), "bytes_written" (stored
+        destination bytes) and "seconds".
+    """
+    import tqdm
+
+    src = analysis.open_archive(src)
+    dtype = np.dtype(sisf.get_dtype(src.dtype))
+    if dst.endswith("/"):
+        dst = dst[:-1]
+
+    sisf.create_archive(dst, src.dtype, src.channel_count, src.mchunk, src.res, src.size)
+
+    tasks = []
+    counts = src.get_mchunk_counts()
+    for scalei in range(analysis.coarsest_scale(src).bit_length()):
+        for c in range(src.channel_count):
+            for i in range(counts[0]):
+                for j in range(counts[1]):
+                    for k in range(counts[2]):
+                        tasks.append((i, j, k, c, 2**scalei))
+
+    def rewrite(task):
+        # Opened here rather than with `get_shard`, so that its chunk table is freed once written
+        shard = src.get_chunk(*task)
+        shard_chunk_size = chunk_size if chunk_size is not None else shard.chunk_size
+        data = ShardSource(shard, shard_chunk_size)
+
+        fname_data, fname_meta = (f"{dst}/{key}" for key in sisf.sisf.shard_keys(*task))
+        sisf.create_shard(
+            fname_data,
+            fname_meta,
+            data,
+            shard_chunk_size,
+            compression if compression is not None else shard.compression_type,
+            compression_opts=compression_opts,
+            thread_count=thread_count,
+            progress=False,
+            order=order,
+        )
+
+        return int(np.prod(shard.shape)) * dtype.itemsize, os.path.getsize(fname_data) + os.path.getsize(fname_meta)
+
+    # Shards of a level tile it, so the level sizes give the total without opening every shard
+    total = 0
+    for scalei in range(analysis.coarsest_scale(src).bit_length()):
+        for c in range(src.channel_count):
+            total += int(np.prod(src.get_size(2**scalei, c))) * dtype.itemsize
+    out = {"shards": 0, "bytes_decoded": 0, "bytes_written": 0}
+    start = time.time()
+
+    with tqdm.tqdm(total=total, unit="B", unit_scale=True, disable=not progress) as status_bar:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(rewrite, task) for task in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                decoded, written = future.result()
+                out["shards"] += 1
+                out["bytes_decoded"] += decoded
+                out["bytes_written"] += written
+                status_bar.update(decoded)
+
+    out["seconds"] = time.time() - start
+    return out
+
+
+def parse_size(text):
+    return tuple(int(s) for s in text.split("x"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite a SISF archive with a new chunk size or codec.")
+    parser.add_argument("src", help="SISF archive to read")
+    parser.add_argument("dst", help="SISF archive folder to create")
+    parser.add_argument("--chunk-size", default=None, help="new chunk size, e.g. 64x64x64")
+    parser.add_argument("--compression", type=int, default=None, help="new compression codec")
+    parser.add_argument("--order", default="c", choices=sorted(sisf.CHUNK_ORDERS), help="chunk order")
+    parser.add_argument("--workers", type=int, default=2, help="shards rewritten in parallel")
+    args = parser.parse_args()
+
+    out = rechunk(
+        args.src,
+        args.dst,
+        chunk_size=None if args.chunk_size is None else parse_size(args.chunk_size),
+        compression=args.compression,
+        order=args.order,
+        workers=args.workers,
+    )
+
+    rate = out["bytes_decoded"] / max(out["seconds"], 1e-9) / 2**20
+    print(
+        f"Rewrote {out['shards']} shards in {out['seconds']:.1f} s ({rate:.1f} MiB/s decoded), "
+        f"{out['bytes_decoded'] / max(out['bytes_written'], 1):.2f}x compression."
+    )
+
+
+if __name__ == "__main__":
+    main()
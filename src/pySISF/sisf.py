@@ -6,8 +6,9 @@
 
 import struct
 import os
-import tqdm
+import zlib
 import itertools
+import threading
 import concurrent
 import concurrent.futures
 from collections import defaultdict
@@ -15,8 +16,11 @@ from collections import defaultdict
 import zstd
 import numpy as np
 
-from pySISF import sndif_utils # vidlib
-import h5ffmpeg
+from pySISF import metrics, segmentation
+from pySISF.storage import LocalStorage, open_storage
+
+# tqdm, h5ffmpeg (video codecs) and sndif_utils (numba) are imported where they are used, so that
+# reading zstd shards does not pay for importing them.
 
 METADATA_NAME = "metadata.bin"
 DEBUG = False
@@ -29,7 +33,35 @@ SHARD_HEADER_SIZE = struct.calcsize(SHARD_HEADER_LAYOUT)
 SHARD_LINE_LAYOUT = f"<QL"
 SHARD_LINE_SIZE = struct.calcsize(SHARD_LINE_LAYOUT)
 
-CURRENT_VERSION = 1
+# Version 2+ shards append a flags word to the shard header
+SHARD_HEADER_EXT_LAYOUT = "<H"
+SHARD_HEADER_EXT_SIZE = struct.calcsize(SHARD_HEADER_EXT_LAYOUT)
+SHARD_FLAG_STATS = 0x1
+SHARD_FLAG_CHECKSUM = 0x2
+
+# Order of the chunk payloads in the data file, stored in bits 4-5 of the flags word. The shard table is always
+# indexed by the C-order chunk id, only the placement of the payloads changes.
+SHARD_ORDER_SHIFT = 4
+SHARD_ORDER_MASK = 0x3 << SHARD_ORDER_SHIFT
+CHUNK_ORDERS = {"c": 0, "morton": 1, "hilbert": 2}
+
+# Shard table line with a CRC-32 of the stored (compressed) chunk, used when SHARD_FLAG_CHECKSUM is set
+SHARD_LINE_CHECKSUM_LAYOUT = "<QLL"
+SHARD_LINE_CHECKSUM_SIZE = struct.calcsize(SHARD_LINE_CHECKSUM_LAYOUT)
+
+# Per-chunk summary (min, max, mean, nonzero count), stored after the shard table
+SHARD_STATS_LAYOUT = "<dddQ"
+SHARD_STATS_SIZE = struct.calcsize(SHARD_STATS_LAYOUT)
+SHARD_STATS_DTYPE = np.dtype([("min", "<f8"), ("max", "<f8"), ("mean", "<f8"), ("nonzero", "<u8")])
+
+# Compression 4 stores each z-plane of a chunk as its own zstd frame, preceded by the frame sizes, so that plane
+# reads only decompress the planes they need
+FRAME_SIZE_DTYPE = np.dtype("<u4")
+
+# Header dtype codes
+DTYPES = {1: np.uint16, 2: np.uint8, 3: np.uint32, 4: np.float32, 5: np.uint64}
+
+CURRENT_VERSION = 2
 
 
 def iterate_bounded(max_val, step_size):
@@ -59,43 +91,175 @@ def create_metadata(version, dtype, channel_count, mchunk, res, size):
 
 def get_dtype_code(i):
     if type(i) is int:
-        if i in [1, 2]:
+        if i in DTYPES:
             return i
 
-    if i == np.uint16:
-        return 1
-    if i == np.uint8:
-        return 2
+    for code, dtype in DTYPES.items():
+        if i == dtype:
+            return code
 
-    raise TypeError("Unknown Data Type")
+    raise TypeError(f"Unknown Data Type {i}, supported types are {[np.dtype(d).name for d in DTYPES.values()]}")
 
 
-def create_shard_worker(data, coords, compression, compression_opts=None, buffer_size=None):
-    if buffer_size:
-        cs = (coords[1] - coords[0], coords[3] - coords[2], coords[5] - coords[4])
+def get_dtype(code):
+    """Returns the numpy dtype of a header dtype code."""
+    try:
+        return np.dtype(DTYPES[code])
+    except KeyError:
+        raise TypeError(f"Unknown Data Type code {code}") from None
 
-        if cs[0] == buffer_size[0] and cs[1] == buffer_size[1] and cs[2] == buffer_size[2]:
-            c = data[coords[0] : coords[1], coords[2] : coords[3], coords[4] : coords[5]]
-        else:
-            c = np.zeros(shape=buffer_size if buffer_size else cs, dtype=np.uint16)
-            c[: cs[0], : cs[1], : cs[2]] += data[coords[0] : coords[1], coords[2] : coords[3], coords[4] : coords[5]]
-    else:
-        c = data[coords[0] : coords[1], coords[2] : coords[3], coords[4] : coords[5]]
+
+def morton_index(coords, bits):
+    """Returns the Morton (Z-order) index of integer 3D coordinates, interleaving `bits` bits per axis."""
+    index = 0
+    for bit in range(bits - 1, -1, -1):
+        for x in coords:
+            index = (index << 1) | ((x >> bit) & 1)
+    return index
+
+
+def hilbert_index(coords, bits):
+    """
+    Returns the index of integer 3D coordinates along a Hilbert curve filling a cube of side 2**bits.
+
+    Uses Skilling's transform ("Programming the Hilbert curve", 2004) from axes to the transposed index.
+    """
+    x = list(coords)
+    n = len(x)
+
+    # Inverse undo excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for i in range(n):
+            if x[i] & q:
+                x[0] ^= p
+            else:
+                t = (x[0] ^ x[i]) & p
+                x[0] ^= t
+                x[i] ^= t
+        q >>= 1
+
+    # Gray encode
+    for i in range(1, n):
+        x[i] ^= x[i - 1]
+    t = 0
+    q = 1 << (bits - 1)
+    while q > 1:
+        if x[n - 1] & q:
+            t ^= q - 1
+        q >>= 1
+    for i in range(n):
+        x[i] ^= t
+
+    return morton_index(x, bits)
+
+
+def chunk_write_order(counts, order):
+    """
+    Returns the C-order ids of a (cx, cy, cz) chunk grid, in the order their payloads are stored.
+
+    Parameters:
+        counts (3-tuple of int): number of chunks along each axis.
+        order (int): one of the `CHUNK_ORDERS` values.
+    """
+    ids = list(range(counts[0] * counts[1] * counts[2]))
+    if order == CHUNK_ORDERS["c"]:
+        return ids
+
+    match order:
+        case 1:
+            curve = morton_index
+        case 2:
+            curve = hilbert_index
+        case _:
+            raise ValueError(f"Invalid chunk order {order}")
+
+    bits = max(1, max(counts) - 1).bit_length()
+    coords = itertools.product(range(counts[0]), range(counts[1]), range(counts[2]))
+    keys = [curve(c, bits) for c in coords]
+
+    return sorted(ids, key=keys.__getitem__)
+
+
+def compute_chunk_stats(c):
+    """Returns the (min, max, mean, nonzero count) summary of a chunk."""
+    if c.size == 0:
+        return (0.0, 0.0, 0.0, 0)
+    return (float(c.min()), float(c.max()), float(c.mean()), int(np.count_nonzero(c)))
+
+
+# Per-thread buffers reused across chunks by `create_shard_worker`
+_scratch = threading.local()
+
+
+def get_scratch(name, shape, dtype):
+    """Returns this thread's reusable buffer `name`, reallocated only when the shape or dtype changes."""
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+
+    buf = buffers.get(name)
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def as_contiguous(c, name):
+    """Returns `c` if it is C-contiguous, otherwise a copy in this thread's scratch buffer `name`."""
+    if c.flags.c_contiguous:
+        return c
+
+    buf = get_scratch(name, c.shape, c.dtype)
+    np.copyto(buf, c)
+    return buf
+
+
+def create_shard_worker(data, coords, compression, compression_opts=None, buffer_size=None, stats=False):
+    # Sliced once, `data` may decode on access (see `pySISF.rechunk.ShardSource`)
+    c = data[coords[0] : coords[1], coords[2] : coords[3], coords[4] : coords[5]]
+    chunk_stats = compute_chunk_stats(c) if stats else None
+
+    padded = buffer_size is not None and c.shape != tuple(buffer_size)
+    if padded:
+        # Zero-pad edge chunks to the full chunk size, zeroing only the padding of the reused buffer
+        cs = c.shape
+        buf = get_scratch("padded", buffer_size, c.dtype)
+        buf[: cs[0], : cs[1], : cs[2]] = c
+        buf[cs[0] :] = 0
+        buf[: cs[0], cs[1] :] = 0
+        buf[: cs[0], : cs[1], cs[2] :] = 0
+        c = buf
 
     # compress
+    t = metrics.start()
     match compression:
         case 0:
-            chunk_bin = c.tobytes(order="C")
-            return chunk_bin
+            # Contiguous views of the input are stored without a copy, reused scratch buffers must be copied
+            chunk_bin = c.tobytes(order="C") if padded or not c.flags.c_contiguous else memoryview(c).cast("B")
         case 1:
-            chunk_bin = c.tobytes(order="C")
-            return zstd.ZSTD_compress(chunk_bin, 9, 1)
+            chunk_bin = zstd.ZSTD_compress(as_contiguous(c, "chunk"), 9, 1)
         case 2:
-            return h5ffmpeg.compress_native(c, codec="libx264", **(compression_opts if compression_opts else {}))
+            import h5ffmpeg
+
+            chunk_bin = h5ffmpeg.compress_native(c, codec="libx264", **(compression_opts if compression_opts else {}))
         case 3:
-            return h5ffmpeg.compress_native(c, codec="libsvtav1", **(compression_opts if compression_opts else {}))
+            import h5ffmpeg
+
+            chunk_bin = h5ffmpeg.compress_native(c, codec="libsvtav1", **(compression_opts if compression_opts else {}))
+        case 4:
+            frames = [zstd.ZSTD_compress(as_contiguous(c[:, :, k], "plane"), 9, 1) for k in range(c.shape[2])]
+            frame_sizes = np.array([len(frame) for frame in frames], dtype=FRAME_SIZE_DTYPE)
+            chunk_bin = frame_sizes.tobytes() + b"".join(frames)
+        case 5:
+            # Fast zstd pass over the lookup tables and packed indices, as Neuroglancer does with gzip
+            chunk_bin = zstd.ZSTD_compress(segmentation.encode(c), 1, 1)
         case _:
             raise ValueError(f"Invalid compression parameter {compression}")
+    metrics.record("compress", t, c.nbytes)
+    metrics.count("chunks_encoded")
+
+    return (chunk_bin, chunk_stats) if stats else chunk_bin
 
 
 def create_shard(
@@ -109,6 +273,9 @@ def create_shard(
     chunk_batch=1024,
     crop=None,
     progress=True,
+    stats=True,
+    checksum=True,
+    order="c",
 ) -> None:
     """
     Function to create a SISF shard.
@@ -118,43 +285,70 @@ def create_shard(
         fname_meta (str): Name of the metadata file to create.
         data (3D numpy array-like): Raw data for the chunk.
         chunk_size (3-tuple of int): Size of each chunk
-        compression (int): compression codec to use
+        compression (int): compression codec to use, 0 (raw), 1 (zstd), 2 (x264), 3 (svt-av1),
+            4 (zstd, one frame per z-plane, for fast plane reads) or 5 (compressed segmentation, for labels)
         thread_count (int, default 8): number of threads to use for data packing
         chunk_batch (int, default 1024): number of jobs to allocate per thread for load balancing
         crop (3-tuple of int, default None): if set, encodes a crop factor into the shard
         progress (bool, default True): prints a loading bar using `tqdm`
+        stats (bool, default True): stores a per-chunk (min, max, mean, nonzero) summary after the shard table
+        checksum (bool, default True): stores a CRC-32 of each stored chunk in the shard table
+        order (str, default "c"): order of the chunk payloads in the data file, "c" (x-major), "morton" or
+            "hilbert". "hilbert" keeps 3D neighbourhoods close together in the file, so cubic regions and xy planes
+            need fewer, larger requests. "morton" only helps cubes aligned to power-of-two blocks of chunks. "c"
+            remains the better choice for xz and yz planes, which both curves split into more requests.
     """
-    dtype = 1
+    import tqdm
 
-    total_chunks = 1
-    for i in range(3):
-        total_chunks *= sum(1 for _ in iterate_bounded(data.shape[i], chunk_size[i]))
+    dtype = get_dtype_code(data.dtype)
+    if compression in (2, 3) and dtype not in (1, 2):
+        raise ValueError(f"Video compression {compression} only supports uint8 and uint16 data, not {data.dtype}")
+    if compression == 5 and not np.issubdtype(data.dtype, np.integer):
+        raise ValueError(f"Segmentation compression requires integer labels, not {data.dtype}")
 
-    def iter_chunks(executor):
-        for istart, iend in iterate_bounded(data.shape[0], chunk_size[0]):
-            for jstart, jend in iterate_bounded(data.shape[1], chunk_size[1]):
-                for kstart, kend in iterate_bounded(data.shape[2], chunk_size[2]):
-                    yield executor.submit(
-                        create_shard_worker,
-                        data,
-                        (istart, iend, jstart, jend, kstart, kend),
-                        compression,
-                        compression_opts=compression_opts,
-                        buffer_size=chunk_size if (compression==2 or compression==3) else None,
-                    )
+    if order not in CHUNK_ORDERS:
+        raise ValueError(f"Invalid chunk order {order}, expected one of {list(CHUNK_ORDERS)}")
 
-    chunk_table = []
+    bounds = [list(iterate_bounded(data.shape[i], chunk_size[i])) for i in range(3)]
+    chunk_coords = [(*bx, *by, *bz) for bx, by, bz in itertools.product(*bounds)]
+    total_chunks = len(chunk_coords)
+    write_order = chunk_write_order([len(b) for b in bounds], CHUNK_ORDERS[order])
+
+    def iter_chunks(executor):
+        for idx in write_order:
+            yield executor.submit(
+                create_shard_worker,
+                data,
+                chunk_coords[idx],
+                compression,
+                compression_opts=compression_opts,
+                buffer_size=chunk_size if (compression==2 or compression==3) else None,
+                stats=stats,
+            )
+
+    # Both tables are indexed by C-order chunk id, whatever the write order
+    chunk_table = [None] * total_chunks
+    chunk_stats = [None] * total_chunks
+    write_ids = iter(write_order)
     with open(fname_data, "wb") as fdata:
         with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
             futures = iter_chunks(executor)
 
-            with tqdm.tqdm(total=total_chunks) as pb:
+            with tqdm.tqdm(total=total_chunks, disable=not progress) as pb:
                 block_size = 512
                 while chunk := list(itertools.islice(futures, block_size)):
                     for future in chunk:
+                        idx = next(write_ids)
                         chunk_bin = future.result()
-                        chunk_table.append((fdata.tell(), len(chunk_bin)))
+                        if stats:
+                            chunk_bin, chunk_stats[idx] = chunk_bin
+                        t = metrics.start()
+                        if checksum:
+                            chunk_table[idx] = (fdata.tell(), len(chunk_bin), zlib.crc32(chunk_bin))
+                        else:
+                            chunk_table[idx] = (fdata.tell(), len(chunk_bin))
                         fdata.write(chunk_bin)
+                        metrics.record("write", t, len(chunk_bin))
                     pb.update(len(chunk))
 
     # Fill crop with default if not specified
@@ -186,12 +380,128 @@ def create_shard(
         )
     )
 
+    flags = 0
+    if stats:
+        flags |= SHARD_FLAG_STATS
+    if checksum:
+        flags |= SHARD_FLAG_CHECKSUM
+    flags |= CHUNK_ORDERS[order] << SHARD_ORDER_SHIFT
+    towrite.extend(struct.pack(SHARD_HEADER_EXT_LAYOUT, flags))
+
     # Write shard table
-    for o, s in chunk_table:
-        towrite.extend(struct.pack(SHARD_LINE_LAYOUT, o, s))
+    line_layout = SHARD_LINE_CHECKSUM_LAYOUT if checksum else SHARD_LINE_LAYOUT
+    for line in chunk_table:
+        towrite.extend(struct.pack(line_layout, *line))
+
+    # Write chunk statistics, in the same order as the shard table
+    if stats:
+        for s in chunk_stats:
+            towrite.extend(struct.pack(SHARD_STATS_LAYOUT, *s))
 
+    t = metrics.start()
     with open(fname_meta, "wb") as fmeta:
         fmeta.write(bytes(towrite))
+    metrics.record("write", t, len(towrite))
+
+
+def create_archive(fname, dtype_code, channel_count, mchunk_size, res, size):
+    """Creates the archive folder, its `data` and `meta` folders and the archive header."""
+    for folder_name in [fname, f"{fname}/data", f"{fname}/meta"]:
+        try:
+            os.mkdir(folder_name)
+        except FileExistsError:
+            pass  # folder exists
+
+    # Create Header
+    with open(f"{fname}/{METADATA_NAME}", "wb") as f:
+        header = create_metadata(CURRENT_VERSION, dtype_code, channel_count, mchunk_size, res, size)
+        f.write(header)
+
+
+def create_metachunk(
+    fname,
+    chunk_name,
+    chunk,
+    chunk_size,
+    compression,
+    downsampling=None,
+    thread_count=8,
+    compression_opts=None,
+    progress=True,
+    order="c",
+) -> None:
+    """
+    Writes the shards of one metachunk of one channel into an archive, with its downsampled pyramid.
+
+    Parameters:
+        fname (str): archive folder, with existing `data` and `meta` folders.
+        chunk_name (str): base name of the 1X shard, e.g. "chunk_0_0_0.0.1X".
+        chunk (3D numpy array): data of the metachunk.
+        downsampling (int, default None): How many downsample tiers to generate. Label data (compression 5) is
+            downsampled by taking the most frequent label, other data by averaging.
+        Other parameters are passed to `create_shard`.
+    """
+    from pySISF import sndif_utils
+
+    downsample = sndif_utils.downsample_mode if compression == 5 else sndif_utils.downsample
+
+    chunk_name_data = f"{fname}/data/{chunk_name}.data"
+    chunk_name_meta = f"{fname}/meta/{chunk_name}.meta"
+
+    # Save 1X image
+    create_shard(
+        chunk_name_data,
+        chunk_name_meta,
+        chunk,
+        chunk_size,
+        compression,
+        thread_count=thread_count,
+        compression_opts=compression_opts,
+        progress=progress,
+        order=order,
+    )
+
+    # Perform downsampling
+    if downsampling is not None:
+        downsample_pyramid = [chunk]
+
+        for scalei in range(downsampling):
+            # convert from 0, 1, 2, etc. -> 1X, 2X, 4X, etc.
+            scale = 2**scalei
+
+            # Skip basecase, already handled above
+            if scale == 1:
+                continue
+
+            # Generate downsampled file names
+            new_chunk_name_data = chunk_name_data.replace(".1X.", f".{scale}X.")
+            new_chunk_name_meta = chunk_name_meta.replace(".1X.", f".{scale}X.")
+
+            chunk_down = np.zeros(
+                shape=(
+                    max(1, downsample_pyramid[-1].shape[0] // 2),
+                    max(1, downsample_pyramid[-1].shape[1] // 2),
+                    max(1, downsample_pyramid[-1].shape[2] // 2),
+                ),
+                dtype=chunk.dtype,
+            )
+
+            # calculate downsampled image
+            downsample(downsample_pyramid[-1], chunk_down)
+            downsample_pyramid.append(chunk_down)
+
+            create_shard(
+                new_chunk_name_data,
+                new_chunk_name_meta,
+                downsample_pyramid[-1],
+                chunk_size,
+                compression,
+                thread_count=thread_count,
+                progress=progress,
+                order=order,
+            )
+
+        del downsample_pyramid
 
 
 def create_sisf(
@@ -205,6 +515,8 @@ def create_sisf(
     compression=1,
     thread_count=8,
     compression_opts=None,
+    order="c",
+    packed=False,
 ) -> None:
     """
     Function to create a SISF archive.
@@ -218,15 +530,36 @@ def create_sisf(
         downsampling (int, default None): How many downsample tiers to generate.
         compression (int, default 1->ZSTD): What compression codec to use.
         thread_count (int, default 8): How many threads to use for data packing.
+        order (str, default "c"): chunk order within each shard's data file, see `create_shard`.
+        packed (bool, default False): write a packed archive file at `fname` instead of a folder, see `pySISF.pack`.
+            The archive is written to a temporary folder next to `fname` first, so this needs twice its size on disk.
     """
+    import tqdm
+
     if fname.endswith("/"):
         fname = fname[:-1]
 
-    for folder_name in [fname, f"{fname}/data", f"{fname}/meta"]:
-        try:
-            os.mkdir(folder_name)
-        except FileExistsError:
-            pass  # folder exists
+    if packed:
+        import tempfile
+
+        from pySISF import pack
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(fname))) as folder:
+            create_sisf(
+                folder,
+                data,
+                mchunk_size,
+                chunk_size,
+                res,
+                enable_status=enable_status,
+                downsampling=downsampling,
+                compression=compression,
+                thread_count=thread_count,
+                compression_opts=compression_opts,
+                order=order,
+            )
+            pack.pack(folder, fname, progress=enable_status)
+        return
 
     if len(data.shape) == 3:
         channel_count = 1
@@ -238,14 +571,10 @@ def create_sisf(
         raise ValueError(f"Invalid image dimension size {data.shape}!")
 
     dtype_code = get_dtype_code(data.dtype)
-    # TODO handle dtype errors
 
     #print(channel_count, size)
 
-    # Create Header
-    with open(f"{fname}/{METADATA_NAME}", "wb") as f:
-        header = create_metadata(CURRENT_VERSION, dtype_code, channel_count, mchunk_size, res, size)
-        f.write(header)
+    create_archive(fname, dtype_code, channel_count, mchunk_size, res, size)
 
     # Calculate totals
     if enable_status:
@@ -266,11 +595,9 @@ def create_sisf(
 
                     # Generate file names
                     chunk_name = f"chunk_{i}_{j}_{k}.{c}.1X"
-                    chunk_name_data = f"{fname}/data/{chunk_name}.data"
-                    chunk_name_meta = f"{fname}/meta/{chunk_name}.meta"
 
                     # Make buffer of only this metachunk
-                    chunk = np.zeros((osizei, osizej, osizek), dtype=np.uint16)
+                    chunk = np.zeros((osizei, osizej, osizek), dtype=get_dtype(dtype_code))
 
                     if channel_count == 1:
                         chunk[...] = data[istart:iend, jstart:jend, kstart:kend]
@@ -279,101 +606,200 @@ def create_sisf(
                     else:
                         raise ValueError(f"Invalid channel count! ({channel_count})")
 
-                    # Save 1X image
-                    create_shard(
-                        chunk_name_data,
-                        chunk_name_meta,
+                    create_metachunk(
+                        fname,
+                        chunk_name,
                         chunk,
                         chunk_size,
                         compression,
+                        downsampling=downsampling,
                         thread_count=thread_count,
                         compression_opts=compression_opts,
+                        progress=enable_status,
+                        order=order,
                     )
 
-                    # Perform downsampling
-                    if downsampling is not None:
-                        downsample_pyramid = [chunk]
+                    if enable_status:
+                        status_bar.update(1)
 
-                        for scalei in range(downsampling):
-                            # convert from 0, 1, 2, etc. -> 1X, 2X, 4X, etc.
-                            scale = 2**scalei
+                    del chunk
 
-                            # Skip basecase, already handled above
-                            if scale == 1:
-                                continue
+    if enable_status:
+        status_bar.close()
 
-                            # Generate downsampled file names
-                            new_chunk_name_data = chunk_name_data.replace(".1X.", f".{scale}X.")
-                            new_chunk_name_meta = chunk_name_meta.replace(".1X.", f".{scale}X.")
 
-                            chunk_down = np.zeros(
-                                shape=(
-                                    max(1, downsample_pyramid[-1].shape[0] // 2),
-                                    max(1, downsample_pyramid[-1].shape[1] // 2),
-                                    max(1, downsample_pyramid[-1].shape[2] // 2),
-                                ),
-                                dtype=np.uint16,
-                            )
+READ_THREAD_COUNT = min(32, (os.cpu_count() or 1) + 4)
+# Maximum number of chunks of one shard fetched together by a read task
+READ_BATCH_SIZE = 16
+# Read plans are consumed this many chunks at a time, so large reads never hold a plan entry for every chunk
+READ_PLAN_WINDOW = 4096
+_read_executor = None
+_read_executor_lock = threading.Lock()
 
-                            # calculate downsampled image
-                            sndif_utils.downsample(downsample_pyramid[-1], chunk_down)
-                            downsample_pyramid.append(chunk_down)
 
-                            # Assign offsets, but not relevant here
+def get_read_executor():
+    """Returns the thread pool shared by all SISF reads, created on first use with `READ_THREAD_COUNT` threads."""
+    global _read_executor
+    with _read_executor_lock:
+        if _read_executor is None:
+            _read_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=READ_THREAD_COUNT, thread_name_prefix="sisf-read"
+            )
+    return _read_executor
 
-                            create_shard(
-                                new_chunk_name_data,
-                                new_chunk_name_meta,
-                                downsample_pyramid[-1],
-                                chunk_size,
-                                compression,
-                                thread_count=thread_count,
-                            )
 
-                        del downsample_pyramid
+def batch_read_plan(plan, batch_size=READ_BATCH_SIZE):
+    """
+    Groups the entries of a read plan into batches of up to `batch_size` chunks of the same shard, in file order,
+    so that each batch covers a compact range of the data file and is read with one coalesced request.
+    """
+    batches = []
+    by_shard = defaultdict(list)
+    for task in plan:
+        by_shard[id(task[0])].append(task)
+    for tasks in by_shard.values():
+        tasks.sort(key=lambda task: task[0].chunk_rank(task[1]))
+        batches.extend(tasks[i : i + batch_size] for i in range(0, len(tasks), batch_size))
 
-                    if enable_status:
-                        status_bar.update(1)
+    return batches
 
-                    del chunk
 
-    if enable_status:
-        status_bar.close()
+def run_read_plan(plan, func, batch_size=READ_BATCH_SIZE, window=READ_PLAN_WINDOW):
+    """
+    Decodes every chunk of a read plan on the shared read executor, calling `func(chunk, dst)` with the selected
+    part of each chunk and its output index. `func` is called from several threads at once.
 
+    Each plan entry is (shard, chunk id, source slices, output index), as produced by `sisf_chunk.plan_read`.
+    The plan may be any iterable, such as `sisf.iter_plan`, and is consumed `window` entries at a time.
+    """
 
-class sisf_chunk:
-    def parse_metadata(self):
-        with open(self.fname_meta, "rb") as f:
-            self.header_bin = f.read(SHARD_HEADER_SIZE)
-            self.header = struct.unpack(SHARD_HEADER_LAYOUT, self.header_bin)
+    def run(batch):
+        shard = batch[0][0]
+        blobs = shard.fetch_chunks([chunk_id for _, chunk_id, _, _ in batch])
+
+        for (_, chunk_id, src, dst), blob in zip(batch, blobs):
+            # Only the selected z-planes are decoded when the codec allows it
+            chunk = shard.decode_chunk(chunk_id, blob, planes=src[2])
+            func(chunk[src[0], src[1]], dst)
+
+    plan = iter(plan)
+    while entries := list(itertools.islice(plan, window)):
+        batches = batch_read_plan(entries, batch_size)
+
+        if len(batches) <= 1:
+            for batch in batches:
+                run(batch)
+            continue
+
+        # Consume the iterator so that the first worker exception is raised here
+        for _ in get_read_executor().map(run, batches):
+            pass
+
+
+def execute_read_plan(plan, out, batch_size=READ_BATCH_SIZE):
+    """
+    Decodes every chunk of a read plan and copies it straight into `out`, see `run_read_plan`.
+
+    Entries write disjoint regions of `out`, so they can run in any order.
+    """
+
+    def copy(chunk, dst):
+        t = metrics.start()
+        out[dst] = chunk
+        metrics.record("copy", t, chunk.nbytes)
+
+    run_read_plan(plan, copy, batch_size)
+
+
+def parse_selection(key, shape):
+    """
+    Converts a selection, one int, slice or (start, stop) pair per axis of `shape`, into (start, stop) pairs and
+    checks its bounds.
+    """
+    if len(key) != len(shape):
+        raise AttributeError(f"Array access must specify all {len(shape)} dimensions.")
+
+    keys = []
+    for a, size in zip(key, shape):
+        if type(a) is int:
+            keys.append((a, a + 1))
+        elif type(a) is slice:
+            if a.step is not None:
+                raise AttributeError("Stepped selection is not supported.")
+            keys.append((a.start if a.start is not None else 0, a.stop if a.stop is not None else size))
+        elif isinstance(a, tuple) and len(a) == 2:
+            keys.append((int(a[0]), int(a[1])))
+        else:
+            raise NotImplementedError("Unknown selector type")
+
+    for i, (start, stop) in enumerate(keys):
+        if stop < start:
+            raise AttributeError("Incorrect parameter ordering.")
+        if start < 0 or stop < 0:
+            raise NotImplementedError("Negative indexing not implemented.")
+        if stop > shape[i] or start >= shape[i]:
+            raise IndexError(f"Axis {i} selection ({start, stop}) out of range ({shape[i]}).")
+
+    return keys
+
+
+def prepare_output(key, out, dtype):
+    """Returns `out` after checking it matches the selection `key`, or a new zeroed array if `out` is None."""
+    shape = tuple(stop - start for start, stop in key)
+    if out is None:
+        return np.zeros(shape=shape, dtype=dtype)
+    if tuple(out.shape) != shape:
+        raise ValueError(f"Output shape {tuple(out.shape)} does not match selection shape {shape}")
 
-            self.header_parsed = {
-                "version": self.header[0],
-                "dtype": self.header[1],
-                "channel_count": self.header[2],
-                "compression_type": self.header[3],
-                "chunk_size": tuple(self.header[4:7]),
-                "size": tuple(self.header[7:10]),
-                "crop": tuple(self.header[10:16]),
-            }
+    return out
 
-            if self.cache is not None:
-                index_table_bin = f.read()
 
-                i = 0
-                iterable = iter(index_table_bin)
-                while True:
-                    chunk = bytes(itertools.islice(iterable, SHARD_LINE_SIZE))
+class sisf_chunk:
+    def parse_metadata(self):
+        t = metrics.start()
+
+        # Version 1 headers have no extension, the extra bytes are then part of the shard table
+        header_bin = self.storage.read(self.fname_meta, 0, SHARD_HEADER_SIZE + SHARD_HEADER_EXT_SIZE)
+        if len(header_bin) < SHARD_HEADER_SIZE:
+            raise ValueError(f"Invalid read size {len(header_bin)} when loading shard header")
+
+        self.header_bin = header_bin[:SHARD_HEADER_SIZE]
+        self.header = struct.unpack(SHARD_HEADER_LAYOUT, self.header_bin)
+
+        self.header_parsed = {
+            "version": self.header[0],
+            "dtype": self.header[1],
+            "channel_count": self.header[2],
+            "compression_type": self.header[3],
+            "chunk_size": tuple(self.header[4:7]),
+            "size": tuple(self.header[7:10]),
+            "crop": tuple(self.header[10:16]),
+            "flags": 0,
+        }
+
+        self.table_offset = SHARD_HEADER_SIZE
+        if self.header_parsed["version"] >= 2:
+            self.header_parsed["flags"] = struct.unpack_from(SHARD_HEADER_EXT_LAYOUT, header_bin, SHARD_HEADER_SIZE)[0]
+            self.table_offset += SHARD_HEADER_EXT_SIZE
+
+        if self.header_parsed["flags"] & SHARD_FLAG_CHECKSUM:
+            self.line_layout, self.line_size = SHARD_LINE_CHECKSUM_LAYOUT, SHARD_LINE_CHECKSUM_SIZE
+        else:
+            self.line_layout, self.line_size = SHARD_LINE_LAYOUT, SHARD_LINE_SIZE
 
-                    if len(chunk) == 0:
-                        break
-                    elif len(chunk) < SHARD_LINE_SIZE:
-                        raise ValueError(f"Invalid read size {len(chunk)} when loading metadata cache")
+        chunk_size = self.header_parsed["chunk_size"]
+        size = self.header_parsed["size"]
+        self.chunk_count = 1
+        for i in range(3):
+            self.chunk_count *= (size[i] + chunk_size[i] - 1) // chunk_size[i]
 
-                    self.cache[i] = struct.unpack(SHARD_LINE_LAYOUT, chunk)
+        if self.cache is not None:
+            index_table_bin = self.storage.read(self.fname_meta, self.table_offset, self.chunk_count * self.line_size)
 
-                    i += 1
+            if len(index_table_bin) != self.chunk_count * self.line_size:
+                raise ValueError(f"Invalid read size {len(index_table_bin)} when loading metadata cache")
 
+            self.cache = dict(enumerate(struct.iter_unpack(self.line_layout, index_table_bin)))
 
         self.version = self.header_parsed["version"]
         self.dtype = self.header_parsed["dtype"]
@@ -382,6 +808,7 @@ class sisf_chunk:
         self.size = self.header_parsed["size"]
         self.compression_type = self.header_parsed["compression_type"]
         self.crop = self.header_parsed["crop"]
+        self.flags = self.header_parsed["flags"]
 
         self.crop = [(self.crop[i * 2], self.crop[(i * 2) + 1]) for i in range(3)]
 
@@ -392,12 +819,28 @@ class sisf_chunk:
         self.countz = (self.size[2] + self.chunk_size[2] - 1) // self.chunk_size[2]
 
         self.chunk_counts = [self.countx, self.county, self.countz]
-
-    def __init__(self, fname_data, fname_meta, parent=None, cache_metadata=False):
+        metrics.record("metadata", t)
+
+    def __init__(
+        self, fname_data, fname_meta, parent=None, cache_metadata=False, verify_checksums=False, storage=None
+    ):
+        """
+        Opens a SISF shard.
+
+        Parameters:
+            fname_data (str): data file name, a key of `storage`.
+            fname_meta (str): metadata file name, a key of `storage`.
+            cache_metadata (bool, default False): load the whole shard table up front.
+            verify_checksums (bool, default False): check each chunk against its stored CRC-32.
+            storage (pySISF.storage.Storage, default None): backend to read from, local files if not set.
+        """
         self.parent = parent
         self.fname_data = fname_data
         self.fname_meta = fname_meta
         self.cache = {} if cache_metadata else None
+        self.verify_checksums = verify_checksums
+        self.storage = storage if storage is not None else LocalStorage()
+        self.chunk_ranks = None
 
         self.parse_metadata()
 
@@ -408,44 +851,154 @@ class sisf_chunk:
 
         return (ix * self.countz * self.county) + (iy * self.countz) + iz
 
-    def get_metadata(self, idx):
+    def get_index_entry(self, idx):
+        """Returns the shard table line of chunk `idx`: (offset, size) or (offset, size, crc32)."""
         if self.cache is not None:
             if idx in self.cache:
+                metrics.count("metadata_cache_hit")
                 return self.cache[idx]
 
-        with open(self.fname_meta, "rb") as f:
-            f.seek(SHARD_HEADER_SIZE + (SHARD_LINE_SIZE * idx))
-            meta_bin = f.read(SHARD_LINE_SIZE)
-            if len(meta_bin) != SHARD_LINE_SIZE:
+        metrics.count("metadata_cache_miss")
+        meta_bin = self.storage.read(self.fname_meta, self.table_offset + (self.line_size * idx), self.line_size)
+        if len(meta_bin) != self.line_size:
+            raise ValueError(f"Invalid read size {len(meta_bin)}, likely invalid chunk id {idx}")
+
+        return struct.unpack(self.line_layout, meta_bin)
+
+    def get_index_entries(self, ids):
+        """Like `get_index_entry` for several chunks, reading the uncached table lines with coalesced requests."""
+        if self.cache is not None and all(idx in self.cache for idx in ids):
+            metrics.count("metadata_cache_hit", len(ids))
+            return [self.cache[idx] for idx in ids]
+        if len(ids) == 1:
+            return [self.get_index_entry(ids[0])]
+
+        metrics.count("metadata_cache_miss", len(ids))
+        ranges = [(self.table_offset + (self.line_size * idx), self.line_size) for idx in ids]
+        entries = []
+        for idx, meta_bin in zip(ids, self.storage.read_ranges(self.fname_meta, ranges)):
+            if len(meta_bin) != self.line_size:
                 raise ValueError(f"Invalid read size {len(meta_bin)}, likely invalid chunk id {idx}")
-            read_offset, read_size = struct.unpack(SHARD_LINE_LAYOUT, meta_bin)
+            entries.append(struct.unpack(self.line_layout, meta_bin))
 
+        return entries
+
+    def get_metadata(self, idx):
+        read_offset, read_size = self.get_index_entry(idx)[:2]
         return (read_offset, read_size)
 
+    @property
+    def has_checksums(self):
+        return bool(self.flags & SHARD_FLAG_CHECKSUM)
+
+    @property
+    def has_stats(self):
+        return bool(self.flags & SHARD_FLAG_STATS)
+
+    @property
+    def chunk_order(self):
+        """Order of the chunk payloads in the data file, one of the `CHUNK_ORDERS` values."""
+        return (self.flags & SHARD_ORDER_MASK) >> SHARD_ORDER_SHIFT
+
+    def chunk_rank(self, idx):
+        """Returns the position of chunk `idx` in the data file's write order."""
+        if self.chunk_order == CHUNK_ORDERS["c"]:
+            return idx
+
+        if self.chunk_ranks is None:
+            ranks = [0] * self.chunk_count
+            for rank, chunk_id in enumerate(chunk_write_order(self.chunk_counts, self.chunk_order)):
+                ranks[chunk_id] = rank
+            self.chunk_ranks = ranks
+
+        return self.chunk_ranks[idx]
+
+    def chunk_stats(self):
+        """
+        Returns the stored per-chunk summary without reading any chunk payload.
+
+        Returns:
+            dict of numpy arrays ("min", "max", "mean", "nonzero"), each shaped as the chunk grid
+            (countx, county, countz) and indexed like `get_chunk_coords`.
+        """
+        if not self.has_stats:
+            raise ValueError(f"Shard {self.fname_meta} was written without chunk statistics.")
+
+        stats_offset = self.table_offset + (self.line_size * self.chunk_count)
+        stats_bin = self.storage.read(self.fname_meta, stats_offset, SHARD_STATS_SIZE * self.chunk_count)
+
+        if len(stats_bin) != SHARD_STATS_SIZE * self.chunk_count:
+            raise ValueError(f"Invalid read size {len(stats_bin)} when loading chunk statistics")
+
+        table = np.frombuffer(stats_bin, dtype=SHARD_STATS_DTYPE).reshape(self.chunk_counts)
+        return {name: table[name] for name in SHARD_STATS_DTYPE.names}
+
+    def fetch_chunks(self, ids):
+        """
+        Reads the stored (compressed) bytes of several chunks, coalescing nearby chunks into larger requests.
+
+        Returns:
+            List of bytes-like objects in the order of `ids`.
+        """
+        entries = self.get_index_entries(ids)
+        blobs = self.storage.read_ranges(self.fname_data, [entry[:2] for entry in entries])
+
+        if self.verify_checksums and self.has_checksums:
+            for idx, entry, blob in zip(ids, entries, blobs):
+                if zlib.crc32(blob) != entry[2]:
+                    raise ValueError(f"Checksum mismatch for chunk {idx} of {self.fname_data}")
+
+        return blobs
+
     def get_chunk(self, idx):
-        meta_off, meta_size = self.get_metadata(idx)
-        with open(self.fname_data, "rb") as f:
-            f.seek(meta_off)
-            chunk_compressed = f.read(meta_size)
+        return self.decode_chunk(idx, self.fetch_chunks([idx])[0])
 
+    def decode_chunk(self, idx, chunk_compressed, planes=None):
+        """
+        Decodes the stored bytes of chunk `idx`, as returned by `fetch_chunks`.
+
+        Parameters:
+            planes (slice, default None): z-planes of the chunk to return, all of them if not set. Only compression 4
+                decodes a subset; other codecs decode the whole chunk and slice it.
+        """
+        t = metrics.start()
         sx, sy, sz = self.get_chunk_size(idx)
 
         match self.compression_type:
             case 0:
                 chunk_decompressed = chunk_compressed
-                out = np.frombuffer(chunk_decompressed, dtype=(np.uint16 if self.dtype == 1 else np.uint8))
+                out = np.frombuffer(chunk_decompressed, dtype=get_dtype(self.dtype))
                 out = out.reshape((sx, sy, sz))
             case 1:
-                chunk_decompressed = zstd.decompress(chunk_compressed)
-                out = np.frombuffer(chunk_decompressed, dtype=(np.uint16 if self.dtype == 1 else np.uint8))
+                chunk_decompressed = zstd.decompress(bytes(chunk_compressed))
+                out = np.frombuffer(chunk_decompressed, dtype=get_dtype(self.dtype))
                 out = out.reshape((sx, sy, sz))
             case 2 | 3:
-                out = h5ffmpeg.decompress_native(chunk_compressed)
+                import h5ffmpeg
+
+                out = h5ffmpeg.decompress_native(bytes(chunk_compressed))
                 out = out[:sx, :sy, :sz]  # crop to size, discard padding
+            case 4:
+                frame_sizes = np.frombuffer(chunk_compressed, dtype=FRAME_SIZE_DTYPE, count=sz)
+                frame_offsets = np.cumsum(frame_sizes) - frame_sizes + frame_sizes.nbytes
+                kstart, kend, _ = (planes if planes is not None else slice(None)).indices(sz)
+
+                out = np.empty((sx, sy, max(0, kend - kstart)), dtype=get_dtype(self.dtype))
+                for k in range(kstart, kend):
+                    frame = chunk_compressed[frame_offsets[k] : frame_offsets[k] + frame_sizes[k]]
+                    out[:, :, k - kstart] = np.frombuffer(zstd.decompress(bytes(frame)), dtype=out.dtype).reshape(
+                        (sx, sy)
+                    )
+                planes = None  # already applied
+            case 5:
+                chunk_decompressed = zstd.decompress(bytes(chunk_compressed))
+                out = segmentation.decode(chunk_decompressed, (sx, sy, sz), get_dtype(self.dtype))
             case _:
                 raise NotImplementedError(f"Decompression type {self.compression_type} not implemented.")
+        metrics.record("decompress", t, out.nbytes)
+        metrics.count("chunks_decoded")
 
-        return out
+        return out if planes is None else out[:, :, planes]
 
     def get_chunk_coords(self, idx):
         dx = idx // (self.countz * self.county)
@@ -486,74 +1039,74 @@ class sisf_chunk:
         return chunk[coffset]
 
     def __getitem__(self, key):
-        if len(key) != 3:
-            raise AttributeError("Array access must specify all 3 dimensions.")
-
-        for s in key:
-            if type(s) is slice:
-                if s.step is not None:
-                    raise AttributeError("Stepped selection is not supported.")
-
-        keys = []
-        for i, a in enumerate(key):
-            if type(a) is int:
-                keys.append((a, a + 1))
-            elif type(a) is slice:
-                keys.append(
-                    (
-                        a.start if a.start is not None else 0,
-                        a.stop if a.stop is not None else self.shape[i],
-                    )
-                )
-            else:
-                raise NotImplementedError("Unknown selector type")
-        key = keys
+        return self.read(key)
 
-        for i, (start, stop) in enumerate(key):
-            if stop < start:
-                raise AttributeError("Incorrect parameter ordering.")
-            if start < 0 or stop < 0:
-                raise NotImplementedError("Negative indexing not implemented.")
+    def read(self, key, out=None):
+        """
+        Reads a selection chunk by chunk, straight into `out`.
 
-            if stop > self.shape[i] or start >= self.shape[i]:
-                raise IndexError(f"Axis {i} selection ({start, stop}) out of range ({self.shape[i]}).")
+        Parameters:
+            key (3 selectors): int, slice or (start, stop) pair per axis, in cropped shard coordinates.
+            out (writable 3D array, default None): destination shaped as the selection, e.g. a reused buffer or an
+                `np.memmap`, so that no full-size array is allocated. A new array if not set.
 
-        # Define output variable
-        outshape = tuple(stop - start for start, stop in keys)
-        out = np.zeros(shape=outshape, dtype=np.uint16)  # TODO should dynamically change dtype
+        Returns:
+            `out`
+        """
+        key = parse_selection(key, self.shape)
+        out = prepare_output(key, out, get_dtype(self.dtype))
+
+        execute_read_plan(self.iter_plan(key), out)
+
+        return out
 
+    def plan_read(self, key, out_prefix=(), out_offset=(0, 0, 0)):
+        """
+        Lists the chunk reads needed for a selection, without reading any chunk.
+
+        Parameters:
+            key (3 (start, stop) pairs): selection in cropped shard coordinates.
+            out_prefix (tuple, default ()): leading output indices, e.g. the channel of a 4D output.
+            out_offset (3-tuple of int, default (0, 0, 0)): position of the selection in the output.
+
+        Returns:
+            List of (shard, chunk id, source slices, output index) tuples, see `execute_read_plan`.
+        """
+        return list(self.iter_plan(key, out_prefix, out_offset))
+
+    def iter_plan(self, key, out_prefix=(), out_offset=(0, 0, 0)):
+        """Like `plan_read`, but yields the plan entries one at a time."""
         # Shift stop and start to match crop
-        keys = tuple((start + crop_start, stop + crop_start) for (crop_start, _), (start, stop) in zip(self.crop, key))
+        key = tuple((start + crop_start, stop + crop_start) for (crop_start, _), (start, stop) in zip(self.crop, key))
 
-        xstart = 0
+        xstart = out_offset[0]
         for (cxstart, _), (sxstart, sxend) in sisf_chunk.iterate_chunks(key[0][0], key[0][1], self.chunk_size[0]):
             xsize = sxend - sxstart
-            ystart = 0
+            ystart = out_offset[1]
             for (cystart, _), (systart, syend) in sisf_chunk.iterate_chunks(key[1][0], key[1][1], self.chunk_size[1]):
                 ysize = syend - systart
-                zstart = 0
+                zstart = out_offset[2]
                 for (czstart, _), (szstart, szend) in sisf_chunk.iterate_chunks(
                     key[2][0], key[2][1], self.chunk_size[2]
                 ):
                     zsize = szend - szstart
 
-                    chunk_id = self.find_index(cxstart, cystart, czstart)
-                    chunk = self.get_chunk_numpy(chunk_id)
-
-                    out[
-                        xstart : xstart + xsize,
-                        ystart : ystart + ysize,
-                        zstart : zstart + zsize,
-                    ] = chunk[sxstart:sxend, systart:syend, szstart:szend]
-
-                    del chunk
+                    yield (
+                        self,
+                        self.find_index(cxstart, cystart, czstart),
+                        (slice(sxstart, sxend), slice(systart, syend), slice(szstart, szend)),
+                        (
+                            *out_prefix,
+                            slice(xstart, xstart + xsize),
+                            slice(ystart, ystart + ysize),
+                            slice(zstart, zstart + zsize),
+                        ),
+                    )
 
                     zstart += zsize
                 ystart += ysize
             xstart += xsize
 
-        return out
-
     def __repr__(self):
         return f"<sif chunk {self.fname_data}/{self.fname_meta} {self.shape}>"
 
@@ -574,18 +1127,17 @@ class sisf_chunk:
 
 class sisf:
     def parse_metadata(self):
-        with open(f"{self.fname}/{METADATA_NAME}", "rb") as f:
-            self.header_bin = f.read(HEADER_SIZE)
-            self.header = struct.unpack(HEADER_LAYOUT, self.header_bin)
-
-            self.header_parsed = {
-                "version": self.header[0],
-                "dtype": self.header[1],
-                "channel_count": self.header[2],
-                "mchunk": self.header[3:6],
-                "res": self.header[6:9],
-                "size": self.header[9:12],
-            }
+        self.header_bin = self.storage.read(METADATA_NAME, 0, HEADER_SIZE)
+        self.header = struct.unpack(HEADER_LAYOUT, self.header_bin)
+
+        self.header_parsed = {
+            "version": self.header[0],
+            "dtype": self.header[1],
+            "channel_count": self.header[2],
+            "mchunk": self.header[3:6],
+            "res": self.header[6:9],
+            "size": self.header[9:12],
+        }
 
         self.version = self.header_parsed["version"]
         self.dtype = self.header_parsed["dtype"]
@@ -594,14 +1146,27 @@ class sisf:
         self.res = self.header_parsed["res"]
         self.size = self.header_parsed["size"]
 
-    def __init__(self, fname, cache_metadata=False):
+    def __init__(self, fname, cache_metadata=False, verify_checksums=False, storage=None):
+        """
+        Opens a SISF archive.
+
+        Parameters:
+            fname (str): archive folder, or a URL such as "https://host/archive" or "s3://bucket/archive".
+            cache_metadata (bool, default False): load each shard table once, on first access.
+            verify_checksums (bool, default False): check each chunk against its stored CRC-32.
+            storage (pySISF.storage.Storage, default None): backend holding the archive, chosen from `fname`
+                with `pySISF.storage.open_storage` if not set.
+        """
         self.fname = fname
         if self.fname.endswith("/"):
             self.fname = self.fname[:-1]
 
         self.cache_metadata = cache_metadata
+        self.verify_checksums = verify_checksums
+        self.storage = storage if storage is not None else open_storage(self.fname)
 
-        # self.chunk_lock = thread.Mutex()
+        self.shards = {}
+        self.shards_lock = threading.Lock()
 
         self.parse_metadata()
 
@@ -609,55 +1174,143 @@ class sisf:
     def shape(self):
         return (self.channel_count, *self.size)
 
-    def get_chunk(self, x, y, z, c, s):
+    def get_size(self, scale=1, channel=0):
+        """
+        Returns the XYZ size of pyramid level `scale`, from the shards of the last metachunk along each axis.
+        Rounding can make it differ from the 1X size divided by `scale`.
+        """
+        if scale == 1:
+            return tuple(self.size)
+
+        counts = self.get_mchunk_counts()
+        size = []
+        for axis in range(3):
+            last = [0, 0, 0]
+            last[axis] = counts[axis] - 1
+            shard = self.get_shard(*last, channel, scale)
+            size.append(last[axis] * (self.mchunk[axis] // scale) + shard.shape[axis])
+
+        return tuple(size)
+
+    def get_shape(self, scale=1):
+        """Shape of pyramid level `scale`."""
+        return (self.channel_count, *self.get_size(scale))
+
+    def get_shard(self, x, y, z, c, s):
+        """Like `get_chunk`, but keeps the opened shard for later reads."""
+        key = (x, y, z, c, s)
+        with self.shards_lock:
+            if key not in self.shards:
+                self.shards[key] = self.get_chunk(x, y, z, c, s)
+            return self.shards[key]
+
+    @staticmethod
+    def shard_keys(x, y, z, c, s):
+        """Returns the data and metadata keys of the shard of metachunk (x, y, z), channel `c` and scale `s`."""
         chunk_fname = f"chunk_{x}_{y}_{z}.{c}.{s}X"
-        fname_data = f"{self.fname}/data/{chunk_fname}.data"
-        fname_meta = f"{self.fname}/meta/{chunk_fname}.meta"
+        return f"data/{chunk_fname}.data", f"meta/{chunk_fname}.meta"
+
+    def get_chunk(self, x, y, z, c, s):
+        fname_data, fname_meta = self.shard_keys(x, y, z, c, s)
+
+        return sisf_chunk(
+            fname_data,
+            fname_meta,
+            parent=self,
+            cache_metadata=self.cache_metadata,
+            verify_checksums=self.verify_checksums,
+            storage=self.storage,
+        )
 
-        return sisf_chunk(fname_data, fname_meta, parent=self, cache_metadata=self.cache_metadata)
+    def get_mchunk_counts(self):
+        return tuple((self.size[i] + self.mchunk[i] - 1) // self.mchunk[i] for i in range(3))
+
+    def chunk_stats(self, channel=0, scale=1):
+        """
+        Collects the stored per-chunk summaries of every metachunk without decompressing any data.
+
+        Parameters:
+            channel (int, default 0): channel to query.
+            scale (int, default 1): pyramid level to query (1, 2, 4, ...).
+
+        Returns:
+            dict of 1D numpy arrays "min", "max", "mean" and "nonzero" (one entry per chunk), plus "bounds",
+            an (N, 6) array of (xstart, xend, ystart, yend, zstart, zend) chunk extents in scaled archive coordinates.
+        """
+        out = defaultdict(list)
+
+        counts = self.get_mchunk_counts()
+        mcs = [m // scale for m in self.mchunk]
+
+        for i in range(counts[0]):
+            for j in range(counts[1]):
+                for k in range(counts[2]):
+                    shard = self.get_chunk(i, j, k, channel, scale)
+                    table = shard.chunk_stats()
+
+                    for name, values in table.items():
+                        out[name].append(values.ravel())
+
+                    bounds = np.zeros((shard.chunk_count, 6), dtype=np.int64)
+                    for idx in range(shard.chunk_count):
+                        coords = shard.get_chunk_coords(idx)
+                        sizes = shard.get_chunk_size(idx)
+                        for axis, origin in enumerate((i, j, k)):
+                            start = origin * mcs[axis] + coords[axis] * shard.chunk_size[axis]
+                            bounds[idx, 2 * axis] = start
+                            bounds[idx, 2 * axis + 1] = start + sizes[axis]
+                    out["bounds"].append(bounds)
+
+        return {name: np.concatenate(values) for name, values in out.items()}
+
+    def find_chunks(self, threshold, channel=0, scale=1):
+        """
+        Returns the (N, 6) bounds of every chunk whose maximum is at least `threshold`, using only the stored
+        chunk statistics.
+        """
+        table = self.chunk_stats(channel=channel, scale=scale)
+        return table["bounds"][table["max"] >= threshold]
 
     def __getitem__(self, key):
-        if len(key) != 4:
-            raise AttributeError("Array access must specify all 4 dimensions.")
-
-        for s in key:
-            if type(s) is slice:
-                if s.step is not None:
-                    raise AttributeError("Stepped selection is not supported.")
-
-        keys = []
-        for i, a in enumerate(key):
-            if type(a) is int:
-                keys.append((a, a + 1))
-            elif type(a) is slice:
-                keys.append(
-                    (
-                        a.start if a.start is not None else 0,
-                        a.stop if a.stop is not None else self.shape[i],
-                    )
-                )
-            else:
-                raise NotImplementedError("Unknown selector type")
-        key = keys
-
-        for i, (start, stop) in enumerate(key):
-            if stop < start:
-                raise AttributeError("Incorrect parameter ordering.")
-            if start < 0 or stop < 0:
-                raise NotImplementedError("Negative indexing not implemented.")
-
-            if i == 0:  # channel
-                if stop > self.channel_count or start >= self.channel_count:
-                    raise IndexError(f"Channel out of range {(start,stop)}.")
-            else:
-                if stop > self.shape[i] or start >= self.shape[i]:
-                    raise IndexError(f"Axis {i} selection ({start, stop}) out of range ({self.shape[i]}).")
+        return self.read(key)
+
+    def read(self, key, scale=1, out=None):
+        """
+        Reads a selection chunk by chunk, straight into `out`. Plans are built and executed `READ_PLAN_WINDOW`
+        chunks at a time, so reading a whole archive into an `np.memmap` needs constant memory.
+
+        Parameters:
+            key (4 selectors): int, slice or (start, stop) pair for the channel and each XYZ axis, in scaled
+                coordinates.
+            scale (int, default 1): pyramid level to read.
+            out (writable 4D array, default None): destination shaped as the selection, e.g. a reused buffer or an
+                `np.memmap`, so that no full-size array is allocated. A new array if not set.
 
-        outshape = tuple(stop - start for start, stop in keys)
+        Returns:
+            `out`
+        """
+        key = parse_selection(key, self.get_shape(scale))
+        out = prepare_output(key, out, get_dtype(self.dtype))
+
+        execute_read_plan(self.iter_plan(key, scale), out)
+
+        return out
 
-        out = np.zeros(shape=outshape, dtype=np.uint16)
+    def plan_read(self, key, scale=1):
+        """
+        Builds one read plan covering every chunk of every channel and metachunk in the selection.
 
-        scale = 1
+        Parameters:
+            key (4 (start, stop) pairs): channel and XYZ selection.
+            scale (int, default 1): pyramid level to read.
+
+        Returns:
+            List of (shard, chunk id, source slices, output index) tuples for `execute_read_plan`.
+        """
+        return list(self.iter_plan(key, scale))
+
+    def iter_plan(self, key, scale=1):
+        """Like `plan_read`, but yields the plan entries one at a time, opening shards as they are reached."""
         mcx = self.mchunk[0] // scale
         mcy = self.mchunk[1] // scale
         mcz = self.mchunk[2] // scale
@@ -676,21 +1329,17 @@ class sisf:
                         zsize = szend - szstart
                         chunk_id_z = czstart // mcz
 
-                        chunk = self.get_chunk(chunk_id_x, chunk_id_y, chunk_id_z, c, scale)
-
-                        out[
-                            c,
-                            xstart : xstart + xsize,
-                            ystart : ystart + ysize,
-                            zstart : zstart + zsize,
-                        ] = chunk[sxstart:sxend, systart:syend, szstart:szend]
+                        shard = self.get_shard(chunk_id_x, chunk_id_y, chunk_id_z, c, scale)
+                        yield from shard.iter_plan(
+                            ((sxstart, sxend), (systart, syend), (szstart, szend)),
+                            out_prefix=(c - key[0][0],),
+                            out_offset=(xstart, ystart, zstart),
+                        )
 
                         zstart += zsize
                     ystart += ysize
                 xstart += xsize
 
-        return out
-
     def __setitem__(self, key, value):
         raise NotImplementedError("SISF files can not be modified.")
 
@@ -6,26 +6,37 @@
 import zipfile
 import zstd
 import tqdm
-import concurrent
+import concurrent.futures
 
 import numpy as np
 from numba import njit
 
 
+# Frames of a SNDIF stack, in the order they are stored
+FRAME_SHAPE = (2304, 2304)
+
+
 def load_from_zip(
     file_name,
     stack_size=2000,
     stack_select=None,
     thread_count=1,
+    flatfield=None,
+    darkfield=None,
 ):
     """
     Load image frames from a SNDIF ZIP archive.
 
+    Frames are decoded straight into the output array. When a flatfield is given, each frame is corrected as it is
+    decoded (see `flatfield_correct`), so correction adds no pass over the stack.
+
     Parameters:
         file_name (str): Name of the input ZIP file.
-        stack_size (int): Number of frames expected.
+        stack_size (int): Number of frames expected, missing frames are filled with zeros.
         stack_select (slice): A parameter passed to the file list to select inputs.
         thread_count (int): Number of threads to launch on the ThreadPoolExecutor.
+        flatfield (2D numpy, default None): flatfield of the frames, e.g. `BaSiC.flatfield`.
+        darkfield (2D numpy, default None): darkfield of the frames, e.g. `BaSiC.darkfield`.
 
     Returns:
         Numpy array containing the loaded frames
@@ -38,31 +49,118 @@ def load_from_zip(
     if stack_select is not None:
         file_list = file_list[stack_select]
 
-    out = bytearray()
-    n = 0
+    outnp = np.zeros((stack_size, *FRAME_SHAPE), dtype=np.uint16)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
-        for r in tqdm.tqdm(
-            executor.map(lambda x: zstd.ZSTD_uncompress(zf.read(x)), file_list),
-            total=len(file_list),
-        ):
-            out += r
-            n += 1
-    zf.close()
+    if flatfield is not None:
+        gain, offset, lo, hi = flatfield_params(flatfield, darkfield, FRAME_SHAPE, outnp.dtype)
 
-    while n < stack_size:
-        n += 1
-        out += b"0" * (2 * 2304 * 2304)
+    def load(n):
+        frame = np.frombuffer(zstd.ZSTD_uncompress(zf.read(file_list[n])), dtype=np.uint16).reshape(FRAME_SHAPE)
+        if flatfield is None:
+            outnp[n] = frame
+        else:
+            flatfield_kernel(frame[:, :, None], outnp[n][:, :, None], gain, offset, lo, hi)
 
-    outnp = np.frombuffer(out, dtype=np.uint16)
-    outnp = outnp.reshape(stack_size, 2304, 2304)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for _ in tqdm.tqdm(executor.map(load, range(len(file_list))), total=len(file_list)):
+            pass
+    zf.close()
 
     outnp = np.moveaxis(outnp, 0, -1)
 
     return outnp
 
 
-@njit
+def flatfield_params(flatfield, darkfield, shape, dtype):
+    """
+    Precomputes the per-pixel gain (1 / flatfield) and offset (darkfield) used by `flatfield_kernel`, and the range
+    outputs of type `dtype` are clipped to.
+    """
+    flatfield = np.asarray(flatfield, dtype=np.float32)
+    if flatfield.shape != tuple(shape):
+        raise ValueError(f"Flatfield shape {flatfield.shape} does not match image shape {tuple(shape)}")
+
+    gain = np.zeros(flatfield.shape, dtype=np.float32)
+    np.divide(1, flatfield, out=gain, where=flatfield > 0)
+
+    if darkfield is None:
+        offset = np.zeros(flatfield.shape, dtype=np.float32)
+    else:
+        offset = np.ascontiguousarray(darkfield, dtype=np.float32)
+        if offset.shape != flatfield.shape:
+            raise ValueError(f"Darkfield shape {offset.shape} does not match flatfield shape {flatfield.shape}")
+
+    if np.issubdtype(dtype, np.integer):
+        lo, hi = float(np.iinfo(dtype).min), float(np.iinfo(dtype).max)
+    else:
+        lo, hi = -np.inf, np.inf
+
+    return gain, offset, lo, hi
+
+
+@njit(cache=True, nogil=True)
+def flatfield_kernel(in_array, out_array, gain, offset, lo, hi):
+    """
+    Writes `(in_array - offset) * gain` into `out_array`, clipped to [lo, hi] and truncated for integer outputs.
+    Both arrays are XYZ, `gain` and `offset` are XY. `out_array` may be `in_array`.
+    """
+    nx, ny, nz = in_array.shape
+
+    if in_array.strides[2] > in_array.strides[0]:
+        # Plane-major memory, e.g. the output of `load_from_zip`: walk one plane at a time
+        for k in range(nz):
+            for i in range(nx):
+                for j in range(ny):
+                    v = (in_array[i, j, k] - offset[i, j]) * gain[i, j]
+                    out_array[i, j, k] = min(max(v, lo), hi)
+    else:
+        for i in range(nx):
+            for j in range(ny):
+                o = offset[i, j]
+                g = gain[i, j]
+                for k in range(nz):
+                    v = (in_array[i, j, k] - o) * g
+                    out_array[i, j, k] = min(max(v, lo), hi)
+
+
+def flatfield_correct(stack, flatfield, darkfield=None, out=None, thread_count=8, slab_size=64):
+    """
+    Flatfield and darkfield correction of an XYZ stack, `(stack - darkfield) / flatfield` for every z-plane, as
+    `BaSiC.transform` does for a single plane.
+
+    The stack is processed in z-slabs of `slab_size` planes across `thread_count` threads, without temporary
+    copies of the stack. Results are clipped to the range of the output type.
+
+    Parameters:
+        stack (3D numpy): XYZ image.
+        flatfield (2D numpy): XY flatfield.
+        darkfield (2D numpy, default None): XY darkfield.
+        out (3D numpy, default None): array of the same shape to write to, `stack` itself (in place) if not set.
+        thread_count (int, default 8): number of slabs corrected in parallel.
+        slab_size (int, default 64): number of z-planes per slab.
+
+    Returns:
+        The corrected stack, `out`
+    """
+    if out is None:
+        out = stack
+    elif out.shape != stack.shape:
+        raise ValueError(f"Output shape {out.shape} does not match stack shape {stack.shape}")
+
+    gain, offset, lo, hi = flatfield_params(flatfield, darkfield, stack.shape[:2], out.dtype)
+
+    def correct(z):
+        flatfield_kernel(stack[:, :, z : z + slab_size], out[:, :, z : z + slab_size], gain, offset, lo, hi)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for _ in executor.map(correct, range(0, stack.shape[2], slab_size)):
+            pass
+
+    return out
+
+
+# cache=True stores the compiled kernel next to this file, so only the first process ever pays for compilation
+@njit(cache=True)
 def downsample(in_array, out_array):
     """
     Utility function to downsample a 3D image by a factor of 2X in all dimensions.
@@ -94,4 +192,49 @@ def downsample(in_array, out_array):
                             total += in_array[(i * si) + ii, (j * sj) + jj, (k * sk) + kk]
                             n += 1
 
-                out_array[i, j, k] = int(total / n)
+                # Truncated for integer outputs, as int() would
+                out_array[i, j, k] = total / n
+
+
+@njit(cache=True)
+def downsample_mode(in_array, out_array):
+    """
+    Downsamples a 3D label image by a factor of 2X in all dimensions, keeping the most frequent label of each
+    2x2x2 block (the smallest label on ties), so that no new labels are created.
+
+    Parameters:
+        in_array (numpy): 3D array containing the input labels
+        out_array (numpy): 3D array of half the size to write the output to
+    """
+    for i, j in zip(in_array.shape, out_array.shape):
+        if max(1, i // 2) != j:
+            raise ValueError(f"Invalid casting max(1, {i}/2) != ({j})")
+
+    si = 1 if in_array.shape[0] < 2 else 2
+    sj = 1 if in_array.shape[1] < 2 else 2
+    sk = 1 if in_array.shape[2] < 2 else 2
+
+    values = np.empty(si * sj * sk, dtype=in_array.dtype)
+
+    for i in range(out_array.shape[0]):
+        for j in range(out_array.shape[1]):
+            for k in range(out_array.shape[2]):
+                n = 0
+                for ii in range(si):
+                    for jj in range(sj):
+                        for kk in range(sk):
+                            values[n] = in_array[(i * si) + ii, (j * sj) + jj, (k * sk) + kk]
+                            n += 1
+
+                best = values[0]
+                best_count = 0
+                for a in range(n):
+                    count = 0
+                    for b in range(n):
+                        if values[b] == values[a]:
+                            count += 1
+                    if count > best_count or (count == best_count and values[a] < best):
+                        best = values[a]
+                        best_count = count
+
+                out_array[i, j, k] = best
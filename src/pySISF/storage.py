@@ -0,0 +1,418 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Storage backends for reading SISF archives.
+
+Every backend reads byte ranges of named objects ("keys", e.g. `meta/chunk_0_0_0.0.1X.meta`) relative to an
+archive root. `read_ranges` coalesces nearby ranges of the same object into fewer, larger requests.
+
+Backends:
+    LocalStorage: files on a local or network filesystem.
+    HTTPStorage: any server supporting HTTP range requests, including public or presigned S3/MinIO buckets.
+    FsspecStorage: any `fsspec` filesystem, e.g. "s3://bucket/archive" with `s3fs` (optional dependency).
+    PackedStorage: a packed single-file archive (see `pySISF.pack`), memory mapped.
+"""
+
+import concurrent.futures
+import gc
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from pySISF import metrics
+
+# Ranges separated by at most this many bytes are fetched with a single request
+DEFAULT_COALESCE_GAP = 64 * 2**10
+# Coalesced requests are not grown beyond this size
+DEFAULT_MAX_REQUEST_SIZE = 16 * 2**20
+
+# Packed archives: header, then the archive files back to back, then the index
+PACK_EXTENSION = ".sisfpack"
+PACK_MAGIC = b"SISFPACK"
+PACK_VERSION = 1
+PACK_HEADER_LAYOUT = "<8sHHQQ"  # magic, version, segment count, index offset, index size
+PACK_HEADER_SIZE = struct.calcsize(PACK_HEADER_LAYOUT)
+PACK_ENTRY_LAYOUT = "<HQQH"  # segment, offset, size, key length, followed by the utf-8 key
+PACK_ENTRY_SIZE = struct.calcsize(PACK_ENTRY_LAYOUT)
+
+
+def coalesce_ranges(ranges, max_gap=DEFAULT_COALESCE_GAP, max_size=DEFAULT_MAX_REQUEST_SIZE):
+    """
+    Merges (offset, size) ranges which are close together.
+
+    Returns:
+        List of (offset, size, members) requests, where members lists the indices into `ranges` covered by
+        the request.
+    """
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+
+    requests = []
+    for i in order:
+        offset, size = ranges[i]
+        if requests:
+            start, length, members = requests[-1]
+            end = start + length
+            new_end = max(end, offset + size)
+            if offset - end <= max_gap and new_end - start <= max_size:
+                requests[-1] = (start, new_end - start, members + [i])
+                continue
+        requests.append((offset, size, [i]))
+
+    return requests
+
+
+class Storage:
+    """
+    Base class for storage backends.
+
+    Subclasses implement `read(key, offset, size)`; `read_ranges` adds coalescing and concurrent requests, issued
+    from a thread pool of `max_workers` threads kept for the lifetime of the storage.
+    """
+
+    def __init__(self, max_workers=8, coalesce_gap=DEFAULT_COALESCE_GAP, max_request_size=DEFAULT_MAX_REQUEST_SIZE):
+        self.max_workers = max_workers
+        self.coalesce_gap = coalesce_gap
+        self.max_request_size = max_request_size
+        self.fetch_executor = None
+        self.fetch_executor_lock = threading.Lock()
+
+    def get_fetch_executor(self):
+        """Returns the thread pool issuing the requests of `read_ranges`, created on first use."""
+        with self.fetch_executor_lock:
+            if self.fetch_executor is None:
+                self.fetch_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="sisf-fetch"
+                )
+        return self.fetch_executor
+
+    def read(self, key, offset=0, size=None):
+        """Reads `size` bytes (or up to the end) of `key` starting at `offset`."""
+        raise NotImplementedError()
+
+    def keys(self):
+        """Lists every key of the storage."""
+        raise NotImplementedError()
+
+    def location(self, key):
+        """Human-readable location of `key`, such as its path or URL, for messages and reports."""
+        return key
+
+    def read_ranges(self, key, ranges):
+        """
+        Reads several (offset, size) ranges of `key`.
+
+        Returns:
+            List of bytes-like objects, in the same order as `ranges`.
+        """
+        requests = coalesce_ranges(ranges, max_gap=self.coalesce_gap, max_size=self.max_request_size)
+
+        def fetch(request):
+            return self.read(key, request[0], request[1])
+
+        if len(requests) == 1 or self.max_workers <= 1:
+            blobs = [fetch(request) for request in requests]
+        else:
+            blobs = list(self.get_fetch_executor().map(fetch, requests))
+
+        out = [None] * len(ranges)
+        for (start, _, members), blob in zip(requests, blobs):
+            view = memoryview(blob)
+            for i in members:
+                offset, size = ranges[i]
+                out[i] = view[offset - start : offset - start + size]
+
+        return out
+
+
+class LocalStorage(Storage):
+    """
+    Files on a locally mounted filesystem.
+
+    Parameters:
+        root (str, default ""): folder keys are relative to, "" to use keys as paths.
+    """
+
+    def __init__(self, root="", **kwargs):
+        kwargs.setdefault("max_workers", 1)  # local reads are already issued from the read executor
+        super().__init__(**kwargs)
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key) if self.root else key
+
+    def location(self, key):
+        return self.path(key)
+
+    def read(self, key, offset=0, size=None):
+        t = metrics.start()
+        with open(self.path(key), "rb") as f:
+            t = metrics.record("open", t)
+            f.seek(offset)
+            blob = f.read() if size is None else f.read(size)
+        metrics.record("read", t, len(blob))
+        metrics.count("read_requests")
+
+        return blob
+
+    def keys(self):
+        root = self.root or "."
+        for folder, _, files in os.walk(root):
+            prefix = os.path.relpath(folder, root).replace(os.sep, "/")
+            for name in files:
+                yield name if prefix == "." else f"{prefix}/{name}"
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def __repr__(self):
+        return f"<LocalStorage {self.root!r}>"
+
+
+class HTTPStorage(Storage):
+    """
+    Objects served over HTTP(S) with range requests, e.g. a static web server or an S3-compatible endpoint.
+
+    Parameters:
+        base_url (str): URL of the archive root.
+        retries (int, default 3): how many times a failed request is retried, with exponential backoff.
+        timeout (float, default 60): timeout of each request in seconds.
+        headers (dict, default None): extra headers sent with every request, e.g. authorization.
+    """
+
+    def __init__(self, base_url, retries=3, timeout=60, headers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.timeout = timeout
+        self.headers = headers if headers else {}
+
+    def url(self, key):
+        return f"{self.base_url}/{urllib.request.quote(key)}"
+
+    def location(self, key):
+        return self.url(key)
+
+    def read(self, key, offset=0, size=None):
+        if size == 0:
+            return b""
+
+        headers = dict(self.headers)
+        headers["Range"] = f"bytes={offset}-" if size is None else f"bytes={offset}-{offset + size - 1}"
+        request = urllib.request.Request(self.url(key), headers=headers)
+
+        t = metrics.start()
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    blob = response.read()
+                    if response.status == 200:
+                        # Server ignored the range and sent the whole object
+                        blob = blob[offset:] if size is None else blob[offset : offset + size]
+                break
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == self.retries:
+                    raise
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                if attempt == self.retries:
+                    raise
+            metrics.count("read_retries")
+            time.sleep(0.1 * 2**attempt)
+
+        metrics.record("read", t, len(blob))
+        metrics.count("read_requests")
+
+        return blob
+
+    def __repr__(self):
+        return f"<HTTPStorage {self.base_url}>"
+
+
+class FsspecStorage(Storage):
+    """
+    Objects on any `fsspec` filesystem, e.g. "s3://bucket/archive" (requires `fsspec` and the filesystem's
+    implementation package, such as `s3fs`).
+
+    Parameters:
+        url (str): URL of the archive root.
+        storage_options: passed to `fsspec.core.url_to_fs`, e.g. `endpoint_url` or credentials.
+    """
+
+    def __init__(
+        self,
+        url,
+        max_workers=8,
+        coalesce_gap=DEFAULT_COALESCE_GAP,
+        max_request_size=DEFAULT_MAX_REQUEST_SIZE,
+        **storage_options,
+    ):
+        super().__init__(max_workers=max_workers, coalesce_gap=coalesce_gap, max_request_size=max_request_size)
+
+        import fsspec.core
+
+        self.fs, self.root = fsspec.core.url_to_fs(url, **storage_options)
+        self.root = self.root.rstrip("/")
+
+    def read(self, key, offset=0, size=None):
+        t = metrics.start()
+        blob = self.fs.cat_file(f"{self.root}/{key}", start=offset, end=None if size is None else offset + size)
+        metrics.record("read", t, len(blob))
+        metrics.count("read_requests")
+
+        return blob
+
+    def keys(self):
+        for path in self.fs.find(self.root):
+            yield path[len(self.root) + 1 :]
+
+    def location(self, key):
+        return self.fs.unstrip_protocol(f"{self.root}/{key}")
+
+    def __repr__(self):
+        return f"<FsspecStorage {self.fs.protocol}://{self.root}>"
+
+
+def pack_segment_name(fname, segment):
+    """Returns the file name of segment `segment` of the packed archive `fname`."""
+    return fname if segment == 0 else f"{fname}.{segment}"
+
+
+def parse_pack_index(header_bin, index_bin):
+    """
+    Parses the header and index of a packed archive.
+
+    Returns:
+        (segment count, dict mapping each key to (segment, offset, size))
+    """
+    magic, version, segment_count, _, _ = struct.unpack(PACK_HEADER_LAYOUT, header_bin)
+    if magic != PACK_MAGIC:
+        raise ValueError("Not a packed SISF archive.")
+    if version > PACK_VERSION:
+        raise NotImplementedError(f"Packed archive version {version} not supported.")
+
+    index = {}
+    pos = 0
+    while pos < len(index_bin):
+        segment, offset, size, key_length = struct.unpack_from(PACK_ENTRY_LAYOUT, index_bin, pos)
+        pos += PACK_ENTRY_SIZE
+        key = bytes(index_bin[pos : pos + key_length]).decode("utf-8")
+        pos += key_length
+        index[key] = (segment, offset, size)
+
+    return segment_count, index
+
+
+class PackedStorage(Storage):
+    """
+    A packed single-file archive, created with `pySISF.pack`. Segment files are memory mapped, so reads are
+    slices of the page cache rather than system calls. The maps are released by `close()`, or on leaving a `with`
+    block.
+
+    Parameters:
+        fname (str): packed archive file, further segments are read from `fname.1`, `fname.2`, ...
+    """
+
+    def __init__(self, fname, **kwargs):
+        kwargs.setdefault("max_workers", 1)
+        super().__init__(**kwargs)
+        self.fname = fname
+
+        with open(fname, "rb") as f:
+            header_bin = f.read(PACK_HEADER_SIZE)
+            if len(header_bin) != PACK_HEADER_SIZE:
+                raise ValueError(f"Invalid read size {len(header_bin)} when loading packed archive header")
+            _, _, _, index_offset, index_size = struct.unpack(PACK_HEADER_LAYOUT, header_bin)
+            f.seek(index_offset)
+            index_bin = f.read(index_size)
+
+        segment_count, self.index = parse_pack_index(header_bin, index_bin)
+
+        self.maps = []
+        for segment in range(segment_count):
+            with open(pack_segment_name(fname, segment), "rb") as f:
+                self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.segments = [memoryview(m) for m in self.maps]
+
+    def keys(self):
+        return self.index.keys()
+
+    def exists(self, key):
+        return key in self.index
+
+    def location(self, key):
+        return f"{self.fname}/{key}"
+
+    def read(self, key, offset=0, size=None):
+        if self.segments is None:
+            raise ValueError(f"{self.fname} is closed")
+
+        try:
+            segment, start, length = self.index[key]
+        except KeyError:
+            raise FileNotFoundError(f"{key} not found in {self.fname}") from None
+
+        end = start + length if size is None else min(start + offset + size, start + length)
+        metrics.count("read_requests")
+
+        return self.segments[segment][start + offset : end]
+
+    def read_ranges(self, key, ranges):
+        # Mapped reads have no per-request cost to amortize
+        return [self.read(key, offset, size) for offset, size in ranges]
+
+    def unmap(self):
+        """Closes the segment maps with no slices in use, returns whether all of them are closed."""
+        for m in self.maps:
+            try:
+                m.close()
+            except BufferError:
+                pass  # slices remain, the map is closed when the last one is freed
+        return all(m.closed for m in self.maps)
+
+    def close(self):
+        """
+        Unmaps the segment files. Maps still referenced by data returned from `read` (e.g. uncompressed chunks)
+        stay open until those are freed.
+        """
+        if self.segments is None:
+            return
+
+        for view in self.segments:
+            view.release()
+        self.segments = None
+
+        if not self.unmap():
+            # Shards reference their archive, so a dropped archive may be waiting for the cycle collector
+            gc.collect()
+            self.unmap()
+        self.maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"<PackedStorage {self.fname!r}>"
+
+
+def open_storage(url, **kwargs):
+    """
+    Returns the storage backend for an archive location.
+
+    "http://" and "https://" URLs use `HTTPStorage`, other URLs with a protocol ("s3://", "gs://", ...) use
+    `FsspecStorage`, local files are packed archives (`PackedStorage`) and anything else is a local folder.
+    """
+    if url.startswith("http://") or url.startswith("https://"):
+        return HTTPStorage(url, **kwargs)
+    if "://" in url:
+        return FsspecStorage(url, **kwargs)
+    if os.path.isfile(url):
+        return PackedStorage(url, **kwargs)
+    return LocalStorage(url, **kwargs)
@@ -0,0 +1,248 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Streaming TIFF/OME-TIFF ingest.
+
+`TiffStack` exposes a multi-page TIFF as a lazy XYZ array: uncompressed stacks are memory mapped, compressed
+pages are decoded in parallel on demand. `tiff_to_sisf` converts a stack one z-slab at a time, decoding the next
+slab while the current one is encoded, so memory stays bounded by two slabs of `mchunk_size[2]` planes.
+
+Usage:
+    python -m pySISF.tiff_utils stack.ome.tif archive --mchunk-size 2000x2000x256 --chunk-size 32x32x10
+"""
+
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from pySISF import sisf
+
+# Series axes which can be the z (page) axis of a stack
+DEPTH_AXES = "ZQIT"
+
+
+class TiffStack:
+    """
+    Lazy XYZ view of one channel of a multi-page TIFF stack, sliceable like a numpy array.
+
+    Parameters:
+        fname (str): TIFF or OME-TIFF file.
+        channel (int, default 0): channel to read, for series with a "C" axis.
+        series (int, default 0): image series of the file.
+        workers (int, default 8): number of pages decoded in parallel.
+        memmap (bool, default True): memory map uncompressed, contiguous stacks instead of decoding pages.
+    """
+
+    def __init__(self, fname, channel=0, series=0, workers=8, memmap=True):
+        import tifffile
+
+        self.fname = fname
+        self.workers = workers
+        self.tif = tifffile.TiffFile(fname)
+        self.tif.filehandle.set_lock(True)  # pages are read from several threads
+        self.series = self.tif.series[series]
+
+        axes, shape = self.series.axes.upper(), self.series.shape
+        if axes[-2:] != "YX" or "S" in axes:
+            raise NotImplementedError(f"Unsupported TIFF axes {axes}, expected pages of YX planes")
+
+        # Page numbers of the series, shaped by the axes in front of YX
+        pages = np.arange(int(np.prod(shape[:-2], dtype=np.int64))).reshape(shape[:-2])
+        page_axes = axes[:-2]
+        if "C" in page_axes:
+            pages = np.take(pages, channel, axis=page_axes.index("C"))
+            page_axes = page_axes.replace("C", "")
+        elif channel != 0:
+            raise ValueError(f"Channel {channel} requested, but the TIFF series has no channel axis ({axes})")
+        if len(page_axes) > 1 or (page_axes and page_axes not in DEPTH_AXES):
+            raise NotImplementedError(f"Unsupported TIFF axes {axes}, expected a single z axis")
+
+        self.pages = pages.reshape(-1)
+        self.shape = (shape[-1], shape[-2], len(self.pages))
+        self.dtype = self.series.dtype
+        self.ndim = 3
+
+        self.mapped = None
+        if memmap and self.series.dataoffset is not None:
+            mapped = tifffile.memmap(fname, series=series, mode="r").reshape(shape)
+            if "C" in axes:
+                mapped = mapped[(slice(None),) * axes.index("C") + (channel,)]
+            self.mapped = mapped.reshape((-1, *shape[-2:])).transpose(2, 1, 0)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def read_page(self, z):
+        """Decodes plane `z` of the stack, in YX order."""
+        page = self.series.pages[int(self.pages[z])]
+        return page.asarray(lock=self.tif.filehandle.lock, maxworkers=1)
+
+    def read(self, xrange, yrange, zrange, out=None):
+        """
+        Reads a region, decoding its pages in parallel.
+
+        Parameters:
+            xrange, yrange, zrange ((start, stop) pairs): region to read.
+            out (3D numpy array, default None): destination, allocated if not set.
+        """
+        (x0, x1), (y0, y1), (z0, z1) = xrange, yrange, zrange
+        if out is None:
+            out = np.empty((x1 - x0, y1 - y0, z1 - z0), dtype=self.dtype)
+
+        if self.mapped is not None:
+            out[...] = self.mapped[x0:x1, y0:y1, z0:z1]
+            return out
+
+        def load(z):
+            out[:, :, z - z0] = self.read_page(z)[y0:y1, x0:x1].T
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(load, range(z0, z1)):
+                pass
+
+        return out
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),) * (3 - len(key))
+
+        ranges = []
+        squeeze = []
+        for axis, (k, size) in enumerate(zip(key, self.shape)):
+            if isinstance(k, (int, np.integer)):
+                k = int(k) + size if k < 0 else int(k)
+                ranges.append((k, k + 1))
+                squeeze.append(axis)
+            else:
+                start, stop, step = k.indices(size)
+                if step != 1:
+                    raise NotImplementedError("Strided TIFF reads are not supported")
+                ranges.append((start, max(start, stop)))
+
+        out = self.read(*ranges)
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+    def close(self):
+        self.tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f"<TiffStack {self.fname} {self.shape} {self.dtype}>"
+
+
+def tiff_to_sisf(
+    fname,
+    archive,
+    mchunk_size,
+    chunk_size,
+    res,
+    channels=None,
+    downsampling=None,
+    compression=1,
+    thread_count=8,
+    workers=8,
+    compression_opts=None,
+    enable_status=True,
+    order="c",
+):
+    """
+    Converts a TIFF stack into a SISF archive, streaming z-slabs of `mchunk_size[2]` planes.
+
+    Each slab is decoded once and split into metachunks. The next slab is decoded in the background while the
+    current one is encoded, so peak memory is about two slabs.
+
+    Parameters:
+        fname (str): TIFF or OME-TIFF stack.
+        archive (str): SISF archive folder to create.
+        channels (list of int, default None): channels to convert, every channel of the series if not set.
+        workers (int, default 8): number of pages decoded in parallel.
+        Other parameters are as for `pySISF.sisf.create_sisf`.
+    """
+    import tqdm
+
+    if archive.endswith("/"):
+        archive = archive[:-1]
+
+    with TiffStack(fname, workers=workers) as first:
+        axes, shape = first.series.axes.upper(), first.series.shape
+        size, dtype = first.shape, first.dtype
+    if channels is None:
+        channels = list(range(shape[axes.index("C")])) if "C" in axes else [0]
+
+    sisf.create_archive(archive, sisf.get_dtype_code(dtype), len(channels), mchunk_size, res, size)
+
+    zslabs = list(sisf.iterate_bounded(size[2], mchunk_size[2]))
+    xblocks = list(sisf.iterate_bounded(size[0], mchunk_size[0]))
+    yblocks = list(sisf.iterate_bounded(size[1], mchunk_size[1]))
+    status_bar = tqdm.tqdm(total=len(channels) * len(zslabs) * len(xblocks) * len(yblocks), disable=not enable_status)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as prefetcher:
+        for c, channel in enumerate(channels):
+            with TiffStack(fname, channel=channel, workers=workers) as stack:
+                pending = prefetcher.submit(stack.read, (0, size[0]), (0, size[1]), zslabs[0])
+
+                for k in range(len(zslabs)):
+                    slab = pending.result()
+                    if k + 1 < len(zslabs):
+                        pending = prefetcher.submit(stack.read, (0, size[0]), (0, size[1]), zslabs[k + 1])
+
+                    for i, (istart, iend) in enumerate(xblocks):
+                        for j, (jstart, jend) in enumerate(yblocks):
+                            sisf.create_metachunk(
+                                archive,
+                                f"chunk_{i}_{j}_{k}.{c}.1X",
+                                slab[istart:iend, jstart:jend],
+                                chunk_size,
+                                compression,
+                                downsampling=downsampling,
+                                thread_count=thread_count,
+                                compression_opts=compression_opts,
+                                progress=False,
+                                order=order,
+                            )
+                            status_bar.update(1)
+
+                    del slab
+
+    status_bar.close()
+
+
+def parse_size(text):
+    return tuple(int(s) for s in text.split("x"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a TIFF/OME-TIFF stack into a SISF archive.")
+    parser.add_argument("fname", help="TIFF stack")
+    parser.add_argument("archive", help="SISF archive folder to create")
+    parser.add_argument("--mchunk-size", default="2000x2000x256", help="metachunk size, e.g. 2000x2000x256")
+    parser.add_argument("--chunk-size", default="32x32x10", help="chunk size, e.g. 32x32x10")
+    parser.add_argument("--res", default="1000x1000x1000", help="resolution in nm, e.g. 100x100x100")
+    parser.add_argument("--downsampling", type=int, default=None, help="number of pyramid levels")
+    parser.add_argument("--compression", type=int, default=1, help="compression codec")
+    parser.add_argument("--workers", type=int, default=8, help="pages decoded in parallel")
+    args = parser.parse_args()
+
+    tiff_to_sisf(
+        args.fname,
+        args.archive,
+        parse_size(args.mchunk_size),
+        parse_size(args.chunk_size),
+        parse_size(args.res),
+        downsampling=args.downsampling,
+        compression=args.compression,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Parallel integrity check of SISF shards.
+
+Chunks are checked against the CRC-32 stored in the shard table without decompressing them. Each shard's data
+file is read sequentially in large blocks, and shards are checked in parallel. Archive folders and packed
+archives (see `pySISF.pack`) are read through `pySISF.storage`.
+
+Usage:
+    python -m pySISF.verify <archive, packed archive or folder of shards> [--workers N]
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import os
+import posixpath
+import zlib
+
+from pySISF import analysis, sisf
+from pySISF.storage import LocalStorage, open_storage
+
+DEFAULT_BLOCK_SIZE = 64 * 2**20
+
+
+def find_shards(path):
+    """
+    Lists the shards under `path`.
+
+    `path` may be a SISF archive (a folder, packed archive file or URL, see `pySISF.storage.open_storage`), a folder
+    of `.data`/`.meta` shard pairs, or a single `.meta` file. The shards of an archive are enumerated from its
+    header, every metachunk, channel and stored pyramid level, so missing shard files are reported as unreadable.
+    Folders of shard pairs are listed with `Storage.keys`.
+
+    Returns:
+        (storage, list of (data key, meta key) pairs)
+    """
+    if path.endswith(".meta"):
+        folder, name = os.path.split(path)
+        if os.path.basename(folder) == "meta":
+            storage, meta_keys = LocalStorage(os.path.dirname(folder)), [f"meta/{name}"]
+        else:
+            storage, meta_keys = LocalStorage(folder), [name]
+        return storage, [(meta_key[: -len(".meta")] + ".data", meta_key) for meta_key in meta_keys]
+
+    storage = open_storage(path)
+    try:
+        archive = sisf.sisf(path, storage=storage)
+    except (OSError, ValueError):
+        archive = None
+
+    if archive is not None:
+        shards = []
+        counts = archive.get_mchunk_counts()
+        for c in range(archive.channel_count):
+            for scalei in range(analysis.coarsest_scale(archive, c).bit_length()):
+                for i, j, k in itertools.product(*(range(n) for n in counts)):
+                    shards.append(archive.shard_keys(i, j, k, c, 2**scalei))
+        return storage, shards
+
+    try:
+        keys = list(storage.keys())
+    except NotImplementedError:
+        raise ValueError(f"{path} is not a SISF archive, and {storage!r} can not list its files.") from None
+
+    folder = "meta/" if any(key.startswith("meta/") for key in keys) else ""
+    meta_keys = sorted(
+        key for key in keys if key.startswith(folder) and key.endswith(".meta") and "/" not in key[len(folder) :]
+    )
+
+    shards = []
+    for meta_key in meta_keys:
+        folder, name = posixpath.split(meta_key)
+        name = name[: -len(".meta")] + ".data"
+        if folder == "meta" and f"data/{name}" in keys:
+            folder = "data"
+        shards.append((posixpath.join(folder, name), meta_key))
+
+    return storage, shards
+
+
+def verify_shard(fname_data, fname_meta, block_size=DEFAULT_BLOCK_SIZE, storage=None):
+    """
+    Checks every chunk of one shard.
+
+    Parameters:
+        fname_data (str): data file name, a key of `storage`.
+        fname_meta (str): metadata file name, a key of `storage`.
+        block_size (int, default 64 MiB): size of the sequential reads issued.
+        storage (pySISF.storage.Storage, default None): backend holding the shard, local files if not set.
+
+    Returns:
+        dict with "chunks", "bytes", "checksums" (whether the shard stores checksums) and "bad",
+        a list of (chunk index, reason).
+    """
+    storage = storage if storage is not None else LocalStorage()
+    result = {
+        "data": storage.location(fname_data),
+        "meta": storage.location(fname_meta),
+        "chunks": 0,
+        "bytes": 0,
+        "checksums": False,
+        "bad": [],
+    }
+
+    try:
+        shard = sisf.sisf_chunk(fname_data, fname_meta, cache_metadata=True, storage=storage)
+        # Also fails if the data file is missing
+        storage.read(fname_data, 0, 1)
+    except (OSError, ValueError) as e:
+        result["bad"].append((None, f"unreadable shard: {e}"))
+        return result
+
+    result["checksums"] = shard.has_checksums
+    entries = sorted(shard.cache.items(), key=lambda item: item[1][0])
+    result["chunks"] = len(entries)
+
+    i = 0
+    while i < len(entries):
+        # Group chunks into one sequential read of up to block_size bytes
+        block_start = entries[i][1][0]
+        j = i
+        block_end = block_start
+        while j < len(entries) and (j == i or entries[j][1][0] + entries[j][1][1] - block_start <= block_size):
+            block_end = max(block_end, entries[j][1][0] + entries[j][1][1])
+            j += 1
+
+        block = memoryview(storage.read(fname_data, block_start, block_end - block_start))
+        result["bytes"] += len(block)
+
+        for idx, entry in entries[i:j]:
+            offset, size = entry[:2]
+            start = offset - block_start
+            if start + size > len(block):
+                data_size = block_start + len(block)
+                result["bad"].append((idx, f"chunk extends past end of data file ({offset + size} > {data_size})"))
+            elif shard.has_checksums and zlib.crc32(block[start : start + size]) != entry[2]:
+                result["bad"].append((idx, "checksum mismatch"))
+
+        i = j
+
+    return result
+
+
+def verify(archive, workers=8, block_size=DEFAULT_BLOCK_SIZE, progress=True):
+    """
+    Verifies every shard of an archive in parallel, without decoding any chunk.
+
+    Parameters:
+        archive (str): SISF archive folder, packed archive, folder of shard pairs, or a single `.meta` file.
+        workers (int, default 8): number of shards to check concurrently.
+        block_size (int, default 64 MiB): size of the sequential reads issued per shard.
+        progress (bool, default True): prints a loading bar using `tqdm`.
+
+    Returns:
+        dict with totals ("shards", "chunks", "bytes"), "unchecked" (shards written without checksums, only
+        checked for table consistency) and "bad", a list of (data file, chunk index, reason).
+    """
+    import tqdm
+
+    storage, shards = find_shards(archive)
+    report = {"shards": len(shards), "chunks": 0, "bytes": 0, "unchecked": [], "bad": []}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(verify_shard, d, m, block_size=block_size, storage=storage) for d, m in shards]
+
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures), disable=not progress):
+            result = future.result()
+            report["chunks"] += result["chunks"]
+            report["bytes"] += result["bytes"]
+            if not result["checksums"]:
+                report["unchecked"].append(result["data"])
+            report["bad"].extend((result["data"], idx, reason) for idx, reason in result["bad"])
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the chunk checksums of a SISF archive.")
+    parser.add_argument("archive", help="SISF archive folder, packed archive, folder of shard pairs, or a .meta file")
+    parser.add_argument("--workers", type=int, default=8, help="number of shards to check concurrently")
+    args = parser.parse_args()
+
+    report = verify(args.archive, workers=args.workers)
+
+    print(f"Checked {report['chunks']} chunks ({report['bytes'] / 1e9:.2f} GB) in {report['shards']} shards.")
+    if report["unchecked"]:
+        print(f"{len(report['unchecked'])} shards have no checksums and were only checked for consistency.")
+    for fname_data, idx, reason in report["bad"]:
+        print(f"BAD {fname_data} chunk {idx}: {reason}")
+
+    raise SystemExit(1 if report["bad"] else 0)
+
+
+if __name__ == "__main__":
+    main()
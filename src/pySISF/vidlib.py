@@ -5,7 +5,9 @@
 
 from enum import Enum
 import numpy as np
+import struct
 import subprocess
+import threading
 
 # Static builds can be downloaded from:
 # - https://github.com/BtbN/FFmpeg-Builds/releases/tag/latest
@@ -16,17 +18,46 @@ EncoderType = Enum("EncoderType", ["X264", "X265", "AV1_AOM", "AV1_SVT"])
 
 DEBUG=False
 
+# Optional blob header describing the encoded stack: magic, version, x, y, z, dtype code, EncoderType value
+BLOB_MAGIC = b"SISV"
+BLOB_HEADER_LAYOUT = "<4sHIIIHH"
+BLOB_HEADER_SIZE = struct.calcsize(BLOB_HEADER_LAYOUT)
+BLOB_VERSION = 1
 
-def encode_stack(input_stack, method=EncoderType.X264, debug=False, fps=24, compression_opts=None):
-    if len(input_stack.shape) != 3:
-        raise ValueError(f"Invalid input size {input_stack.shape}! (should be 3)")
+# Raw stream demuxer for each encoder, used when decoding concatenated blobs
+DEMUXER = {
+    EncoderType.X264: "h264",
+    EncoderType.X265: "hevc",
+    EncoderType.AV1_AOM: "obu",
+    EncoderType.AV1_SVT: "obu",
+}
 
-    # Input XYZ formatted, using Z as time channel
+# Encoder options for `encode_stacks`: an IDR frame with repeated parameter sets every `{z}` frames, so that the
+# stream of one encoder splits into independently decodable stacks. AV1 has no equivalent and is encoded per stack.
+SEGMENT_OPTIONS = {
+    EncoderType.X264: ["-x264-params", "keyint={z}:min-keyint={z}:scenecut=0:repeat-headers=1"],
+    EncoderType.X265: [
+        "-x265-params",
+        "keyint={z}:min-keyint={z}:scenecut=0:open-gop=0:repeat-headers=1:log-level=error",
+    ],
+}
 
-    t = input_stack.shape[2]
-    w = input_stack.shape[0]
-    h = input_stack.shape[1]
+# First NAL unit type written for each stack in `encode_stacks` output (h264 SPS, hevc VPS)
+SEGMENT_NAL = {
+    EncoderType.X264: lambda header: header & 0x1F == 7,
+    EncoderType.X265: lambda header: (header >> 1) & 0x3F == 32,
+}
 
+# Tone-mapping for uint16 input, equivalent to `(x.astype(np.float32) ** 0.5).astype(np.uint8)`
+UINT16_LUT = (np.arange(2**16, dtype=np.float32) ** 0.5).astype(np.uint8)
+# Approximate inverse of UINT16_LUT, used to restore uint16 output
+UINT16_INVERSE_LUT = np.arange(2**8, dtype=np.uint16) ** 2
+
+# Same codes as the SISF header
+DTYPE_CODES = {np.dtype(np.uint16): 1, np.dtype(np.uint8): 2}
+
+
+def build_encode_command(w, h, method=EncoderType.X264, fps=24, compression_opts=None):
     match method:
         case EncoderType.X264:
             crf = 17
@@ -101,7 +132,11 @@ def encode_stack(input_stack, method=EncoderType.X264, debug=False, fps=24, comp
 
     ffmpeg_command.append("pipe:")
 
-    job = subprocess.Popen(
+    return ffmpeg_command
+
+
+def spawn_encoder(ffmpeg_command):
+    return subprocess.Popen(
         ffmpeg_command,
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -109,27 +144,72 @@ def encode_stack(input_stack, method=EncoderType.X264, debug=False, fps=24, comp
         stderr=subprocess.DEVNULL if not DEBUG else subprocess.STDOUT,
     )
 
-    to_encoder = b""
 
+def iter_frames(input_stack):
+    """
+    Yields the Z frames of an XYZ stack as contiguous uint8 (X, Y) arrays.
+
+    uint16 input is tone-mapped through `UINT16_LUT`, so only a single frame is held in memory at a time.
+    """
     match input_stack.dtype:
         case np.uint8:
-            to_encoder = np.moveaxis(input_stack, -1, 0).tobytes()
+            for z in range(input_stack.shape[2]):
+                yield np.ascontiguousarray(input_stack[:, :, z])
         case np.uint16:
-            # apply rescale...
-            to_encoder = np.array(input_stack, dtype=np.float32)
-            # to_encoder /= to_encoder.max() if to_encoder.max() > 0 else 1
-            # to_encoder *= 2**8
+            for z in range(input_stack.shape[2]):
+                yield UINT16_LUT[input_stack[:, :, z]]
+        case _:
+            raise ValueError(f"Invalid data input type {input_stack.dtype}.")
 
-            to_encoder = to_encoder**0.5
 
-            to_encoder = to_encoder.astype(np.uint8)
+def pack_blob_header(input_stack, method):
+    return struct.pack(
+        BLOB_HEADER_LAYOUT,
+        BLOB_MAGIC,
+        BLOB_VERSION,
+        *input_stack.shape,
+        DTYPE_CODES[input_stack.dtype],
+        method.value,
+    )
 
-            to_encoder = np.moveaxis(to_encoder, -1, 0)
-            to_encoder = to_encoder.tobytes()
-        case _:
-            raise ValueError(f"Invalid data input type {input_stack.dtype}.")
 
-    out, err = job.communicate(input=to_encoder)
+def parse_blob_header(input_blob):
+    """
+    Reads the header written by `encode_stack`.
+
+    Returns:
+        (shape, dtype, method, payload) for blobs with a header, or None for bare encoded streams.
+    """
+    if len(input_blob) < BLOB_HEADER_SIZE or bytes(input_blob[: len(BLOB_MAGIC)]) != BLOB_MAGIC:
+        return None
+
+    magic, version, x, y, z, dtype_code, method = struct.unpack_from(BLOB_HEADER_LAYOUT, input_blob)
+    if version != BLOB_VERSION:
+        raise ValueError(f"Unsupported video blob version {version}.")
+
+    dtype = {code: dtype for dtype, code in DTYPE_CODES.items()}[dtype_code]
+    return (x, y, z), dtype, EncoderType(method), memoryview(input_blob)[BLOB_HEADER_SIZE:]
+
+
+def stream_encode(job, input_stacks):
+    """Feeds the frames of each stack in `input_stacks` to a running encoder and returns the encoded stream."""
+
+    def feed():
+        try:
+            for input_stack in input_stacks:
+                for frame in iter_frames(input_stack):
+                    job.stdin.write(frame.data)
+        except BrokenPipeError:
+            pass  # encoder exited early, reported below by the empty output
+        finally:
+            job.stdin.close()
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    out = job.stdout.read()
+    writer.join()
+    job.stdout.close()
+    job.wait()
 
     if not len(out):
         raise ValueError("No output receieved from ffmpeg. Is your chunk size sufficient?")
@@ -137,7 +217,221 @@ def encode_stack(input_stack, method=EncoderType.X264, debug=False, fps=24, comp
     return out
 
 
-def decode_stack(input_blob, dims=(128, 128), method="libx264", debug=False, fps="24/1"):
+def split_stream(stream, method):
+    """Splits an Annex B stream written with `SEGMENT_OPTIONS` at the parameter sets starting each stack."""
+    starts = []
+    i = stream.find(b"\x00\x00\x01")
+    while i >= 0:
+        if i + 3 < len(stream) and SEGMENT_NAL[method](stream[i + 3]):
+            starts.append(i - 1 if i and stream[i - 1] == 0 else i)  # include 4-byte start codes
+        i = stream.find(b"\x00\x00\x01", i + 3)
+
+    return [stream[start:end] for start, end in zip(starts, starts[1:] + [len(stream)])]
+
+
+def encode_stack(input_stack, method=EncoderType.X264, debug=False, fps=24, compression_opts=None, header=False):
+    """
+    Encodes an XYZ stack as a video, using Z as the time axis.
+
+    Parameters:
+        input_stack (3D numpy array): uint8 or uint16 stack, uint16 is tone-mapped through `UINT16_LUT`.
+        method (EncoderType, default X264): encoder to use.
+        fps (int, default 24): nominal frame rate of the stream.
+        compression_opts (dict, default None): overrides for "crf" and "preset".
+        header (bool, default False): prefix the stream with the stack shape, dtype and encoder so that
+            `decode_stack`/`decode_stacks` do not need them to be supplied. Off by default, so that the
+            output stays a bare stream playable by ffmpeg.
+    """
+    if len(input_stack.shape) != 3:
+        raise ValueError(f"Invalid input size {input_stack.shape}! (should be 3)")
+
+    # Input XYZ formatted, using Z as time channel
+    w = input_stack.shape[0]
+    h = input_stack.shape[1]
+
+    ffmpeg_command = build_encode_command(w, h, method=method, fps=fps, compression_opts=compression_opts)
+    out = stream_encode(spawn_encoder(ffmpeg_command), [input_stack])
+
+    return pack_blob_header(input_stack, method) + out if header else out
+
+
+def encode_stacks(input_stacks, method=EncoderType.X264, fps=24, compression_opts=None, header=False):
+    """
+    Encodes many XYZ stacks, using one ffmpeg process per run of consecutive stacks of the same shape.
+
+    The encoder is told to start every stack with an IDR frame and repeated parameter sets, so its output is
+    split back into one independent stream per stack, each decodable on its own like `encode_stack` output.
+    Rate control looks across stack boundaries, so the bytes differ slightly from encoding each stack alone.
+    AV1 streams can not be split this way and fall back to one `encode_stack` call per stack.
+
+    Parameters:
+        input_stacks (list of 3D numpy arrays): uint8 or uint16 stacks, see `encode_stack`.
+        method, fps, compression_opts, header: see `encode_stack`.
+
+    Returns:
+        List of encoded stacks, one per input stack.
+    """
+    if method not in SEGMENT_OPTIONS:
+        return [
+            encode_stack(stack, method=method, fps=fps, compression_opts=compression_opts, header=header)
+            for stack in input_stacks
+        ]
+
+    for stack in input_stacks:
+        if len(stack.shape) != 3:
+            raise ValueError(f"Invalid input size {stack.shape}! (should be 3)")
+
+    # Split into runs which can share one encoder
+    batches = []
+    for stack in input_stacks:
+        if batches and batches[-1][0].shape == stack.shape:
+            batches[-1].append(stack)
+        else:
+            batches.append([stack])
+
+    out = []
+    for batch in batches:
+        w, h, z = batch[0].shape
+        ffmpeg_command = build_encode_command(w, h, method=method, fps=fps, compression_opts=compression_opts)
+        ffmpeg_command[-1:-1] = [option.format(z=z) for option in SEGMENT_OPTIONS[method]]
+
+        streams = split_stream(stream_encode(spawn_encoder(ffmpeg_command), batch), method)
+        if len(streams) != len(batch):
+            raise ValueError(f"ffmpeg returned {len(streams)} streams for {len(batch)} stacks.")
+
+        for stack, stream in zip(batch, streams):
+            out.append(pack_blob_header(stack, method) + stream if header else stream)
+
+    return out
+
+
+def build_decode_command(demuxer=None, fps="24/1"):
+    ffmpeg_command = [ffmpeg_exe]
+    if demuxer is not None:
+        ffmpeg_command.extend(["-f", demuxer])
+    ffmpeg_command.extend(
+        [
+            # Formatting for the input stream
+            "-r",
+            fps,
+            "-i",
+            "pipe:",
+            # Formatting for the output stream, one output frame per decoded frame
+            "-an",
+            "-fps_mode",
+            "passthrough",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "gray",
+            "-vcodec",
+            "rawvideo",
+            "pipe:",
+        ]
+    )
+    return ffmpeg_command
+
+
+def read_frames(job, outputs, restore_dtype=False):
+    """
+    Reads decoded gray frames from `job` straight into the Z planes of each preallocated XYZ array in `outputs`.
+    """
+    frame = None
+    for out in outputs:
+        frame_shape = out.shape[:2]
+        if frame is None or frame.shape != frame_shape:
+            frame = np.empty(frame_shape, dtype=np.uint8)
+
+        for z in range(out.shape[2]):
+            if job.stdout.readinto(frame.data) != frame.nbytes:
+                raise ValueError("ffmpeg returned fewer frames than the blob headers describe.")
+
+            if out.dtype == np.uint16 and restore_dtype:
+                np.take(UINT16_INVERSE_LUT, frame, out=out[:, :, z])
+            else:
+                out[:, :, z] = frame
+
+
+def decode_stacks(input_blobs, fps="24/1", restore_dtype=False, out=None):
+    """
+    Decodes many blobs written by `encode_stack` (with header=True) using one ffmpeg process per batch.
+
+    Consecutive blobs with the same frame size and encoder are concatenated into a single stream, and frames
+    are copied directly into preallocated XYZ arrays.
+
+    Parameters:
+        input_blobs (list of bytes-like): encoded stacks, each with a blob header.
+        fps (str, default "24/1"): nominal frame rate of the stream.
+        restore_dtype (bool, default False): return uint16 stacks for uint16 input, using `UINT16_INVERSE_LUT`,
+            instead of the decoded uint8 frames.
+        out (list of numpy arrays, default None): destination arrays, allocated if not given.
+
+    Returns:
+        List of XYZ numpy arrays, one per blob.
+    """
+    parsed = []
+    for blob in input_blobs:
+        info = parse_blob_header(blob)
+        if info is None:
+            raise ValueError("decode_stacks requires blobs encoded with a header.")
+        parsed.append(info)
+
+    if out is None:
+        out = [
+            np.empty(shape, dtype=dtype if restore_dtype else np.uint8) for shape, dtype, _, _ in parsed
+        ]
+    elif len(out) != len(parsed):
+        raise ValueError(f"Expected {len(parsed)} output arrays, got {len(out)}.")
+
+    # Split into runs which can share one decoder
+    batches = []
+    for i, (shape, _, method, _) in enumerate(parsed):
+        key = (shape[:2], DEMUXER[method])
+        if batches and batches[-1][0] == key:
+            batches[-1][1].append(i)
+        else:
+            batches.append((key, [i]))
+
+    for (_, demuxer), indices in batches:
+        job = subprocess.Popen(
+            build_decode_command(demuxer=demuxer, fps=fps),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL if not DEBUG else subprocess.STDOUT,
+        )
+
+        def feed(job=job, indices=indices):
+            try:
+                for i in indices:
+                    job.stdin.write(parsed[i][3])
+            except BrokenPipeError:
+                pass  # decoder exited early, reported by read_frames
+            finally:
+                job.stdin.close()
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        try:
+            read_frames(job, [out[i] for i in indices], restore_dtype=restore_dtype)
+        finally:
+            job.stdout.close()
+            writer.join()
+            job.wait()
+
+    return out
+
+
+def decode_stack(input_blob, dims=(128, 128), method="libx264", debug=False, fps="24/1", restore_dtype=False):
+    """
+    Decodes a single blob produced by `encode_stack`.
+
+    Returns the decoded uint8 XYZ stack. Blobs with a header are decoded into a preallocated array of the
+    recorded shape, and of the recorded dtype with `restore_dtype` set; `dims` is only used for bare streams
+    without a header.
+    """
+    if parse_blob_header(input_blob) is not None:
+        return decode_stacks([input_blob], fps=fps, restore_dtype=restore_dtype)[0]
+
     ffmpeg_command = [
         ffmpeg_exe,
         # Formatting for the input stream
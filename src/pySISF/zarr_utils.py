@@ -0,0 +1,253 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""
+Export of SISF archives to OME-Zarr (0.5, on zarr v3), with one multiscale level per stored `.NX` pyramid level.
+
+Arrays have axes (c, x, y, z), so a chunk stored in C order is laid out exactly like a SISF chunk, and use the
+`bytes` + `zstd` codec chain. Chunks of zstd (compression 1) archives are therefore copied as stored, straight from
+the shard index, wherever the zarr chunk is a whole SISF chunk: the chunk grid matches the metachunk grid and the
+chunk is not cut by the archive edge. Other chunks are decoded and re-encoded.
+
+With `sharded=True`, chunks are grouped into `sharding_indexed` shards of one metachunk (rounded up to whole
+chunks), as SISF shards do, instead of one file per chunk.
+
+Usage:
+    python -m pySISF.zarr_utils archive archive.ome.zarr [--sharded]
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import struct
+
+import numpy as np
+import zstd
+
+from pySISF import analysis, sisf
+
+OME_VERSION = "0.5"
+AXES = ("c", "x", "y", "z")
+# Shard index entry of a chunk missing from the shard
+MISSING_CHUNK = 2**64 - 1
+
+
+def array_metadata(shape, dtype, chunk_shape, compression_level=9, inner_chunk_shape=None):
+    """Returns the zarr v3 `zarr.json` of an array, sharded when `inner_chunk_shape` is set."""
+    codecs = [
+        {"name": "bytes", "configuration": {"endian": "little"}},
+        {"name": "zstd", "configuration": {"level": compression_level, "checksum": False}},
+    ]
+    if inner_chunk_shape is not None:
+        codecs = [
+            {
+                "name": "sharding_indexed",
+                "configuration": {
+                    "chunk_shape": list(inner_chunk_shape),
+                    "codecs": codecs,
+                    "index_codecs": [{"name": "bytes", "configuration": {"endian": "little"}}],
+                    "index_location": "end",
+                },
+            }
+        ]
+
+    return {
+        "zarr_format": 3,
+        "node_type": "array",
+        "shape": list(shape),
+        "data_type": np.dtype(dtype).name,
+        "chunk_grid": {"name": "regular", "configuration": {"chunk_shape": list(chunk_shape)}},
+        "chunk_key_encoding": {"name": "default", "configuration": {"separator": "/"}},
+        "fill_value": 0,
+        "codecs": codecs,
+        "dimension_names": list(AXES),
+        "attributes": {},
+    }
+
+
+def multiscales_metadata(name, res, scales):
+    """Returns the OME-Zarr `zarr.json` of the root group, `res` being in nm."""
+    axes = [{"name": "c", "type": "channel"}]
+    axes.extend({"name": axis, "type": "space", "unit": "nanometer"} for axis in AXES[1:])
+
+    datasets = [
+        {
+            "path": str(level),
+            "coordinateTransformations": [{"type": "scale", "scale": [1.0, *(float(r * scale) for r in res)]}],
+        }
+        for level, scale in enumerate(scales)
+    ]
+
+    return {
+        "zarr_format": 3,
+        "node_type": "group",
+        "attributes": {
+            "ome": {"version": OME_VERSION, "multiscales": [{"name": name, "axes": axes, "datasets": datasets}]}
+        },
+    }
+
+
+def write_json(fname, value):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname, "w") as f:
+        json.dump(value, f, indent=1)
+
+
+def find_stored_chunk(archive, channel, scale, start, chunk_size, mchunk_size):
+    """
+    Returns (shard, chunk id) if the zarr chunk starting at `start` is a whole stored SISF chunk, None otherwise.
+    """
+    mchunk = tuple(s // m for s, m in zip(start, mchunk_size))
+    if any((s + c - 1) // m != i for s, c, m, i in zip(start, chunk_size, mchunk_size, mchunk)):
+        return None  # crosses a metachunk boundary
+
+    shard = archive.get_shard(*mchunk, channel, scale)
+    local = tuple(s - i * m + crop_start for s, i, m, (crop_start, _) in zip(start, mchunk, mchunk_size, shard.crop))
+    if shard.chunk_size != tuple(chunk_size) or any(s % c for s, c in zip(local, chunk_size)):
+        return None
+
+    idx = shard.find_index(*local)
+    if shard.get_chunk_size(idx) != tuple(chunk_size):
+        return None
+
+    return shard, idx
+
+
+def export_zarr(archive, dst, levels=None, sharded=False, compression_level=9, thread_count=8, progress=True):
+    """
+    Exports an archive to OME-Zarr.
+
+    Parameters:
+        archive (str or pySISF.sisf.sisf): archive to export.
+        dst (str): zarr folder to create, usually ending in ".ome.zarr".
+        levels (list of int, default None): pyramid levels (1, 2, 4, ...) to export, every stored level if not set.
+        sharded (bool, default False): group chunks into one `sharding_indexed` shard per metachunk.
+        compression_level (int, default 9): zstd level of re-encoded chunks.
+        thread_count (int, default 8): number of metachunks exported in parallel.
+        progress (bool, default True): prints a loading bar using `tqdm`.
+
+    Returns:
+        dict with the number of chunks "copied" as stored and "encoded" after decoding.
+    """
+    import tqdm
+
+    archive = analysis.open_archive(archive)
+    dtype = np.dtype(sisf.get_dtype(archive.dtype))
+    if levels is None:
+        levels = [2**i for i in range(analysis.coarsest_scale(archive).bit_length())]
+
+    name = os.path.basename(archive.fname)
+    write_json(os.path.join(dst, "zarr.json"), multiscales_metadata(name, archive.res, levels))
+
+    tasks = []
+    for level, scale in enumerate(levels):
+        size = analysis.scaled_size(archive, 0, scale)
+        first = archive.get_shard(0, 0, 0, 0, scale)
+        chunk_size = first.chunk_size
+        mchunk_size = tuple(m // scale for m in archive.mchunk)
+        block = tuple(c * -(-m // c) for c, m in zip(chunk_size, mchunk_size))
+
+        shape = (archive.channel_count, *size)
+        if sharded:
+            metadata = array_metadata(shape, dtype, (1, *block), compression_level, (1, *chunk_size))
+        else:
+            metadata = array_metadata(shape, dtype, (1, *chunk_size), compression_level)
+        write_json(os.path.join(dst, str(level), "zarr.json"), metadata)
+
+        level_info = (level, scale, size, chunk_size, mchunk_size, block, first.compression_type)
+        for c in range(archive.channel_count):
+            for origin in itertools.product(*(range(0, s, b) for s, b in zip(size, block))):
+                tasks.append((level_info, c, origin))
+
+    def export_block(task):
+        (level, scale, size, chunk_size, mchunk_size, block, compression), c, origin = task
+        counts = [b // cs for b, cs in zip(block, chunk_size)]
+
+        # Every chunk of the block, in C order: (position in the block, global start, stored chunk or None)
+        chunks = []
+        for pos in itertools.product(*(range(n) for n in counts)):
+            start = tuple(o + p * cs for o, p, cs in zip(origin, pos, chunk_size))
+            if any(s >= e for s, e in zip(start, size)):
+                continue
+            stored = None
+            if compression == 1 and all(s + cs <= e for s, cs, e in zip(start, chunk_size, size)):
+                stored = find_stored_chunk(archive, c, scale, start, chunk_size, mchunk_size)
+            chunks.append((pos, start, stored))
+
+        # Copy stored payloads, fetching the chunks of each shard with coalesced reads
+        payloads = {}
+        by_shard = {}
+        for pos, _, stored in chunks:
+            if stored is not None:
+                by_shard.setdefault(id(stored[0]), (stored[0], []))[1].append((pos, stored[1]))
+        for shard, entries in by_shard.values():
+            for (pos, _), blob in zip(entries, shard.fetch_chunks([idx for _, idx in entries])):
+                payloads[pos] = blob
+
+        for pos, start, stored in chunks:
+            if stored is None:
+                buf = np.zeros((1, *chunk_size), dtype=dtype)
+                region = tuple((s, min(s + cs, e)) for s, cs, e in zip(start, chunk_size, size))
+                sisf.execute_read_plan(archive.plan_read(((c, c + 1), *region), scale=scale), buf)
+                payloads[pos] = zstd.ZSTD_compress(buf, compression_level, 1)
+
+        if sharded:
+            key = os.path.join(dst, str(level), "c", str(c), *(str(o // b) for o, b in zip(origin, block)))
+            write_shard(key, payloads, counts)
+        else:
+            for pos, start, _ in chunks:
+                key = os.path.join(dst, str(level), "c", str(c), *(str(s // cs) for s, cs in zip(start, chunk_size)))
+                os.makedirs(os.path.dirname(key), exist_ok=True)
+                with open(key, "wb") as f:
+                    f.write(payloads[pos])
+
+        copied = sum(stored is not None for _, _, stored in chunks)
+        return copied, len(chunks) - copied
+
+    out = {"copied": 0, "encoded": 0}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for copied, encoded in tqdm.tqdm(executor.map(export_block, tasks), total=len(tasks), disable=not progress):
+            out["copied"] += copied
+            out["encoded"] += encoded
+
+    return out
+
+
+def write_shard(fname, payloads, counts):
+    """
+    Writes a `sharding_indexed` shard: chunk payloads back to back, then an index of (offset, size) uint64 pairs
+    over the chunks of the shard in C order, `MISSING_CHUNK` for absent chunks.
+    """
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+    index = []
+    offset = 0
+    with open(fname, "wb") as f:
+        for pos in itertools.product(*(range(n) for n in counts)):
+            blob = payloads.get(pos)
+            if blob is None:
+                index.extend((MISSING_CHUNK, MISSING_CHUNK))
+                continue
+            f.write(blob)
+            index.extend((offset, len(blob)))
+            offset += len(blob)
+        f.write(struct.pack(f"<{len(index)}Q", *index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a SISF archive to OME-Zarr (zarr v3).")
+    parser.add_argument("archive", help="SISF archive")
+    parser.add_argument("dst", help="zarr folder to create")
+    parser.add_argument("--sharded", action="store_true", help="write one zarr shard per metachunk")
+    parser.add_argument("--threads", type=int, default=8, help="metachunks exported in parallel")
+    args = parser.parse_args()
+
+    counts = export_zarr(args.archive, args.dst, sharded=args.sharded, thread_count=args.threads)
+    print(f"Copied {counts['copied']} chunks, re-encoded {counts['encoded']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@
 """This is a sample python file for testing functions from the source code."""
 from __future__ import annotations
 
+import os
+import subprocess
+import sys
+
 import pySISF
 
 # Silence exit code 5
@@ -12,4 +16,11 @@ def test_int_placeholder() -> None:
     pass
 
 def test_placeholder() -> None:
-    pass
\ No newline at end of file
+    pass
+
+
+def test_import_is_lazy() -> None:
+    code = "import sys, pySISF.sisf; print(' '.join(m for m in ('numba', 'h5ffmpeg', 'tqdm') if m in sys.modules))"
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(pySISF.__file__))}
+    result = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    assert result.stdout.strip() == ""
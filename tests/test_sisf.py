@@ -0,0 +1,708 @@
+#   ---------------------------------------------------------------------------------
+#   Copyright (c) University of Michigan 2020-2025. All rights reserved.
+#   Licensed under the MIT License. See LICENSE in project root for information.
+#   ---------------------------------------------------------------------------------
+"""Round-trip tests for SISF archives on small synthetic volumes."""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from pySISF import sisf
+
+
+@pytest.fixture
+def volume():
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 1000, size=(70, 50, 33), dtype=np.uint16)
+    data[:32] = 0
+    return data
+
+
+@pytest.fixture
+def archive(tmp_path, volume):
+    fname = str(tmp_path / "archive")
+    sisf.create_sisf(fname, volume, (64, 64, 64), (32, 32, 10), (1, 1, 1), enable_status=False, downsampling=2)
+    return sisf.sisf(fname)
+
+
+def test_roundtrip(archive, volume) -> None:
+    assert archive.shape == (1, *volume.shape)
+    assert (archive[0, :, :, :] == volume).all()
+    assert (archive[0, 10:40, 5:45, 3:30] == volume[10:40, 5:45, 3:30]).all()
+
+
+def test_chunk_stats(archive, volume) -> None:
+    table = archive.chunk_stats()
+    assert table["bounds"].shape == (len(table["max"]), 6)
+
+    for (xs, xe, ys, ye, zs, ze), cmin, cmax, cmean, cnz in zip(
+        table["bounds"], table["min"], table["max"], table["mean"], table["nonzero"]
+    ):
+        block = volume[xs:xe, ys:ye, zs:ze]
+        assert cmin == block.min()
+        assert cmax == block.max()
+        assert cmean == pytest.approx(block.mean())
+        assert cnz == np.count_nonzero(block)
+
+    assert (archive.find_chunks(1)[:, 0] >= 32).all()
+
+
+def test_metrics_trace(archive) -> None:
+    from pySISF import metrics
+
+    with metrics.trace() as events:
+        archive[0, 0:5, 0:5, 0:5]
+
+    stages = {stage for stage, _, _ in events}
+    assert {"open", "read", "decompress", "copy"} <= stages
+    assert not metrics.ENABLED
+
+    # A timer started while disabled is not recorded once enabled
+    t = metrics.start()
+    with metrics.trace() as events:
+        assert metrics.record("late", t) > 0
+    assert events == []
+
+
+def test_verify_detects_corruption(tmp_path, archive) -> None:
+    from pySISF import pack, verify
+
+    report = verify.verify(archive.fname, workers=2, progress=False)
+    assert report["bad"] == [] and report["unchecked"] == []
+    assert report["chunks"] > 0
+
+    packed = str(tmp_path / "archive.sisfpack")
+    pack.pack(archive.fname, packed, progress=False)
+    packed_report = verify.verify(packed, workers=2, progress=False)
+    assert packed_report["bad"] == [] and packed_report["unchecked"] == []
+    assert (packed_report["shards"], packed_report["chunks"]) == (report["shards"], report["chunks"])
+
+    shard = archive.get_chunk(1, 0, 0, 0, 1)
+    offset, size = shard.get_metadata(3)
+    with open(shard.storage.path(shard.fname_data), "r+b") as f:
+        f.seek(offset + size // 2)
+        value = f.read(1)
+        f.seek(offset + size // 2)
+        f.write(bytes([value[0] ^ 0xFF]))
+
+    report = verify.verify(archive.fname, workers=2, progress=False)
+    assert report["bad"] == [(shard.storage.path(shard.fname_data), 3, "checksum mismatch")]
+
+    checked = sisf.sisf(archive.fname, verify_checksums=True)
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        checked[0, :, :, :]
+
+
+def test_multichannel_and_crop(tmp_path, volume) -> None:
+    data = np.stack([volume, volume[::-1], volume // 2])
+    fname = str(tmp_path / "multi")
+    sisf.create_sisf(fname, data, (32, 32, 16), (16, 16, 8), (1, 1, 1), enable_status=False)
+    archive = sisf.sisf(fname)
+    assert (archive[1:3, 20:60, 5:45, 10:30] == data[1:3, 20:60, 5:45, 10:30]).all()
+
+    crop = (10, 60, 5, 45, 3, 30)
+    fname_data, fname_meta = str(tmp_path / "crop.data"), str(tmp_path / "crop.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (16, 16, 8), 1, crop=crop, progress=False)
+    shard = sisf.sisf_chunk(fname_data, fname_meta)
+    assert shard.shape == (50, 40, 27)
+    assert (shard[:, :, :] == volume[10:60, 5:45, 3:30]).all()
+
+
+@pytest.fixture
+def http_archive(archive):
+    """Serves the archive folder over HTTP with Range support, yielding its URL."""
+    import functools
+    import http.server
+    import threading
+
+    class RangeHandler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            start, end = self.headers["Range"][len("bytes=") :].split("-")
+            try:
+                with open(self.translate_path(self.path), "rb") as f:
+                    f.seek(int(start))
+                    body = f.read(int(end) - int(start) + 1)
+            except FileNotFoundError:
+                self.send_error(404)
+                return
+            self.send_response(206)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(RangeHandler, directory=archive.fname)
+    with http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+
+
+def test_http_range_reads(http_archive, volume) -> None:
+    from pySISF import metrics, storage
+
+    remote = sisf.sisf(http_archive)
+    assert isinstance(remote.storage, storage.HTTPStorage)
+
+    metrics.reset()
+    with metrics.trace():
+        assert (remote[0, 10:40, 5:45, 3:30] == volume[10:40, 5:45, 3:30]).all()
+    requests = metrics.stats()["counters"]["read_requests"]
+
+    # Shard header, table lines and chunks with one coalesced request each
+    assert metrics.stats()["counters"]["chunks_decoded"] > 1
+    assert requests == 3 * len(remote.shards)
+
+
+def test_verify_http(http_archive, archive) -> None:
+    import os
+
+    from pySISF import verify
+
+    local = verify.verify(archive.fname, workers=2, progress=False)
+    report = verify.verify(http_archive, workers=2, progress=False)
+    assert report["bad"] == [] and report["unchecked"] == []
+    assert (report["shards"], report["chunks"]) == (local["shards"], local["chunks"])
+
+    fname_data, _ = archive.shard_keys(1, 0, 0, 0, 2)
+    os.remove(os.path.join(archive.fname, fname_data))
+    report = verify.verify(http_archive, workers=2, progress=False)
+    [(name, idx, reason)] = report["bad"]
+    assert (name, idx) == (f"{http_archive}/{fname_data}", None) and reason.startswith("unreadable shard")
+
+
+def test_coalesce_ranges(tmp_path) -> None:
+    from pySISF.storage import LocalStorage, coalesce_ranges
+
+    requests = coalesce_ranges([(100, 10), (0, 50), (60, 20), (10000, 5)], max_gap=32)
+    assert requests == [(0, 110, [1, 2, 0]), (10000, 5, [3])]
+
+    payload = bytes(range(256)) * 64
+    (tmp_path / "blob").write_bytes(payload)
+    local = LocalStorage(str(tmp_path), max_workers=4, coalesce_gap=0)
+    ranges = [(0, 16), (1000, 100), (5000, 7), (9000, 300)]
+    for _ in range(2):
+        assert [bytes(b) for b in local.read_ranges("blob", ranges)] == [payload[o : o + n] for o, n in ranges]
+    executor = local.get_fetch_executor()
+    local.read_ranges("blob", ranges)
+    assert local.get_fetch_executor() is executor
+
+
+@pytest.mark.parametrize("segment_size", [None, 4096])
+def test_pack_roundtrip(tmp_path, archive, volume, segment_size) -> None:
+    import filecmp
+
+    from pySISF import pack, storage
+
+    fname = str(tmp_path / "archive.sisfpack")
+    segments = pack.pack(archive.fname, fname, segment_size=segment_size, progress=False)
+    assert (segments > 1) == (segment_size is not None)
+
+    packed = sisf.sisf(fname)
+    assert isinstance(packed.storage, storage.PackedStorage)
+    assert (packed[0, :, :, :] == volume).all()
+    assert (packed[0, 10:40, 5:45, 3:30] == volume[10:40, 5:45, 3:30]).all()
+
+    pack.unpack(fname, str(tmp_path / "unpacked"), progress=False)
+    for key in pack.archive_keys(archive.fname):
+        assert filecmp.cmp(f"{archive.fname}/{key}", str(tmp_path / "unpacked" / key), shallow=False)
+
+
+def test_pack_write_and_close(tmp_path, volume) -> None:
+    from pySISF import storage
+
+    fname = str(tmp_path / "written.sisfpack")
+    sisf.create_sisf(fname, volume, (64, 64, 64), (32, 32, 10), (1, 1, 1), enable_status=False, packed=True)
+    assert [p.name for p in tmp_path.iterdir()] == ["written.sisfpack"]
+
+    with storage.PackedStorage(fname) as packed:
+        archive = sisf.sisf(fname, storage=packed)
+        assert (archive[0, :, :, :] == volume).all()
+        maps = packed.maps
+        del archive
+    assert all(m.closed for m in maps)
+    with pytest.raises(ValueError, match="closed"):
+        packed.read("metadata.bin")
+    packed.close()
+
+    # Slices still in use keep their map open instead of failing
+    packed = storage.PackedStorage(fname)
+    header, maps = packed.read("metadata.bin"), packed.maps
+    packed.close()
+    assert not maps[0].closed and len(bytes(header))
+
+
+@pytest.mark.parametrize("order", ["morton", "hilbert"])
+def test_chunk_order(tmp_path, volume, order) -> None:
+    from pySISF import storage
+
+    assert sorted(sisf.chunk_write_order((3, 4, 5), sisf.CHUNK_ORDERS[order])) == list(range(60))
+    if order == "hilbert":
+        # Consecutive chunks of a Hilbert curve are face neighbours
+        path = [(idx // 16, idx // 4 % 4, idx % 4) for idx in sisf.chunk_write_order((4, 4, 4), 2)]
+        assert all(sum(abs(a - b) for a, b in zip(p, q)) == 1 for p, q in zip(path, path[1:]))
+
+    fname_data, fname_meta = str(tmp_path / f"{order}.data"), str(tmp_path / f"{order}.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (16, 16, 8), 1, progress=False, order=order)
+    shard = sisf.sisf_chunk(fname_data, fname_meta, storage=storage.LocalStorage(coalesce_gap=0))
+    assert shard.chunk_order == sisf.CHUNK_ORDERS[order]
+    assert (shard[:, :, :] == volume).all()
+
+    # The first 8 chunks of a Morton/Hilbert order form a 2x2x2 cube, stored contiguously
+    first = sorted(range(shard.chunk_count), key=shard.chunk_rank)[:8]
+    offsets = sorted(shard.get_metadata(idx) for idx in first)
+    assert offsets[0][0] == 0
+    assert all(a[0] + a[1] == b[0] for a, b in zip(offsets, offsets[1:]))
+
+
+def test_chunk_order_requests(tmp_path) -> None:
+    from pySISF import metrics, storage
+
+    data = np.random.default_rng(0).integers(0, 1000, size=(128, 128, 64), dtype=np.uint16)
+    access = {
+        "cube": np.s_[32:64, 32:64, 8:24],
+        "aligned_cube": np.s_[32:64, 32:64, 16:32],
+        "xy_plane": np.s_[:, :, 15],
+        "xz_plane": np.s_[:, 50, :],
+        "yz_plane": np.s_[50, :, :],
+    }
+
+    requests = {}
+    for order in sisf.CHUNK_ORDERS:
+        fname_data, fname_meta = str(tmp_path / f"{order}.data"), str(tmp_path / f"{order}.meta")
+        sisf.create_shard(fname_data, fname_meta, data, (16, 16, 8), 1, progress=False, order=order)
+        # Only exactly adjacent chunks are merged into one request
+        local = storage.LocalStorage(coalesce_gap=0)
+        shard = sisf.sisf_chunk(fname_data, fname_meta, cache_metadata=True, storage=local)
+        for kind, key in access.items():
+            metrics.reset()
+            with metrics.trace():
+                region = shard[key]
+            requests[order, kind] = metrics.stats()["counters"]["read_requests"]
+            assert (np.squeeze(region) == data[key]).all()
+    metrics.reset()
+
+    # Hilbert order reads cubes and xy planes with fewer requests, Morton only aligned cubes
+    for kind in ["cube", "aligned_cube", "xy_plane"]:
+        assert requests["hilbert", kind] < requests["c", kind]
+    assert requests["morton", "aligned_cube"] == 1 < requests["c", "aligned_cube"]
+    assert requests["morton", "cube"] > requests["c", "cube"]
+
+    # C order stays best for planes containing the z axis
+    for kind in ["xz_plane", "yz_plane"]:
+        assert requests["c", kind] < min(requests["morton", kind], requests["hilbert", kind])
+
+
+def test_advisor(volume) -> None:
+    from pySISF import advisor
+
+    workload = {"xy_plane": 2, "cube:16": 1, "point": 1}
+    report = advisor.advise(
+        volume, workload, [(8, 8, 8), (32, 32, 10)], mchunk_sizes=[(256, 256, 256)], queries_per_kind=2, progress=False
+    )
+
+    assert len(report["results"]) == 2 and report["recommended"] is report["results"][0]
+    for result in report["results"]:
+        assert result["ratio"] > 1
+        assert result["queries"]["xy_plane"]["amplification"] >= 1
+    assert report["mchunk"]["index_bytes"] <= advisor.DEFAULT_MAX_INDEX_BYTES
+    assert "Recommended: chunk_size=" in advisor.format_report(report)
+
+
+def test_plane_frames(tmp_path, volume) -> None:
+    from pySISF import metrics
+
+    fname_data, fname_meta = str(tmp_path / "frames.data"), str(tmp_path / "frames.meta")
+    sisf.create_shard(fname_data, fname_meta, volume, (32, 32, 10), 4, progress=False)
+    shard = sisf.sisf_chunk(fname_data, fname_meta)
+    assert (shard[:, :, :] == volume).all()
+    assert (shard[5:50, 3:40, 7:25] == volume[5:50, 3:40, 7:25]).all()
+
+    with metrics.trace() as events:
+        plane = shard[:, :, 12]
+    assert (plane[:, :, 0] == volume[:, :, 12]).all()
+    # Only one z-plane of each chunk is decoded
+    assert sum(nbytes for stage, _, nbytes in events if stage == "decompress") == volume[:, :, 12].nbytes
+
+
+@pytest.mark.parametrize("compression", [0, 1, 4])
+def test_worker_output_unchanged(tmp_path, volume, compression) -> None:
+    import zstd
+
+    payloads = []
+    for data in [volume, np.asfortranarray(volume)]:
+        fname_data, fname_meta = str(tmp_path / "w.data"), str(tmp_path / "w.meta")
+        sisf.create_shard(fname_data, fname_meta, data, (32, 32, 10), compression, progress=False)
+        with open(fname_data, "rb") as f:
+            payloads.append(f.read())
+    assert payloads[0] == payloads[1]
+
+    # Last chunk, an edge chunk, matches the plain tobytes() encoding
+    c = volume[64:, 32:, 30:]
+    expected = {0: c.tobytes(), 1: zstd.ZSTD_compress(c.tobytes(), 9, 1)}.get(compression)
+    if expected is not None:
+        assert payloads[0].endswith(expected)
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_tiff_ingest(tmp_path, volume, compression) -> None:
+    tifffile = pytest.importorskip("tifffile")
+    from pySISF import tiff_utils
+
+    # Two channels, stored as ZCYX pages
+    data = np.stack([volume, volume // 3])
+    fname = str(tmp_path / "stack.ome.tif")
+    tifffile.imwrite(fname, data.transpose(3, 0, 2, 1), compression=compression, metadata={"axes": "ZCYX"})
+
+    with tiff_utils.TiffStack(fname, channel=1, workers=2) as stack:
+        assert stack.shape == volume.shape
+        assert (stack.mapped is not None) == (compression is None)
+        assert (stack[5:40, 3:30, 7:20] == data[1, 5:40, 3:30, 7:20]).all()
+        assert (stack[:, 10, :] == data[1, :, 10, :]).all()
+
+    archive = str(tmp_path / "archive")
+    tiff_utils.tiff_to_sisf(fname, archive, (32, 32, 16), (16, 16, 8), (1, 1, 1), downsampling=2, enable_status=False)
+    assert (sisf.sisf(archive)[0:2, :, :, :] == data).all()
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.uint32, np.float32])
+def test_dtypes(tmp_path, volume, dtype) -> None:
+    data = (volume // 4).astype(dtype) if dtype == np.uint8 else volume.astype(dtype) * dtype(3)
+    fname = str(tmp_path / "archive")
+    sisf.create_sisf(fname, data, (64, 64, 64), (16, 16, 8), (1, 1, 1), enable_status=False, downsampling=2)
+
+    archive = sisf.sisf(fname)
+    assert sisf.get_dtype(archive.dtype) == dtype
+    out = archive[0, 5:50, 3:40, 7:25]
+    assert out.dtype == dtype and (out == data[5:50, 3:40, 7:25]).all()
+
+    shard = archive.get_chunk(0, 0, 0, 0, 2)
+    assert shard[:, :, :].dtype == dtype
+    assert shard[0:1, 0:1, 0:1][0, 0, 0] == dtype(data[0:2, 0:2, 0:2].astype(np.float64).mean())
+
+
+@pytest.mark.parametrize("dtype", [np.uint32, np.uint64])
+def test_segmentation(tmp_path, dtype) -> None:
+    from pySISF import segmentation, sndif_utils
+
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 6, size=(9, 7, 6)).repeat(8, axis=0)[:70].repeat(8, axis=1)[:, :50].repeat(6, axis=2)
+    labels = (labels.astype(dtype) * dtype(2**31 + 12345))[:, :, :33]
+    labels[3, 4, 5] = 7  # a block with an unusual label
+
+    for shape in [(8, 8, 8), (13, 5, 33), labels.shape]:
+        chunk = labels[: shape[0], : shape[1], : shape[2]]
+        blob = segmentation.encode(chunk)
+        assert (segmentation.decode(blob, chunk.shape, dtype) == chunk).all()
+    assert len(blob) < labels.nbytes / 10
+
+    fname = str(tmp_path / "labels")
+    sisf.create_sisf(
+        fname, labels, (64, 64, 64), (16, 16, 10), (1, 1, 1), enable_status=False, downsampling=2, compression=5
+    )
+    archive = sisf.sisf(fname)
+    assert (archive[0, :, :, :] == labels).all()
+
+    expected = np.zeros((35, 25, 16), dtype=dtype)
+    sndif_utils.downsample_mode(labels, expected)
+    assert set(np.unique(expected)) <= set(np.unique(labels))
+    assert (archive.get_chunk(1, 0, 0, 0, 2)[:, :, :] == expected[32:35, :, :]).all()
+
+
+def test_flatfield_correct(volume) -> None:
+    from pySISF import sndif_utils
+
+    rng = np.random.default_rng(0)
+    flatfield = rng.uniform(0.5, 1.5, size=volume.shape[:2])
+    darkfield = rng.uniform(0, 300, size=volume.shape[:2])
+    expected = np.clip((volume - darkfield[:, :, None]) / flatfield[:, :, None], 0, 65535)
+
+    out = sndif_utils.flatfield_correct(volume, flatfield, darkfield, out=np.empty_like(volume), slab_size=7)
+    assert np.abs(out - expected.astype(np.uint16).astype(np.int64)).max() <= 1
+
+    planes = np.moveaxis(np.ascontiguousarray(np.moveaxis(volume, -1, 0)), 0, -1)
+    sndif_utils.flatfield_correct(planes, flatfield, darkfield, thread_count=2)
+    assert (planes == out).all()
+
+
+@pytest.mark.parametrize("blending", ["priority", "max", "mean"])
+def test_mosaic(tmp_path, volume, blending) -> None:
+    from pySISF import mosaic
+
+    # Three overlapping tiles of one channel and one tile of a second channel
+    tiles = [("a", (0, 0, 0), 0, 1), ("b", (40, 10, 5), 0, 0), ("c", (60, 45, 0), 0, 2), ("d", (5, 0, 0), 1, 0)]
+    for n, (name, offset, channel, priority) in enumerate(tiles):
+        data = volume + np.uint16(100 * n)
+        sisf.create_shard(
+            str(tmp_path / f"{name}.1X.data"),
+            str(tmp_path / f"{name}.1X.meta"),
+            data,
+            (16, 16, 10),
+            1,
+            crop=(2, 62, 3, 43, 0, 33),
+            progress=False,
+        )
+
+    fname = str(tmp_path / "mosaic.json")
+    entries = [{"name": name, "offset": o, "channel": c, "priority": p} for name, o, c, p in tiles]
+    mosaic.create_mosaic(fname, entries, blending=blending)
+    m = mosaic.mosaic(fname)
+    assert m.shape == (2, 120, 85, 38)
+
+    expected = np.zeros(m.shape, dtype=np.float64)
+    weight = np.zeros(m.shape, dtype=np.int64)
+    order = sorted(range(len(tiles)), key=lambda n: tiles[n][3]) if blending == "priority" else range(len(tiles))
+    for n in order:
+        _, (x, y, z), c, _ = tiles[n]
+        tile = volume[2:62, 3:43, :] + 100.0 * n
+        region = (c, slice(x, x + 60), slice(y, y + 40), slice(z, z + 33))
+        if blending == "max":
+            expected[region] = np.maximum(expected[region], tile)
+        else:
+            expected[region] = tile if blending == "priority" else expected[region] + tile
+        weight[region] += 1
+    if blending == "mean":
+        expected = np.divide(expected, weight, out=expected, where=weight > 0)
+
+    assert (m[:, :, :, :] == expected.astype(np.uint16)).all()
+    assert (m[0, 30:70, 20:50, 7] == expected[0:1, 30:70, 20:50, 7:8].astype(np.uint16)).all()
+
+
+@pytest.mark.parametrize("blending", ["max", "mean"])
+def test_mosaic_negative(tmp_path, blending) -> None:
+    from pySISF import mosaic
+
+    # Three tiles of negative float32 data overlapping around (20, 20, 5)
+    rng = np.random.default_rng(1)
+    tiles = [("a", (0, 0, 0)), ("b", (12, 4, 0)), ("c", (8, 14, 3))]
+    stack = np.full((3, 44, 38, 14), np.nan)
+    for n, (name, offset) in enumerate(tiles):
+        data = -rng.random((32, 24, 11), dtype=np.float32) * 100
+        sisf.create_shard(
+            str(tmp_path / f"{name}.1X.data"), str(tmp_path / f"{name}.1X.meta"), data, (8, 8, 8), 1, progress=False
+        )
+        stack[(n, *(slice(o, o + s) for o, s in zip(offset, data.shape)))] = data
+
+    fname = str(tmp_path / "mosaic.json")
+    mosaic.create_mosaic(fname, [{"name": name, "offset": o} for name, o in tiles], blending=blending)
+    m = mosaic.mosaic(fname)
+
+    count = (~np.isnan(stack)).sum(axis=0)
+    covered = count > 0
+    expected = np.fmax.reduce(stack) if blending == "max" else np.nansum(stack, axis=0) / np.maximum(count, 1)
+    out = np.full((1, *stack.shape[1:]), 5, dtype=np.float32)
+    result = m.read((0, slice(None), slice(None), slice(None)), out=out)[0]
+    assert np.allclose(result[covered], expected[covered], atol=1e-4)
+    assert (result[~covered] == 0).all()
+
+
+def test_histogram(archive, volume) -> None:
+    from pySISF import analysis
+
+    counts, edges = analysis.histogram(archive)
+    assert (counts == np.bincount(volume.ravel())).all() and edges[0] == 0 and len(edges) == volume.max() + 2
+
+    q = [0, 1, 50, 99.5, 100]
+    assert (analysis.percentiles(archive, q) == np.percentile(volume, q, method="inverted_cdf")).all()
+
+    region = ((10, 50), (5, 40), (3, 20))
+    counts, _ = analysis.histogram(archive, bins=10, range=(0, 1000), region=region)
+    assert (counts == np.histogram(volume[10:50, 5:40, 3:20], bins=10, range=(0, 1000))[0]).all()
+
+    # Unit bins (bincount) and other ranges (np.histogram) both count values equal to the upper bound
+    for bins, bounds in [(500, (0, 500)), (300, (200, 500)), (100, (0.5, 100.5))]:
+        counts, _ = analysis.histogram(archive, bins=bins, range=bounds)
+        assert (counts == np.histogram(volume, bins=bins, range=bounds)[0]).all()
+
+    assert analysis.coarsest_scale(archive) == 2
+    counts, _ = analysis.histogram(archive, approximate=True)
+    assert counts.sum() == 35 * 25 * 16
+    counts, _ = analysis.histogram(archive, sample=0.5)
+    assert 0 < counts.sum() < volume.size
+
+
+def test_project(archive, volume) -> None:
+    from pySISF import analysis, sndif_utils
+
+    assert (analysis.project(archive) == volume.max(axis=2)).all()
+    assert (analysis.project(archive, axis=0, mode="sum") == volume.sum(axis=0)).all()
+
+    region = ((10, 50), (5, 40), (3, 20))
+    expected = volume[10:50, 5:40, 3:20].mean(axis=1)
+    assert np.allclose(analysis.project(archive, axis=1, mode="mean", region=region), expected)
+
+    level = np.zeros((35, 25, 16), dtype=np.uint16)
+    sndif_utils.downsample(volume, level)
+    assert (analysis.project(archive, scale=2) == level.max(axis=2)).all()
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_zarr_export(tmp_path, archive, volume, sharded) -> None:
+    import itertools
+    import json
+
+    import zstd
+
+    from pySISF import sndif_utils, zarr_utils
+
+    dst = tmp_path / "archive.ome.zarr"
+    counts = zarr_utils.export_zarr(archive, str(dst), sharded=sharded, progress=False)
+    assert counts == {"copied": 6, "encoded": 18 + 4}
+
+    multiscales = json.loads((dst / "zarr.json").read_text())["attributes"]["ome"]["multiscales"][0]
+    assert [d["path"] for d in multiscales["datasets"]] == ["0", "1"]
+
+    level = np.zeros((35, 25, 16), dtype=np.uint16)
+    sndif_utils.downsample(volume, level)
+
+    for path, expected in [("0", volume), ("1", level)]:
+        meta = json.loads((dst / path / "zarr.json").read_text())
+        assert meta["shape"] == [1, *expected.shape]
+        grid = meta["chunk_grid"]["configuration"]["chunk_shape"][1:]
+        inner = meta["codecs"][0]["configuration"]["chunk_shape"][1:] if sharded else grid
+
+        out = np.zeros([-(-s // c) * c for s, c in zip(expected.shape, grid)], dtype=np.uint16)
+        for key in itertools.product(*(range(-(-s // c)) for s, c in zip(expected.shape, grid))):
+            blob = (dst / path / "c" / "0" / "/".join(map(str, key))).read_bytes()
+            inner_counts = [g // i for g, i in zip(grid, inner)]
+            index = [(0, len(blob))]
+            if sharded:
+                index = np.frombuffer(blob[-16 * np.prod(inner_counts) :], dtype="<u8").reshape(-1, 2)
+            for pos, (offset, size) in zip(itertools.product(*(range(n) for n in inner_counts)), index):
+                if offset == zarr_utils.MISSING_CHUNK:
+                    continue
+                chunk = np.frombuffer(zstd.decompress(blob[offset : offset + size]), dtype=np.uint16).reshape(inner)
+                start = [k * g + p * i for k, g, p, i in zip(key, grid, pos, inner)]
+                out[tuple(slice(s, s + i) for s, i in zip(start, inner))] = chunk
+        assert (out[: expected.shape[0], : expected.shape[1], : expected.shape[2]] == expected).all()
+
+
+def test_rechunk(tmp_path, archive, volume) -> None:
+    from pySISF import metrics, rechunk
+
+    dst = str(tmp_path / "rechunked")
+    metrics.reset()
+    with metrics.trace():
+        out = rechunk.rechunk(archive, dst, chunk_size=(16, 16, 16), compression=4, order="hilbert", progress=False)
+    assert out["shards"] == 2 * 2 and out["bytes_decoded"] == volume.nbytes + 35 * 25 * 16 * 2
+
+    # Every source chunk is decoded once, though the new chunks do not line up with them
+    sources = [archive.get_chunk(i, 0, 0, 0, s) for i in range(2) for s in (1, 2)]
+    assert metrics.stats()["counters"]["chunks_decoded"] == sum(shard.chunk_count for shard in sources)
+
+    rechunked = sisf.sisf(dst)
+    shard = rechunked.get_shard(0, 0, 0, 0, 2)
+    assert shard.chunk_size == (16, 16, 16) and shard.compression_type == 4
+    assert (rechunked[0, :, :, :] == volume).all()
+    assert (shard[:, :, :] == archive.get_shard(0, 0, 0, 0, 2)[:, :, :]).all()
+
+
+def test_read_out(tmp_path, archive, volume) -> None:
+    out = np.lib.format.open_memmap(str(tmp_path / "out.npy"), mode="w+", dtype=np.uint16, shape=(1, *volume.shape))
+    assert archive.read((0, slice(None), slice(None), slice(None)), out=out) is out
+    out.flush()
+    assert (np.load(str(tmp_path / "out.npy")) == volume).all()
+
+    buffer = np.full((1, 20, 30, 5), 7, dtype=np.uint16)
+    archive.read((0, (40, 60), (10, 40), (28, 33)), out=buffer)
+    assert (buffer[0] == volume[40:60, 10:40, 28:33]).all()
+
+    shard = archive.get_shard(1, 0, 0, 0, 1)
+    assert (shard.read((slice(None), 3, (0, 33)), out=np.empty((6, 1, 33), dtype=np.float32)) == volume[64:, 3:4]).all()
+
+    with pytest.raises(ValueError, match="does not match"):
+        archive.read((0, slice(None), slice(None), 0), out=buffer)
+
+    # The 2X level, whose shape comes from the downsampled shards
+    level = np.concatenate([archive.get_shard(i, 0, 0, 0, 2)[:, :, :] for i in range(2)])
+    assert archive.get_shape(2) == (1, *level.shape) == (1, 35, 25, 16)
+    half = np.empty((1, 20, 25, 6), dtype=np.uint16)
+    assert archive.read((0, (15, 35), slice(None), (10, 16)), scale=2, out=half) is half
+    assert (half[0] == level[15:35, :, 10:16]).all()
+
+
+@pytest.fixture
+def vidlib():
+    import shutil
+
+    from pySISF import vidlib
+
+    if shutil.which(vidlib.ffmpeg_exe) is None:
+        pytest.skip("ffmpeg not found")
+    return vidlib
+
+
+def test_vidlib_encode_cleanup(monkeypatch, vidlib) -> None:
+    jobs = []
+    spawn = vidlib.spawn_encoder
+    monkeypatch.setattr(vidlib, "spawn_encoder", lambda command: jobs.append(spawn(command)) or jobs[-1])
+
+    stack = np.random.default_rng(0).integers(0, 255, size=(32, 32, 8), dtype=np.uint8)
+    for _ in range(3):
+        assert len(vidlib.encode_stack(stack))
+
+    # One encoder per stack, each one exited and its pipes closed once the stream is returned
+    assert len(jobs) == 3
+    assert all(job.poll() is not None and job.stdin.closed and job.stdout.closed for job in jobs)
+
+
+@pytest.mark.parametrize("method", ["X264", "X265"])
+def test_vidlib_encode_batch(monkeypatch, vidlib, method) -> None:
+    method = vidlib.EncoderType[method]
+    jobs = []
+    spawn = vidlib.spawn_encoder
+    monkeypatch.setattr(vidlib, "spawn_encoder", lambda command: jobs.append(spawn(command)) or jobs[-1])
+
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(0, 200, 32 * 32 * 8).reshape(32, 32, 8)
+    stacks = [(ramp + rng.integers(0, 10, ramp.shape) + 5 * i).astype(np.uint8) for i in range(5)]
+    stacks.append(stacks[0][:16])  # edge chunk, encoded by a second process
+
+    blobs = vidlib.encode_stacks(stacks, method=method, header=True)
+    assert len(jobs) == 2 < len(stacks)
+    assert all(job.poll() is not None and job.stdin.closed and job.stdout.closed for job in jobs)
+
+    # Every stack decodes on its own, as well as a single-stack encode does
+    for stack, blob in zip(stacks, blobs):
+        decoded = vidlib.decode_stack(blob)
+        single = vidlib.decode_stack(vidlib.encode_stack(stack, method=method, header=True))
+        assert decoded.shape == stack.shape
+        error = np.abs(decoded.astype(int) - stack).mean()
+        assert error < 1.2 * np.abs(single.astype(int) - stack).mean() + 0.5
+    assert all(out.shape == stack.shape for out, stack in zip(vidlib.decode_stacks(blobs), stacks))
+
+
+def test_vidlib_header(vidlib) -> None:
+    rng = np.random.default_rng(0)
+    stacks = [rng.integers(0, 2**16, size=(32, 16, z), dtype=np.uint16) for z in (8, 5)]
+    stacks.append(rng.integers(0, 255, size=(16, 16, 6), dtype=np.uint8))
+
+    # Bare streams stay the default, and decode to uint8 frames given their size
+    bare = vidlib.encode_stack(stacks[2])
+    assert vidlib.parse_blob_header(bare) is None
+    decoded = vidlib.decode_stack(bare, dims=(16, 16))
+    assert decoded.shape == (16, 16, 6) and decoded.dtype == np.uint8
+
+    blobs = [vidlib.encode_stack(stack, header=True) for stack in stacks]
+    shape, dtype, method, payload = vidlib.parse_blob_header(blobs[0])
+    assert (shape, dtype, method) == ((32, 16, 8), np.uint16, vidlib.EncoderType.X264)
+    assert bytes(payload) == bytes(blobs[0][vidlib.BLOB_HEADER_SIZE :])
+
+    decoded = vidlib.decode_stack(blobs[0])
+    assert decoded.shape == (32, 16, 8) and decoded.dtype == np.uint8
+
+    restored = vidlib.decode_stack(blobs[0], restore_dtype=True)
+    assert restored.dtype == np.uint16
+    assert (vidlib.UINT16_LUT[restored] == decoded).all()
+
+    batch = vidlib.decode_stacks(blobs, restore_dtype=True)
+    assert [(a.shape, a.dtype) for a in batch] == [(s.shape, s.dtype) for s in stacks]
+    assert (batch[0] == restored).all()
+
+    with pytest.raises(ValueError, match="header"):
+        vidlib.decode_stacks([bare])